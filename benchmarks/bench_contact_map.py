@@ -0,0 +1,143 @@
+"""
+Benchmark of the contact map reporter of the MD stage. Compares
+molecules.sim.ContactMapReporter against deepdrive.md.ContactMapReporter
+in an OpenMM simulation on the CPU platform, and the contact map
+computation of both for synthetic chains of increasing size.
+
+Example
+-------
+python benchmarks/bench_contact_map.py -n 100 -n 1000 -n 10000
+python benchmarks/bench_contact_map.py --pdb input.pdb --steps 2000 --report 10
+"""
+import os
+import time
+import click
+import tempfile
+import numpy as np
+from scipy.spatial.distance import pdist
+from MDAnalysis.lib.distances import self_distance_array
+from deepdrive.preproc import contact_map_triu
+
+
+def molecules_contact_map(positions):
+    # Contact map computation of molecules.sim.ContactMapReporter
+    return (self_distance_array(positions.astype(np.float32)) < 8.0) * 1.0
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_kernels(num_atoms, repeat):
+    rng = np.random.default_rng(0)
+    print(f'{"atoms":>8} {"molecules (ms)":>15} {"dense (ms)":>11} '
+          f'{"kdtree (ms)":>12} {"fastest":>7} {"speedup":>8}')
+
+    for n in num_atoms:
+        # Random walk with the C-alpha spacing of a protein chain
+        positions = np.cumsum(rng.normal(scale=2.2, size=(n, 3)), axis=0)
+
+        # MDAnalysis computes distances in float32, which may flip
+        # pairs at the cutoff, so check against a float64 reference
+        expected = pack_bits(pdist(positions) < 8.0)
+        for method in ['dense', 'kdtree']:
+            if not np.array_equal(contact_map_triu(positions, method=method, packed=True),
+                                  expected):
+                raise ValueError(f'Contact maps differ for {n} atoms')
+
+        old = best_time(lambda: pack_bits(molecules_contact_map(positions)), repeat)
+        dense = best_time(lambda: contact_map_triu(positions, method='dense',
+                                                   packed=True), repeat)
+        kdtree = best_time(lambda: contact_map_triu(positions, method='kdtree',
+                                                    packed=True), repeat)
+        fastest = 'kdtree' if kdtree < dense else 'dense'
+        print(f'{n:>8} {old * 1e3:>15.2f} {dense * 1e3:>11.2f} {kdtree * 1e3:>12.2f} '
+              f'{fastest:>7} {old / min(dense, kdtree):>7.1f}x')
+
+
+def pack_bits(contact_map):
+    return np.packbits(contact_map > 0)
+
+
+def bench_simulation(pdb_path, steps, report):
+    import parmed as pmd
+    import simtk.unit as u
+    import simtk.openmm as omm
+    import simtk.openmm.app as app
+    import molecules.sim as sim
+    from deepdrive.md import ContactMapReporter
+
+    pdb = pmd.load_file(pdb_path)
+    forcefield = app.ForceField('amber99sbildn.xml', 'amber99_obc.xml')
+    system = forcefield.createSystem(pdb.topology, nonbondedMethod=app.CutoffNonPeriodic,
+                                     nonbondedCutoff=1.0*u.nanometer, constraints=app.HBonds)
+    platform = omm.Platform.getPlatformByName('CPU')
+
+    reporters = {'none': None,
+                 'molecules': sim.ContactMapReporter,
+                 'deepdrive': ContactMapReporter}
+
+    print(f'{"reporter":>10} {"steps":>8} {"reports":>8} {"time (s)":>10} '
+          f'{"per report (ms)":>16} {"file (KB)":>10}')
+
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, reporter in reporters.items():
+            integrator = omm.LangevinIntegrator(300*u.kelvin, 91.0/u.picosecond,
+                                                0.002*u.picoseconds)
+            simulation = app.Simulation(pdb.topology, system, integrator, platform)
+            simulation.context.setPositions(pdb.positions)
+            simulation.context.setVelocitiesToTemperature(300*u.kelvin, 1)
+
+            path = os.path.join(tmp_dir, f'output-cm-{name}.h5')
+            if reporter:
+                simulation.reporters.append(reporter(path, report))
+
+            start = time.perf_counter()
+            simulation.step(steps)
+            elapsed = time.perf_counter() - start
+
+            if reporter:
+                # Close the h5 file
+                del simulation.reporters[:]
+                size = os.path.getsize(path) / 2**10
+            else:
+                baseline, size = elapsed, 0
+
+            per_report = (elapsed - baseline) / (steps // report) * 1e3
+            print(f'{name:>10} {steps:>8} {steps // report:>8} {elapsed:>10.3f} '
+                  f'{per_report:>16.3f} {size:>10.0f}')
+
+
+@click.command()
+@click.option('-n', '--num_atoms', multiple=True, type=int,
+              default=[100, 500, 1000, 5000],
+              help='Number of selected atoms of the synthetic chains')
+
+@click.option('-r', '--repeat', default=5, type=int,
+              help='Number of timed repetitions (best is reported)')
+
+@click.option('-p', '--pdb', 'pdb_path', default=None,
+              type=click.Path(exists=True),
+              help='PDB file to simulate on the CPU platform with each reporter')
+
+@click.option('-s', '--steps', default=1000, type=int,
+              help='Number of simulation steps')
+
+@click.option('-R', '--report', default=10, type=int,
+              help='Number of steps between reports')
+
+def main(num_atoms, repeat, pdb_path, steps, report):
+    bench_kernels(num_atoms, repeat)
+    if pdb_path:
+        print()
+        bench_simulation(pdb_path, steps, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark of the outlier detection engines of the outlier stage on
+synthetic latent space embeddings. Compares the runtime of OPTICS
+clustering with kNN index based local outlier factor and k-distance
+scoring, and the overlap of the selected outliers. The kNN engines
+select as many outliers as OPTICS labels as noise.
+
+OPTICS is quadratic in practice, so it is skipped above --optics_max
+points; raise it to compare at 1M points given enough time.
+
+Example
+-------
+python benchmarks/bench_outliers.py -n 10000 -n 100000 -n 1000000 -w 8
+"""
+import time
+import click
+import numpy as np
+from molecules.ml.unsupervised.cluster import optics_clustering
+from deepdrive.outlier import knn_outlier_scores, top_outliers
+
+
+def synthetic_embeddings(num_points, latent_dim, num_clusters=10,
+                         outlier_fraction=0.01, seed=0):
+    """Gaussian clusters in latent space plus uniformly scattered points."""
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(-5, 5, size=(num_clusters, latent_dim))
+    num_scattered = int(outlier_fraction * num_points)
+    labels = rng.randint(num_clusters, size=num_points - num_scattered)
+    clustered = centers[labels] + 0.5 * rng.randn(len(labels), latent_dim)
+    scattered = rng.uniform(-8, 8, size=(num_scattered, latent_dim))
+    data = np.concatenate([clustered, scattered]).astype(np.float32)
+    return data[rng.permutation(num_points)]
+
+
+def overlap(a, b):
+    """Fraction of b also found in a."""
+    return len(np.intersect1d(a, b)) / max(len(b), 1)
+
+
+@click.command()
+@click.option('-n', '--num_points', multiple=True, type=int,
+              default=[10000, 100000, 1000000],
+              help='Number of embeddings')
+
+@click.option('-d', '--latent_dim', default=3, type=int,
+              help='Dimension of the latent space')
+
+@click.option('-m', '--min_samples', default=10, type=int,
+              help='min_samples of OPTICS')
+
+@click.option('-k', '--n_neighbors', default=20, type=int,
+              help='Number of neighbors of the kNN engines')
+
+@click.option('-o', '--num_outliers', default=500, type=int,
+              help='Number of outliers selected when OPTICS is skipped')
+
+@click.option('-w', '--num_workers', default=1, type=int,
+              help='Number of threads querying the kNN index')
+
+@click.option('--optics_max', default=100000, type=int,
+              help='Skip OPTICS above this many points')
+
+def main(num_points, latent_dim, min_samples, n_neighbors, num_outliers,
+         num_workers, optics_max):
+    print(f'{"points":>8} {"engine":>8} {"time (s)":>10} '
+          f'{"outliers":>9} {"overlap":>8}')
+
+    for n in num_points:
+        data = synthetic_embeddings(n, latent_dim)
+
+        optics_inds = None
+        if n <= optics_max:
+            start = time.perf_counter()
+            optics_inds, _ = optics_clustering(data, min_samples)
+            elapsed = time.perf_counter() - start
+            print(f'{n:>8} {"optics":>8} {elapsed:>10.2f} {len(optics_inds):>9} {"-":>8}')
+        else:
+            print(f'{n:>8} {"optics":>8} {"skipped":>10}')
+
+        count = len(optics_inds) if optics_inds is not None else num_outliers
+        for method in ('lof', 'kdist'):
+            start = time.perf_counter()
+            scores = knn_outlier_scores(data, k=n_neighbors, method=method,
+                                        num_workers=num_workers)
+            inds = top_outliers(scores, count)
+            elapsed = time.perf_counter() - start
+            match = f'{overlap(inds, optics_inds):>8.2f}' \
+                    if optics_inds is not None else f'{"-":>8}'
+            print(f'{n:>8} {method:>8} {elapsed:>10.2f} {len(inds):>9} {match}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Microbenchmark of the upper triangle to full contact map expansion
+used by the preprocessing stage. Compares the per-frame
+molecules.utils.triu_to_full + np.pad path against
+deepdrive.preproc.triu_to_full_batch.
+
+Example
+-------
+python benchmarks/bench_triu_to_full.py -n 22 -n 100 -f 10000
+"""
+import time
+import click
+import numpy as np
+from molecules.utils import triu_to_full
+from deepdrive.preproc import triu_to_full_batch
+
+
+def per_frame_path(cm_batch):
+    # Previous implementation of deepdrive.preproc.cm_to_cvae
+    cm_data_full = np.array(list(map(triu_to_full, cm_batch)))
+    pad_f = lambda x: (0,0) if x % 2 == 0 else (0,1)
+    padding_buffer = [(0,0)]
+    for x in cm_data_full.shape[1:]:
+        padding_buffer.append(pad_f(x))
+    return np.pad(cm_data_full, padding_buffer, mode='constant')
+
+
+def batched_path(cm_batch):
+    return triu_to_full_batch(cm_batch)
+
+
+def best_time(func, data, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+@click.command()
+@click.option('-n', '--num_residues', multiple=True, type=int,
+              default=[22, 100, 200],
+              help='Number of residues per contact map')
+
+@click.option('-f', '--frames', default=1000, type=int,
+              help='Number of frames per batch')
+
+@click.option('-r', '--repeat', default=3, type=int,
+              help='Number of timed repetitions (best is reported)')
+
+def main(num_residues, frames, repeat):
+    rng = np.random.default_rng(0)
+    print(f'{"residues":>8} {"frames":>8} {"per-frame (s)":>14} '
+          f'{"batched (s)":>12} {"speedup":>8}')
+
+    for num_res in num_residues:
+        triu_len = num_res * (num_res - 1) // 2
+        cm_batch = (rng.random((frames, triu_len)) < 0.3).astype(np.float32)
+
+        if not np.array_equal(per_frame_path(cm_batch), batched_path(cm_batch)):
+            raise ValueError(f'Outputs differ for {num_res} residues')
+
+        old = best_time(per_frame_path, cm_batch, repeat)
+        new = best_time(batched_path, cm_batch, repeat)
+        print(f'{num_res:>8} {frames:>8} {old:>14.4f} {new:>12.4f} {old / new:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""
+Benchmark suite of the hot paths of a DeepDriveMD iteration on
+synthetic data: contact map preprocessing, embedding, outlier
+detection and outlier PDB extraction. Runs on a CPU-only machine
+without any services.
+
+Input data is generated before each case. Every case then runs in a
+fresh process, so its peak RSS is not inflated by data generation or
+previous cases. Results can be saved and compared against a baseline
+to catch regressions.
+
+Example
+-------
+python benchmarks/suite.py -f 1000 -f 100000 -r 20 -r 200 -o results.json
+python benchmarks/suite.py -f 1000 -f 100000 -r 20 -r 200 -b results.json
+"""
+import os
+import sys
+import json
+import time
+import click
+import resource
+import tempfile
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'examples', 'cvae_dbscan', 'scripts')
+
+import synthetic
+
+NUM_SIMS = 4
+
+
+class StandInHyperparams:
+    """Hyperparameters of StandInEncoder, replacing EncoderHyperparams.load."""
+    latent_dim = 3
+
+    @classmethod
+    def load(cls, path):
+        return cls()
+
+
+class StandInEncoder:
+    """
+    Tiny encoder with the interface of EncoderConvolution2D, embedding
+    contact maps with a fixed random projection, so generate_embeddings
+    can be benchmarked without a trained model or a GPU.
+
+    """
+    def __init__(self, input_shape, hyperparameters):
+        rng = np.random.default_rng(0)
+        self.weights = rng.standard_normal((int(np.prod(input_shape)),
+                                            hyperparameters.latent_dim))
+
+    def load_weights(self, path):
+        pass
+
+    def embed(self, data):
+        z = data.reshape(len(data), -1) @ self.weights
+        return z, z
+
+
+# Each case has a setup, run in the parent process to generate its input
+# files, and a prepare function run in a fresh child process. prepare
+# does the imports and returns the function that is timed.
+
+def setup_contact_maps(tmp_dir, num_frames, num_residues):
+    sim_path = os.path.join(tmp_dir, 'md')
+    synthetic.write_sim_contact_maps(sim_path, NUM_SIMS, num_frames, num_residues)
+    return {'sim_path': sim_path, 'out_path': tmp_dir}
+
+
+def setup_cvae_input(tmp_dir, num_frames, num_residues):
+    import h5py
+    from deepdrive.preproc import stream_cm_to_cvae
+
+    kwargs = setup_contact_maps(tmp_dir, num_frames, num_residues)
+    cm_path = os.path.join(tmp_dir, 'cvae-input.h5')
+    files = [h5py.File(os.path.join(kwargs['sim_path'], f'output-cm-{i}.h5'), 'r')
+             for i in range(NUM_SIMS)]
+    with h5py.File(cm_path, 'w') as out:
+        stream_cm_to_cvae([file['contact_maps'] for file in files], out)
+    for file in files:
+        file.close()
+    return {'cm_path': cm_path}
+
+
+def setup_embeddings(tmp_dir, num_frames, num_residues):
+    embed_path = os.path.join(tmp_dir, 'embeddings.npy')
+    np.save(embed_path, synthetic.random_embeddings(num_frames))
+    return {'embed_path': embed_path}
+
+
+def setup_trajectories(tmp_dir, num_frames, num_residues):
+    from deepdrive.preproc import FrameIndex
+
+    sim_path = os.path.join(tmp_dir, 'md')
+    frames_per_sim = max(num_frames // NUM_SIMS, 1)
+    frame_index = FrameIndex()
+    for pdb_path, dcd_path in synthetic.write_sim_trajectories(
+            sim_path, NUM_SIMS, frames_per_sim, num_residues):
+        frame_index.append(dcd_path, pdb_path, 0, frames_per_sim)
+
+    index_path = os.path.join(tmp_dir, 'cvae-input-index.npz')
+    frame_index.save(index_path)
+
+    shared_path = os.path.join(tmp_dir, 'shared')
+    os.makedirs(shared_path)
+
+    # 1% of the frames are outliers, as typical for the outlier stage
+    num_outliers = min(max(len(frame_index) // 100, 10), len(frame_index))
+    rng = np.random.default_rng(0)
+    inds = rng.choice(len(frame_index), num_outliers, replace=False)
+    return {'index_path': index_path, 'shared_path': shared_path,
+            'outlier_inds': inds.tolist()}
+
+
+def prepare_cm_to_cvae(sim_path, out_path):
+    import h5py
+    from deepdrive.preproc import cm_to_cvae
+
+    def run():
+        files = [h5py.File(os.path.join(sim_path, f'output-cm-{i}.h5'), 'r')
+                 for i in range(NUM_SIMS)]
+        cm_to_cvae([file['contact_maps'] for file in files])
+        for file in files:
+            file.close()
+    return run
+
+
+def prepare_contact_map_script(sim_path, out_path, *args):
+    sys.path.insert(0, SCRIPTS_PATH)
+    import contact_map
+    return lambda: contact_map.main(['--sim_path', sim_path, '--out', out_path, *args],
+                                    standalone_mode=False)
+
+
+def prepare_contact_map_stream(sim_path, out_path):
+    return prepare_contact_map_script(sim_path, out_path, '--stream')
+
+
+def prepare_contact_map_packed(sim_path, out_path):
+    return prepare_contact_map_script(sim_path, out_path, '--packed')
+
+
+def prepare_generate_embeddings(cm_path):
+    sys.path.insert(0, SCRIPTS_PATH)
+    import dbscan
+    # dbscan imports the encoder on first use
+    import molecules.ml.unsupervised as unsupervised
+    unsupervised.EncoderHyperparams = StandInHyperparams
+    unsupervised.EncoderConvolution2D = StandInEncoder
+    return lambda: dbscan.generate_embeddings('hparams', 'weights', cm_path)
+
+
+def prepare_optics(embed_path):
+    from molecules.ml.unsupervised.cluster import optics_clustering
+    return lambda: optics_clustering(np.load(embed_path), 10)
+
+
+def prepare_knn_lof(embed_path):
+    from deepdrive.outlier import knn_outlier_scores, top_outliers
+    return lambda: top_outliers(knn_outlier_scores(np.load(embed_path), k=20), 500)
+
+
+def prepare_write_rewarded_pdbs(index_path, shared_path, outlier_inds):
+    sys.path.insert(0, SCRIPTS_PATH)
+    import dbscan
+    from deepdrive.preproc import FrameIndex
+    return lambda: dbscan.write_rewarded_pdbs(outlier_inds, FrameIndex.load(index_path),
+                                              shared_path)
+
+
+# Name: (setup, prepare, whether the case depends on the number of residues)
+CASES = {
+    'cm_to_cvae': (setup_contact_maps, prepare_cm_to_cvae, True),
+    'contact_map_stream': (setup_contact_maps, prepare_contact_map_stream, True),
+    'contact_map_packed': (setup_contact_maps, prepare_contact_map_packed, True),
+    'generate_embeddings': (setup_cvae_input, prepare_generate_embeddings, True),
+    'optics': (setup_embeddings, prepare_optics, False),
+    'knn_lof': (setup_embeddings, prepare_knn_lof, False),
+    'write_rewarded_pdbs': (setup_trajectories, prepare_write_rewarded_pdbs, True),
+}
+
+
+def measure(case, kwargs):
+    """
+    Runs in a fresh process.
+
+    Returns
+    -------
+    tuple of (seconds, peak RSS in bytes, RSS after imports in bytes)
+
+    """
+    run = CASES[case][1](**kwargs)
+    # ru_maxrss is in kilobytes on Linux
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return elapsed, peak_rss, base_rss
+
+
+def run_case(case, num_frames, num_residues):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        kwargs = CASES[case][0](tmp_dir, num_frames, num_residues)
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=mp.get_context('spawn')) as executor:
+            elapsed, peak_rss, base_rss = executor.submit(measure, case, kwargs).result()
+
+    return {'case': case, 'frames': num_frames, 'residues': num_residues,
+            'time': elapsed, 'peak_rss': peak_rss, 'base_rss': base_rss}
+
+
+@click.command()
+@click.option('-c', '--case', 'cases', multiple=True,
+              type=click.Choice(list(CASES)), default=list(CASES),
+              help='Cases to run, defaults to all')
+
+@click.option('-f', '--frames', multiple=True, type=int,
+              default=[1000, 10000],
+              help='Total number of frames, from 1k to 1M')
+
+@click.option('-r', '--residues', multiple=True, type=int,
+              default=[20, 100],
+              help='Number of residues, from 20 to 500')
+
+@click.option('-o', '--out', 'out_path', default=None,
+              type=click.Path(),
+              help='JSON file to save the results in')
+
+@click.option('-b', '--baseline', 'baseline_path', default=None,
+              type=click.Path(exists=True),
+              help='JSON file of earlier results to compare against')
+
+@click.option('-t', '--tolerance', default=1.2, type=float,
+              help='Ratio to the baseline time or peak RSS reported '
+                   'as a regression')
+
+def main(cases, frames, residues, out_path, baseline_path, tolerance):
+    baseline = {}
+    if baseline_path:
+        with open(baseline_path) as file:
+            baseline = {(r['case'], r['frames'], r['residues']): r
+                        for r in json.load(file)}
+
+    print(f'{"case":>20} {"frames":>8} {"residues":>8} {"time (s)":>10} '
+          f'{"peak RSS (MB)":>14} {"vs baseline":>12}')
+
+    results = []
+    for case in cases:
+        for num_frames in frames:
+            for num_residues in (residues if CASES[case][2] else residues[:1]):
+                try:
+                    result = run_case(case, num_frames, num_residues)
+                except Exception as e:
+                    print(f'{case:>20} {num_frames:>8} {num_residues:>8} '
+                          f'failed: {type(e).__name__}: {e}')
+                    continue
+                results.append(result)
+
+                compare = ''
+                base = baseline.get((case, num_frames, num_residues))
+                if base:
+                    time_ratio = result['time'] / base['time']
+                    rss_ratio = result['peak_rss'] / base['peak_rss']
+                    compare = f'{time_ratio:.2f}x {rss_ratio:.2f}x'
+                    if time_ratio > tolerance or rss_ratio > tolerance:
+                        compare += ' REGRESSION'
+
+                print(f'{case:>20} {num_frames:>8} {num_residues:>8} '
+                      f'{result["time"]:>10.3f} {result["peak_rss"] / 2**20:>14.0f} '
+                      f'{compare:>12}')
+
+    if out_path:
+        with open(out_path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
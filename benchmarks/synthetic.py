@@ -0,0 +1,102 @@
+"""
+Synthetic data generators for the benchmarks, writing files in the
+layouts produced by the MD stage: output-cm-<id>.h5 contact maps and
+input-<id>.pdb / output-<id>.dcd trajectories.
+"""
+import os
+import h5py
+import numpy as np
+
+
+def write_contact_maps(path, num_frames, num_residues, density=0.1,
+                       chunk_size=4096, seed=0):
+    """
+    Write random contact maps in the layout of the molecules
+    ContactMapReporter: a float32 'contact_maps' dataset of shape
+    (triu_len, num_frames) holding the strict upper triangle of
+    each frame. Frames are generated chunk_size at a time.
+
+    """
+    rng = np.random.default_rng(seed)
+    triu_len = num_residues * (num_residues - 1) // 2
+    with h5py.File(path, 'w') as file:
+        dset = file.create_dataset('contact_maps', (triu_len, num_frames),
+                                   dtype=np.float32)
+        for start in range(0, num_frames, chunk_size):
+            stop = min(start + chunk_size, num_frames)
+            batch = rng.random((triu_len, stop - start), dtype=np.float32) < density
+            dset[:, start:stop] = batch
+    return path
+
+
+def write_sim_contact_maps(sim_path, num_sims, num_frames, num_residues,
+                           density=0.1, seed=0):
+    """
+    Write num_frames frames split evenly over num_sims output-cm-<id>.h5
+    files in sim_path.
+
+    Returns
+    -------
+    list of written file paths
+
+    """
+    os.makedirs(sim_path, exist_ok=True)
+    counts = np.diff(np.linspace(0, num_frames, num_sims + 1).astype(int))
+    return [write_contact_maps(os.path.join(sim_path, f'output-cm-{i}.h5'),
+                               int(count), num_residues, density, seed=seed + i)
+            for i, count in enumerate(counts)]
+
+
+def write_trajectory(pdb_path, dcd_path, num_residues, num_frames, seed=0):
+    """
+    Write a chain of num_residues CA atoms as a PDB file and a random
+    walk of it over num_frames frames as a DCD trajectory.
+
+    """
+    import MDAnalysis as mda
+
+    u = mda.Universe.empty(num_residues, n_residues=num_residues,
+                           atom_resindex=np.arange(num_residues),
+                           trajectory=True)
+    u.add_TopologyAttr('names', ['CA'] * num_residues)
+    u.add_TopologyAttr('resnames', ['ALA'] * num_residues)
+    u.add_TopologyAttr('resids', np.arange(1, num_residues + 1))
+
+    rng = np.random.default_rng(seed)
+    positions = np.cumsum(rng.normal(scale=2.2, size=(num_residues, 3)), axis=0)
+    u.atoms.positions = positions
+    u.atoms.write(pdb_path)
+
+    with mda.Writer(dcd_path, num_residues) as writer:
+        for _ in range(num_frames):
+            positions = positions + rng.normal(scale=0.1, size=positions.shape)
+            u.atoms.positions = positions
+            writer.write(u.atoms)
+
+    return pdb_path, dcd_path
+
+
+def write_sim_trajectories(sim_path, num_sims, num_frames, num_residues, seed=0):
+    """
+    Write num_sims input-<id>.pdb and output-<id>.dcd files in sim_path
+    with num_frames frames each.
+
+    Returns
+    -------
+    list of (pdb_path, dcd_path) tuples
+
+    """
+    os.makedirs(sim_path, exist_ok=True)
+    return [write_trajectory(os.path.join(sim_path, f'input-{i}.pdb'),
+                             os.path.join(sim_path, f'output-{i}.dcd'),
+                             num_residues, num_frames, seed=seed + i)
+            for i in range(num_sims)]
+
+
+def random_embeddings(num_frames, latent_dim=3, num_clusters=10, seed=0):
+    """Latent space embeddings drawn from a mixture of Gaussians."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-5, 5, size=(num_clusters, latent_dim))
+    labels = rng.integers(num_clusters, size=num_frames)
+    return (centers[labels] +
+            0.5 * rng.standard_normal((num_frames, latent_dim))).astype(np.float32)
@@ -1,6 +1,8 @@
 import os
+import json
+import time
 from collections import namedtuple
-from radical.entk import Pipeline, Stage, Task, AppManager
+from radical.entk import Pipeline, Stage, Task
 
 
 class DeepDriveMD:
@@ -11,7 +13,8 @@ class DeepDriveMD:
     def __init__(self, md_sims, preprocs, ml_algs, outlier_algs, resources,
                  max_iter=1, pipeline_name='MD_ML', md_stage_name='MD',
                  pre_stage_name='Preprocess', ml_stage_name='ML',
-                 outlier_stage_name='Outlier'):
+                 outlier_stage_name='Outlier', async_mode=False,
+                 max_staleness=1, backend='entk', profile_dir=None):
 
         """
         Parameters
@@ -53,9 +56,37 @@ class DeepDriveMD:
         outlier_stage_name : str
             Name of outlier detection stage
 
+        async_mode : bool
+            If True, run MD and preprocessing in one pipeline and ML and
+            outlier detection in a second, concurrent pipeline, so that
+            MD of iteration i+1 overlaps with the analysis of iteration i.
+            MD is seeded from the newest outliers available. If False,
+            all stages of an iteration run serially in one pipeline.
+
+        max_staleness : int
+            In async_mode, the number of iterations the outliers seeding
+            an MD stage may lag behind. MD of iteration i may start once
+            outliers of iteration i - 1 - max_staleness are available,
+            otherwise the MD pipeline is suspended until they are.
+
+        backend : str
+            'entk' to run on the EnTK AppManager, which requires the
+            RabbitMQ and MongoDB services, or 'local' to run tasks as
+            subprocesses on the local node, see deepdrive.local
+
+        profile_dir : str
+            If given, record the submit and end time of every stage in
+            <profile_dir>/stages.json and have every task save its
+            deepdrive.utils.profiling.TaskProfiler record below
+            <profile_dir>/pipeline-<id>
+
         """
+        if backend not in ('entk', 'local'):
+            raise ValueError(f'Invalid backend {backend}, expected entk or local')
+
         # Checks environment variables are set
-        self._validate_environment()
+        if backend == 'entk':
+            self._validate_environment()
 
         # Number of iterations through the pipeline
         self.current_iter = 0
@@ -70,23 +101,40 @@ class DeepDriveMD:
                        'ml': StageData(ml_stage_name, ml_algs),
                        'outlier': StageData(outlier_stage_name, outlier_algs)}
 
-        # Initialize pipeline
-        self.__pipeline = Pipeline()
-        self.__pipeline.name = pipeline_name
+        self.profile_dir = profile_dir
+        self.stage_records = []
+
+        self.async_mode = async_mode
+        self.max_staleness = max_staleness
+
+        if async_mode:
+            # Sets stages of the concurrent MD and analysis pipelines
+            workflow = self._async_pipelines(pipeline_name)
+        else:
+            # Initialize pipeline
+            self.__pipeline = Pipeline()
+            self.__pipeline.name = pipeline_name
+
+            # Sets pipeline stages
+            self._pipeline()
 
-        # Sets pipeline stages
-        self._pipeline()
+            workflow = {self.__pipeline}
 
         # Create Application Manager
-        self.appman = AppManager(hostname=os.environ.get('RMQ_HOSTNAME'),
-                                 port=int(os.environ.get('RMQ_PORT')))
+        if backend == 'local':
+            from deepdrive.local import LocalAppManager
+            self.appman = LocalAppManager()
+        else:
+            from radical.entk import AppManager
+            self.appman = AppManager(hostname=os.environ.get('RMQ_HOSTNAME'),
+                                     port=int(os.environ.get('RMQ_PORT')))
 
         # Assign hardware resources to application
         self.appman.resource_desc = resources
 
         # Assign the workflow as a set of Pipelines to the Application Manager. In
         # this way, all the pipelines in the set will execute concurrently.
-        self.appman.workflow = {self.__pipeline}
+        self.appman.workflow = workflow
 
     def run(self):
         """
@@ -109,19 +157,66 @@ class DeepDriveMD:
             if not os.environ.get(envar):
                 raise Exception(f'{envar} environment variable not set')
         
-    def _generate_stage(self, stage_type):
+    def _generate_stage(self, stage_type, pipeline_id=None, post_exec=None):
         """
         Parameters
         ----------
         stage_type : str
             key into self.stages dictionary to retrieve stage name and taskmanagers.
+
+        pipeline_id : int
+            iteration the stage belongs to, defaults to self.current_iter
+
+        post_exec : callable
+            called when the stage completes. It returns the uids of the
+            pipelines it resumed, which EnTK needs to advance them.
         """
+        if pipeline_id is None:
+            pipeline_id = self.current_iter
         stage = Stage()
         stage.name = self.stages[stage_type].name
         for taskman in self.stages[stage_type].taskmanagers:
-            stage.add_tasks(set(taskman.tasks(self.current_iter)))
+            tasks = set(taskman.tasks(pipeline_id))
+            if self.profile_dir:
+                for task in tasks:
+                    self._profile_task(task, stage.name, pipeline_id)
+            stage.add_tasks(tasks)
+
+        if self.profile_dir:
+            record = {'pipeline_id': pipeline_id, 'stage': stage.name,
+                      'submit': time.time(), 'end': None,
+                      'tasks': [task.uid for task in stage.tasks]}
+            stage.post_exec = lambda: self._stage_done(record, post_exec)
+        elif post_exec:
+            stage.post_exec = post_exec
+
         return stage
 
+    def _profile_task(self, task, stage_name, pipeline_id):
+        """Export the profiling environment of TaskProfiler in pre_exec."""
+        profile_dir = os.path.join(self.profile_dir, f'pipeline-{pipeline_id}')
+        task.pre_exec = [f'export DEEPDRIVE_TASK_START=$(date +%s.%N)',
+                         f'mkdir -p {profile_dir}',
+                         f'export DEEPDRIVE_PROFILE_DIR={profile_dir}',
+                         f'export DEEPDRIVE_TASK_UID={task.uid}',
+                         f'export DEEPDRIVE_STAGE={stage_name}',
+                         f'export DEEPDRIVE_PIPELINE_ID={pipeline_id}'] + \
+                        list(task.pre_exec) + \
+                        [f'export DEEPDRIVE_EXEC_START=$(date +%s.%N)']
+
+    def _stage_done(self, record, post_exec=None):
+        record['end'] = time.time()
+        self.stage_records.append(record)
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, 'stages.json')
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(self.stage_records, file)
+        os.replace(f'{path}.tmp', path)
+
+        if post_exec:
+            return post_exec()
+
     def _condition(self):
         if self.current_iter < self.max_iter:
             self._pipeline()
@@ -142,11 +237,141 @@ class DeepDriveMD:
             self.__pipeline.add_stages(self._generate_stage(stage_type))
 
         # Generate last stage seperate to add post execution step
-        last_stage = self._generate_stage('outlier')
-
-        # Set post execution for last stage
-        last_stage.post_exec = self._condition
+        last_stage = self._generate_stage('outlier', post_exec=self._condition)
 
         self.current_iter += 1
 
         self.__pipeline.add_stages(last_stage)
+
+    def _async_pipelines(self, pipeline_name):
+        """
+        Creates the MD and analysis pipelines of async_mode.
+
+        The MD pipeline runs MD and preprocessing stages. When the
+        preprocessing of iteration i completes, the data is handed to
+        the analysis pipeline and MD of iteration i+1 is scheduled if the
+        available outliers are fresh enough. The analysis pipeline runs
+        ML and outlier stages on the newest preprocessed iteration,
+        skipping iterations superseded while it was busy. Either pipeline
+        is suspended while it waits for the other. The stage post_exec
+        callbacks resuming a pipeline return its uid, as the EnTK
+        AppManager only advances the resumed pipelines it is told of.
+
+        Returns
+        -------
+        set of both pipelines
+
+        """
+        self.__md_pipeline = Pipeline()
+        self.__md_pipeline.name = f'{pipeline_name}.md'
+
+        self.__analysis_pipeline = Pipeline()
+        self.__analysis_pipeline.name = f'{pipeline_name}.analysis'
+
+        # Iterations preprocessed and waiting to be analyzed
+        self.ready_iters = []
+        # Iteration currently analyzed, if any
+        self.analysis_iter = None
+        # Newest iteration with outliers, -1 for the initial PDB files
+        self.outlier_iter = -1
+        # Next MD iteration, waiting for fresh outliers if md_waiting
+        self.next_md_iter = 0
+        self.md_waiting = False
+        self.md_finished = False
+        self.analysis_waiting = False
+
+        self._add_md_stages(0)
+
+        # A pipeline needs a stage to start with. The analysis pipeline
+        # runs a no-op stage and suspends until data is preprocessed.
+        idle_task = Task()
+        idle_task.executable = ['/bin/true']
+        idle_stage = Stage()
+        idle_stage.name = 'Idle'
+        idle_stage.add_tasks(idle_task)
+        idle_stage.post_exec = self._analysis_idle
+        self.__analysis_pipeline.add_stages(idle_stage)
+
+        return {self.__md_pipeline, self.__analysis_pipeline}
+
+    def _is_fresh(self, pipeline_id):
+        """Whether outliers are fresh enough to seed MD of pipeline_id."""
+        return pipeline_id - 1 - self.outlier_iter <= self.max_staleness
+
+    def _add_md_stages(self, pipeline_id):
+        self.current_iter = pipeline_id
+        self.__md_pipeline.add_stages(self._generate_stage('md', pipeline_id))
+        pre_stage = self._generate_stage('preprocess', pipeline_id,
+                                         lambda: self._md_done(pipeline_id))
+        self.__md_pipeline.add_stages(pre_stage)
+
+    def _md_done(self, pipeline_id):
+        print(f'Finished MD iteration {pipeline_id + 1} of {self.max_iter}')
+        self.ready_iters.append(pipeline_id)
+        resumed = []
+        if self.analysis_iter is None:
+            resumed = self._start_analysis()
+
+        self.next_md_iter = pipeline_id + 1
+        if self.next_md_iter >= self.max_iter:
+            self.md_finished = True
+        elif self._is_fresh(self.next_md_iter):
+            self._add_md_stages(self.next_md_iter)
+        else:
+            print(f'MD iteration {self.next_md_iter + 1} waits for outliers')
+            self.md_waiting = True
+            self.__md_pipeline.suspend()
+
+        return resumed
+
+    def _start_analysis(self):
+        """
+        Returns
+        -------
+        list of the uids of the pipelines resumed
+
+        """
+        # Analyze the newest data, older iterations are superseded
+        pipeline_id = self.ready_iters[-1]
+        if len(self.ready_iters) > 1:
+            print(f'Skipping analysis of iterations {self.ready_iters[:-1]}')
+        self.ready_iters = []
+        self.analysis_iter = pipeline_id
+
+        self.__analysis_pipeline.add_stages(self._generate_stage('ml', pipeline_id))
+        outlier_stage = self._generate_stage('outlier', pipeline_id,
+                                             self._analysis_done)
+        self.__analysis_pipeline.add_stages(outlier_stage)
+
+        if self.analysis_waiting:
+            self.analysis_waiting = False
+            self.__analysis_pipeline.resume()
+            return [self.__analysis_pipeline.uid]
+        return []
+
+    def _analysis_idle(self):
+        if self.analysis_iter is None:
+            self.analysis_waiting = True
+            self.__analysis_pipeline.suspend()
+        return []
+
+    def _analysis_done(self):
+        print(f'Finished analysis of iteration {self.analysis_iter + 1} of {self.max_iter}')
+        self.outlier_iter = self.analysis_iter
+        self.analysis_iter = None
+
+        resumed = []
+        if self.md_waiting and self._is_fresh(self.next_md_iter):
+            self.md_waiting = False
+            self._add_md_stages(self.next_md_iter)
+            self.__md_pipeline.resume()
+            resumed.append(self.__md_pipeline.uid)
+
+        if self.ready_iters:
+            resumed.extend(self._start_analysis())
+        elif not self.md_finished:
+            self._analysis_idle()
+        else:
+            print('Done')
+
+        return resumed
@@ -0,0 +1,165 @@
+import os
+import ast
+import time
+import shlex
+import subprocess
+from collections import deque
+from radical.entk import states
+
+
+class LocalAppManager:
+    """
+    Runs a DeepDriveMD workflow on the local node without the
+    RabbitMQ, MongoDB and radical.pilot services of EnTK.
+
+    Drop-in replacement of radical.entk.AppManager for the workflows
+    built by DeepDriveMD: pipelines run concurrently, the stages of a
+    pipeline run in order, and stage post_exec callbacks may add stages
+    to, suspend or resume pipelines. The tasks of a stage are launched
+    as bash subprocesses running their pre_exec commands, executable
+    and post_exec commands, as many at a time as the cores of the node
+    allow given the cpu_reqs of each task.
+
+    Example
+    -------
+    appman = LocalAppManager(cores=8)
+    appman.workflow = {pipeline}
+    appman.run()
+
+    """
+    def __init__(self, cores=None, workdir=None, poll_interval=0.005):
+        """
+        Parameters
+        ----------
+        cores : int
+            number of cores tasks may use at once. Defaults to
+            resource_desc['cpus'] if set, otherwise all cores.
+
+        workdir : str
+            directory of the task stdout and stderr files, defaults
+            to ./local-tasks
+
+        poll_interval : float
+            seconds between checks for finished tasks
+
+        """
+        self.cores = cores
+        self.workdir = workdir or os.path.join(os.getcwd(), 'local-tasks')
+        self.poll_interval = poll_interval
+        self.resource_desc = {}
+        self.workflow = set()
+
+    def run(self):
+        """
+        Runs all pipelines of the workflow until they are done, failed
+        or suspended with no task left to resume them.
+
+        """
+        cores = self.cores or self.resource_desc.get('cpus') or os.cpu_count()
+        os.makedirs(self.workdir, exist_ok=True)
+
+        pipelines = sorted(self.workflow, key=lambda pipeline: pipeline.name or '')
+        # Index of the current stage of each pipeline
+        current = {pipeline.uid: 0 for pipeline in pipelines}
+        # Tasks of the current stage of each pipeline not yet launched
+        pending = {}
+        # Number of tasks of the current stage of each pipeline still running
+        running_count = {}
+        failed = set()
+        running = []
+        free = cores
+
+        while True:
+            # Queue the tasks of stages that became current
+            for pipeline in pipelines:
+                uid = pipeline.uid
+                if uid in pending or uid in failed or \
+                        pipeline.state == states.SUSPENDED or \
+                        current[uid] >= len(pipeline.stages):
+                    continue
+                stage = pipeline.stages[current[uid]]
+                pending[uid] = deque(stage.tasks)
+                running_count[uid] = 0
+
+            # Launch pending tasks in pipeline order while cores are free
+            for pipeline in pipelines:
+                queue = pending.get(pipeline.uid)
+                while queue and self._cores(queue[0], cores) <= free:
+                    task = queue.popleft()
+                    free -= self._cores(task, cores)
+                    running.append((pipeline, task, self._launch(pipeline, task)))
+                    running_count[pipeline.uid] += 1
+
+            if not running:
+                idle = [pipeline.name for pipeline in pipelines
+                        if pipeline.state == states.SUSPENDED]
+                if idle:
+                    print(f'Pipelines {idle} are suspended with no tasks left to run')
+                break
+
+            time.sleep(self.poll_interval)
+
+            still_running = []
+            for pipeline, task, proc in running:
+                if proc.poll() is None:
+                    still_running.append((pipeline, task, proc))
+                    continue
+
+                free += self._cores(task, cores)
+                running_count[pipeline.uid] -= 1
+                if proc.returncode:
+                    print(f'Task {task.uid} of {pipeline.name} failed with '
+                          f'exit code {proc.returncode}, see {self.workdir}')
+                    failed.add(pipeline.uid)
+                    pipeline.state = states.FAILED
+
+                # Finish the stage once all of its tasks are done
+                if not running_count[pipeline.uid] and not pending[pipeline.uid]:
+                    del pending[pipeline.uid]
+                    if pipeline.uid not in failed:
+                        stage = pipeline.stages[current[pipeline.uid]]
+                        current[pipeline.uid] += 1
+                        if callable(stage.post_exec):
+                            stage.post_exec()
+                        # As in EnTK, a pipeline is done once its last stage is
+                        # done and its post_exec added no stages
+                        if pipeline.state != states.SUSPENDED and \
+                                current[pipeline.uid] >= len(pipeline.stages):
+                            pipeline.state = states.DONE
+            running = still_running
+
+        if failed:
+            raise RuntimeError(f'{len(failed)} pipelines failed')
+
+    @staticmethod
+    def _cores(task, cores):
+        """Cores used by a task, from cpu_reqs in either EnTK schema."""
+        reqs = task.cpu_reqs or {}
+        processes = reqs.get('processes') or reqs.get('cpu_processes') or 1
+        threads = reqs.get('threads_per_process') or reqs.get('cpu_threads') or 1
+        return min(processes * threads, cores)
+
+    def _launch(self, pipeline, task):
+        executable = task.executable
+        if isinstance(executable, str):
+            # Newer EnTK versions store list executables as their repr
+            executable = ast.literal_eval(executable) \
+                         if executable.startswith('[') else [executable]
+        command = ' '.join(shlex.quote(str(arg)) for arg in
+                           list(executable) + list(task.arguments or []))
+
+        # post_exec commands only run if the executable succeeded
+        script = '\n'.join(list(task.pre_exec or []) + [command] +
+                           ['ret=$?', 'if [ $ret -ne 0 ]; then exit $ret; fi'] +
+                           list(task.post_exec or []))
+
+        reqs = task.cpu_reqs or {}
+        env = dict(os.environ)
+        threads = reqs.get('threads_per_process') or reqs.get('cpu_threads')
+        if threads:
+            env['OMP_NUM_THREADS'] = str(threads)
+
+        base = os.path.join(self.workdir, f'{pipeline.name}.{task.uid}')
+        with open(f'{base}.out', 'w') as out, open(f'{base}.err', 'w') as err:
+            return subprocess.Popen(['bash', '-c', script], stdout=out,
+                                    stderr=err, env=env)
@@ -1 +1,4 @@
-from deepdrive.md.md import openmm_simulate_amber_fs_pep
+from deepdrive.md.md import openmm_simulate_amber_fs_pep, openmm_simulate_replicas
+from deepdrive.md.system import create_system
+from deepdrive.md.reporters import (OutputWriter, BufferedReporter, BufferedDCDReporter,
+                                    BufferedStateDataReporter, ContactMapReporter)
@@ -1,9 +1,13 @@
+import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 import parmed as pmd
 import simtk.unit as u
 import simtk.openmm as omm
 import simtk.openmm.app as app
-import molecules.sim as sim
+from deepdrive.md.system import create_system
+from deepdrive.md.reporters import (OutputWriter, BufferedReporter, BufferedDCDReporter,
+                                    BufferedStateDataReporter, ContactMapReporter)
 
 
 
@@ -13,7 +17,9 @@ def openmm_simulate_amber_fs_pep(pdb_file, top_file=None, checkpnt_fname='checkp
                                  checkpnt=None, GPU_index=0,
                                  output_traj='output.dcd', output_log='output.log', output_cm=None,
                                  report_time=10*u.picoseconds,sim_time=10*u.nanoseconds, 
-                                 platform='CUDA'):
+                                 platform='CUDA', flush_time=None, async_flush=False,
+                                 checkpoint_time=None, system_cache=None, restart=False,
+                                 threads=None):
     """
     Start and run an OpenMM NVT simulation with Langevin integrator at 2 fs 
     time step and 300 K. The cutoff distance for nonbonded interactions were 
@@ -41,6 +47,7 @@ def openmm_simulate_amber_fs_pep(pdb_file, top_file=None, checkpnt_fname='checkp
         energy, temperature, speed, etc.
  
     output_cm : the h5 file contains contact map information
+        Bit-packed C-alpha contact maps, see deepdrive.md.ContactMapReporter
 
     report_time : 10 ps
         The program writes its information to the output every 10 ps by default 
@@ -51,31 +58,55 @@ def openmm_simulate_amber_fs_pep(pdb_file, top_file=None, checkpnt_fname='checkp
     platform : str
         Name of platform. Options: 'CUDA', 'OpenCL', or 'CPU'
 
+    flush_time : None or time
+        Trajectory, contact map and log reports are held in memory and
+        written in bulk every flush_time, rounded down to a multiple of
+        report_time. By default, every report is written right away.
+
+    async_flush : bool
+        Write reports on a background thread while the simulation runs
+
+    checkpoint_time : None or time
+        Interval between checkpoints, defaults to flush_time if set,
+        otherwise report_time
+
+    system_cache : None or str
+        Directory caching the serialized System of each topology and
+        force field, so it is only built once, see create_system
+
+    restart : bool
+        The structure is already equilibrated, e.g. an outlier frame
+        of an earlier simulation. Skips the energy minimization and
+        the 100 ps equilibration. Positions and velocities are loaded
+        from checkpnt if given, otherwise velocities are drawn at 300 K
+        for the positions of pdb_file.
+
+    threads : None or int
+        Number of threads of the CPU platform, defaults to all cores
+
     """
 
     if top_file: 
         pdb = pmd.load_file(top_file, xyz=pdb_file)
-        system = pdb.createSystem(nonbondedMethod=app.CutoffNonPeriodic, 
-                nonbondedCutoff=1.0*u.nanometer, constraints=app.HBonds, 
-                implicitSolvent=app.OBC1)
     else: 
         pdb = pmd.load_file(pdb_file)
-        forcefield = app.ForceField('amber99sbildn.xml', 'amber99_obc.xml')
-        system = forcefield.createSystem(pdb.topology, nonbondedMethod=app.CutoffNonPeriodic, 
-                nonbondedCutoff=1.0*u.nanometer, constraints=app.HBonds)
+    system = create_system(pdb, top_file, system_cache)
 
     dt = 0.002*u.picoseconds
     integrator = omm.LangevinIntegrator(300*u.kelvin, 91.0/u.picosecond, dt)
     integrator.setConstraintTolerance(0.00001)
 
     # Select platform
-    if platform is 'CUDA':
+    if platform == 'CUDA':
         platform = omm.Platform_getPlatformByName('CUDA')
         properties = {'DeviceIndex': str(GPU_index), 'CudaPrecision': 'mixed'}
-    elif platform is 'OpenCL':
+    elif platform == 'OpenCL':
         platform = omm.Platform_getPlatformByName('OpenCL')
         properties = {'DeviceIndex': str(GPU_index)}
-    elif platform is 'CPU':
+    elif platform == 'CPU' and threads:
+        platform = omm.Platform_getPlatformByName('CPU')
+        properties = {'Threads': str(threads)}
+    elif platform == 'CPU':
         platform, properties = None, None
     else:
         raise ValueError(f'Invalid platform name: {platform}')
@@ -84,22 +115,90 @@ def openmm_simulate_amber_fs_pep(pdb_file, top_file=None, checkpnt_fname='checkp
 
     simulation.context.setPositions(random.choice(pdb.get_coordinates())/10) #parmed \AA to OpenMM nm
 
-    # equilibrate
-    simulation.minimizeEnergy() 
-    simulation.context.setVelocitiesToTemperature(300*u.kelvin, random.randint(1, 10000))
-    simulation.step(int(100*u.picoseconds / (2*u.femtoseconds)))
+    if restart:
+        # Already equilibrated, only draw velocities
+        simulation.context.setVelocitiesToTemperature(300*u.kelvin, random.randint(1, 10000))
+    else:
+        # equilibrate
+        simulation.minimizeEnergy() 
+        simulation.context.setVelocitiesToTemperature(300*u.kelvin, random.randint(1, 10000))
+        simulation.step(int(100*u.picoseconds / (2*u.femtoseconds)))
 
     report_freq = int(report_time/dt)
-    simulation.reporters.append(app.DCDReporter(output_traj, report_freq))
+    # Number of reports held in memory and written at a time
+    buffer_size = max(1, int(flush_time/report_time)) if flush_time else 1
+    writer = OutputWriter(background=async_flush)
+
+    simulation.reporters.append(BufferedDCDReporter(output_traj, report_freq,
+                                                    buffer_size, writer))
     if output_cm:
-        simulation.reporters.append(sim.ContactMapReporter(output_cm, report_freq))
+        simulation.reporters.append(ContactMapReporter(output_cm, report_freq,
+                                                       buffer_size=buffer_size,
+                                                       writer=writer))
 
-    simulation.reporters.append(app.StateDataReporter(output_log,
-            report_freq, step=True, time=True, speed=True,
+    simulation.reporters.append(BufferedStateDataReporter(output_log,
+            report_freq, buffer_size, writer, step=True, time=True, speed=True,
             potentialEnergy=True, temperature=True, totalEnergy=True))
-    simulation.reporters.append(app.CheckpointReporter(checkpnt_fname, report_freq))
+
+    checkpoint_freq = int(checkpoint_time/dt) if checkpoint_time else report_freq * buffer_size
+    simulation.reporters.append(app.CheckpointReporter(checkpnt_fname, checkpoint_freq))
 
     if checkpnt:
         simulation.loadCheckpoint(checkpnt)
     nsteps = int(sim_time/dt)
     simulation.step(nsteps)
+
+    # Write the remaining buffered reports
+    for reporter in simulation.reporters:
+        if isinstance(reporter, BufferedReporter):
+            reporter.close()
+    writer.close()
+
+
+def openmm_simulate_replicas(replicas, concurrent=1, threads=None, **kwargs):
+    """
+    Run several simulations in one process, so the imports, the force
+    field and the System of each topology (see create_system) are only
+    loaded once for all of them.
+
+    Parameters
+    ----------
+    replicas : list
+        list of dicts of the per-replica arguments of
+        openmm_simulate_amber_fs_pep, e.g. pdb_file, output_traj,
+        output_log, output_cm and checkpnt_fname
+
+    concurrent : int
+        number of replicas simulated at a time, each in its own thread
+        and OpenMM context. Replicas run one after another by default.
+
+    threads : None or int
+        number of threads of the CPU platform, split evenly between
+        the concurrent replicas. Defaults to all cores, which each
+        replica uses if replicas run one after another.
+
+    **kwargs
+        arguments of openmm_simulate_amber_fs_pep shared by all replicas
+
+    """
+    if concurrent < 1:
+        raise ValueError(f'concurrent must be at least 1, currently {concurrent}')
+
+    # Concurrent contexts would each default to all cores
+    if concurrent > 1 and not threads:
+        threads = os.cpu_count()
+    if threads:
+        kwargs['threads'] = max(1, threads // concurrent)
+
+    def simulate(replica):
+        openmm_simulate_amber_fs_pep(**replica, **kwargs)
+
+    if concurrent == 1:
+        for replica in replicas:
+            simulate(replica)
+        return
+
+    # OpenMM releases the GIL while integrating
+    with ThreadPoolExecutor(max_workers=concurrent) as executor:
+        for _ in executor.map(simulate, replicas):
+            pass
@@ -0,0 +1,315 @@
+import io
+import os
+import h5py
+import numpy as np
+import simtk.unit as u
+import simtk.openmm.app as app
+from concurrent.futures import ThreadPoolExecutor
+from deepdrive.preproc import contact_map_triu
+
+
+class OutputWriter:
+    """
+    Performs the bulk writes of buffered reporters, either right away
+    in the simulation thread or in order on a background thread, so the
+    integrator keeps running while a flush reaches the file system.
+
+    Errors of background writes are raised in the simulation thread by
+    the next submit, wait or close.
+
+    """
+    def __init__(self, background=False, max_pending=2):
+        """
+        Parameters
+        ----------
+        background : bool
+            write on a background thread
+
+        max_pending : int
+            number of background writes that may be queued before
+            submit blocks, bounding the memory held by buffered frames
+
+        """
+        self._executor = ThreadPoolExecutor(max_workers=1) if background else None
+        self.max_pending = max_pending
+        self._pending = []
+
+    def submit(self, func, *args):
+        if self._executor is None:
+            func(*args)
+            return
+
+        # Raise errors of finished writes and wait while too many are queued
+        while self._pending and (self._pending[0].done() or
+                                 len(self._pending) >= self.max_pending):
+            self._pending.pop(0).result()
+        self._pending.append(self._executor.submit(func, *args))
+
+    def wait(self):
+        """Wait for all submitted writes to finish."""
+        while self._pending:
+            self._pending.pop(0).result()
+
+    def close(self):
+        """Wait for all submitted writes and stop the background thread."""
+        self.wait()
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+
+
+class BufferedReporter:
+    """
+    Base class of reporters holding buffer_size reports in memory and
+    writing them in one bulk write through an OutputWriter. Subclasses
+    implement _write, which receives the list of buffered reports.
+    Remaining reports are written by close, which waits for the writes
+    to finish. The writer may be shared by the reporters of a
+    simulation and is closed by its owner.
+
+    """
+    def __init__(self, reportInterval, buffer_size=1, writer=None):
+        """
+        Parameters
+        ----------
+        reportInterval : int
+            number of steps between reports
+
+        buffer_size : int
+            number of reports written at a time
+
+        writer : OutputWriter
+            writer shared by the buffered reporters of a simulation,
+            defaults to writing in the simulation thread
+
+        """
+        self._report_interval = reportInterval
+        self.buffer_size = buffer_size
+        self.writer = writer or OutputWriter()
+        self._buffer = []
+
+    def describeNextReport(self, simulation):
+        steps = self._report_interval - simulation.currentStep % self._report_interval
+        return (steps, True, False, False, False, None)
+
+    def _add(self, report):
+        self._buffer.append(report)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.writer.submit(self._write, self._buffer)
+            self._buffer = []
+
+    def close(self):
+        """Write buffered reports and wait for all writes to finish."""
+        self.flush()
+        self.writer.wait()
+
+    def _write(self, reports):
+        raise NotImplementedError
+
+
+class BufferedDCDReporter(BufferedReporter):
+    """
+    Buffered version of simtk.openmm.app.DCDReporter. Frames are encoded
+    with app.DCDFile in memory and appended to the DCD file buffer_size
+    frames at a time, followed by an update of the header.
+
+    """
+    def __init__(self, file, reportInterval, buffer_size=1, writer=None,
+                 enforcePeriodicBox=None):
+        super().__init__(reportInterval, buffer_size, writer)
+        self._out = open(file, 'wb')
+        self._enforce_periodic_box = enforcePeriodicBox
+        self._dcd = None
+
+    def describeNextReport(self, simulation):
+        return super().describeNextReport(simulation)[:5] + (self._enforce_periodic_box,)
+
+    def report(self, simulation, state):
+        if self._dcd is None:
+            self._encoded = io.BytesIO()
+            self._dcd = app.DCDFile(self._encoded, simulation.topology,
+                                    simulation.integrator.getStepSize(),
+                                    simulation.currentStep, self._report_interval)
+            self._header_len = self._encoded.tell()
+            self._out.write(self._encoded.getvalue())
+
+        box = state.getPeriodicBoxVectors() \
+              if simulation.topology.getUnitCellDimensions() is not None else None
+        self._add((state.getPositions(asNumpy=True), box))
+
+    def _write(self, reports):
+        for positions, box in reports:
+            self._dcd.writeModel(positions, periodicBoxVectors=box)
+
+        # The header of the in-memory file counts all frames written so far
+        encoded = self._encoded.getvalue()
+        self._out.seek(0, os.SEEK_END)
+        self._out.write(encoded[self._header_len:])
+        self._out.seek(0)
+        self._out.write(encoded[:self._header_len])
+        self._out.flush()
+
+        self._encoded.seek(self._header_len)
+        self._encoded.truncate()
+
+    def close(self):
+        super().close()
+        self._out.close()
+
+
+class BufferedStateDataReporter(BufferedReporter, app.StateDataReporter):
+    """
+    Buffered version of simtk.openmm.app.StateDataReporter, taking the
+    same keyword arguments. Lines are formatted in memory and appended
+    to the log file buffer_size lines at a time.
+
+    """
+    def __init__(self, file, reportInterval, buffer_size=1, writer=None, **kwargs):
+        app.StateDataReporter.__init__(self, io.StringIO(), reportInterval, **kwargs)
+        BufferedReporter.__init__(self, reportInterval, buffer_size, writer)
+        self._log = open(file, 'w')
+
+    def describeNextReport(self, simulation):
+        return app.StateDataReporter.describeNextReport(self, simulation)
+
+    def report(self, simulation, state):
+        app.StateDataReporter.report(self, simulation, state)
+        self._add(self._out.getvalue())
+        self._out.seek(0)
+        self._out.truncate()
+
+    def _write(self, reports):
+        self._log.write(''.join(reports))
+        self._log.flush()
+
+    def close(self):
+        BufferedReporter.close(self)
+        self._log.close()
+
+
+class ContactMapReporter(BufferedReporter):
+    """
+    OpenMM reporter writing the contact map of a subset of atoms, by
+    default the C-alpha atoms, every reportInterval steps.
+
+    The atoms are selected once, on the first report. Contacts are
+    computed with a vectorized pairwise distance computation, or with a
+    k-d tree neighbor search for large selections, see
+    deepdrive.preproc.contact_map_triu. Only the positions of the
+    selected atoms are buffered; contact maps are computed when the
+    buffer is written, on the background thread of the writer if any.
+
+    By default, the strict upper triangle of each contact map is stored
+    bit-packed in a uint8 'contact_maps' dataset of shape
+    (num_frames, ceil(triu_len / 8)) whose attributes `packed`,
+    `triu_len` and `num_residues` describe the layout. Read it with
+    deepdrive.preproc.open_contact_maps. With packed=False, contact maps
+    are stored as float32 in the (triu_len, num_frames) layout of
+    molecules.sim.ContactMapReporter.
+
+    Example
+    -------
+    simulation.reporters.append(ContactMapReporter('output-cm.h5', 5000))
+
+    """
+    def __init__(self, file, reportInterval, selection='CA', cutoff=8.0,
+                 method='auto', packed=True, buffer_size=1, writer=None):
+        """
+        Parameters
+        ----------
+        file : str
+            h5 file to write
+
+        reportInterval : int
+            number of steps between reports
+
+        selection : str or list
+            atom name of the selected atoms, or list of atom indices
+
+        cutoff : float
+            distance (Angstrom) below which two atoms are in contact
+
+        method : str
+            'dense', 'kdtree' or 'auto', see contact_map_triu
+
+        packed : bool
+            store bit-packed instead of float32 contact maps
+
+        buffer_size, writer
+            see BufferedReporter
+
+        """
+        super().__init__(reportInterval, buffer_size, writer)
+        self._file = h5py.File(file, 'w', libver='latest')
+        self.selection = selection
+        self.cutoff = cutoff
+        self.method = method
+        self.packed = packed
+        self._indices = None
+        self._out = None
+
+    def __del__(self):
+        if self._file:
+            self._file.close()
+
+    def close(self):
+        if self._file:
+            super().close()
+            self._file.close()
+            self._file = None
+
+    def report(self, simulation, state):
+        if self._indices is None:
+            self._indices = self._select(simulation.topology)
+            self._out = self._create_dataset()
+
+        positions = state.getPositions(asNumpy=True).value_in_unit(u.angstrom)
+        self._add(positions[self._indices])
+
+    def _write(self, reports):
+        contact_maps = np.array([contact_map_triu(positions, self.cutoff,
+                                                  self.method, self.packed)
+                                 for positions in reports])
+        if self.packed:
+            start = len(self._out)
+            self._out.resize(start + len(reports), axis=0)
+            self._out[start:] = contact_maps
+        else:
+            start = self._out.shape[1]
+            self._out.resize(start + len(reports), axis=1)
+            self._out[:, start:] = contact_maps.T
+        self._file.flush()
+
+    def _select(self, topology):
+        if isinstance(self.selection, str):
+            indices = [atom.index for atom in topology.atoms()
+                       if atom.name == self.selection]
+        else:
+            indices = list(self.selection)
+        if len(indices) < 2:
+            raise ValueError(f'Contact map selection {self.selection} '
+                             f'matches {len(indices)} atoms')
+        return np.array(indices)
+
+    def _create_dataset(self):
+        num_atoms = len(self._indices)
+        triu_len = num_atoms * (num_atoms - 1) // 2
+        if self.packed:
+            size = (triu_len + 7) // 8
+            out = self._file.create_dataset('contact_maps', shape=(0, size),
+                                            maxshape=(None, size), dtype=np.uint8,
+                                            chunks=(max(1, min(1024, 2**20 // size)), size))
+            out.attrs['packed'] = True
+            out.attrs['triu_len'] = triu_len
+            out.attrs['num_residues'] = num_atoms
+        else:
+            out = self._file.create_dataset('contact_maps', shape=(triu_len, 0),
+                                            maxshape=(triu_len, None), dtype=np.float32,
+                                            chunks=(triu_len, max(1, self.buffer_size)))
+        # Readers may open the file while the simulation is running
+        self._file.swmr_mode = True
+        return out
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import threading
+import simtk.unit as u
+import simtk.openmm as omm
+import simtk.openmm.app as app
+from functools import lru_cache
+
+# Systems built or loaded by this process, by cache key. Simulations of
+# replicas with the same topology share a System.
+_systems = {}
+_systems_lock = threading.Lock()
+
+
+def topology_digest(topology):
+    """
+    SHA-256 hex digest of the atoms, residues, bonds and unit cell of
+    an OpenMM topology, independent of the atom positions.
+
+    """
+    sha = hashlib.sha256()
+    for atom in topology.atoms():
+        element = atom.element.symbol if atom.element is not None else ''
+        sha.update(f'{atom.residue.chain.index} {atom.residue.name} '
+                   f'{atom.name} {element}\n'.encode())
+    for atom1, atom2 in topology.bonds():
+        sha.update(f'{atom1.index}-{atom2.index}\n'.encode())
+    sha.update(str(topology.getUnitCellDimensions()).encode())
+    return sha.hexdigest()
+
+
+def system_cache_key(topology, settings, top_file=None):
+    """
+    Key of the system built for a topology with the given force field
+    settings, also covering the contents of the parameter file
+    top_file, if any, and the OpenMM version.
+
+    """
+    sha = hashlib.sha256()
+    sha.update(topology_digest(topology).encode())
+    sha.update(json.dumps(settings, sort_keys=True).encode())
+    sha.update(omm.Platform.getOpenMMVersion().encode())
+    if top_file:
+        with open(top_file, 'rb') as file:
+            for block in iter(lambda: file.read(2**20), b''):
+                sha.update(block)
+    return sha.hexdigest()[:16]
+
+
+@lru_cache(maxsize=None)
+def load_forcefield(*files):
+    """ForceField of the given files, parsed once per process."""
+    return app.ForceField(*files)
+
+
+def create_system(pdb, top_file=None, cache_dir=None):
+    """
+    Build the implicit solvent system of the MD stage for a parmed
+    structure, or load it from cache_dir if it was built before for
+    the same topology and force field settings. Within a process, the
+    system of a topology is only built or loaded once.
+
+    Parameters
+    ----------
+    pdb : parmed.Structure
+        structure to simulate, loaded with its parameters from top_file
+        if given, otherwise parametrized with the amber99sbildn and
+        OBC force fields
+
+    top_file : str
+        topology file the structure was loaded from, if any
+
+    cache_dir : str
+        directory of serialized systems, system-<key>.xml. If None,
+        the system is always built.
+
+    Returns
+    -------
+    simtk.openmm.System
+
+    """
+    settings = {'nonbondedMethod': 'CutoffNonPeriodic',
+                'nonbondedCutoff': 1.0, 'constraints': 'HBonds'}
+    if top_file:
+        settings['implicitSolvent'] = 'OBC1'
+    else:
+        settings['forcefield'] = ['amber99sbildn.xml', 'amber99_obc.xml']
+
+    key = system_cache_key(pdb.topology, settings, top_file)
+    # Replicas simulated in threads wait for the first to build the system
+    with _systems_lock:
+        if key not in _systems:
+            _systems[key] = _build_system(pdb, top_file, cache_dir, settings, key)
+    return _systems[key]
+
+
+def _build_system(pdb, top_file, cache_dir, settings, key):
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f'system-{key}.xml')
+        if os.path.exists(cache_path):
+            with open(cache_path) as file:
+                return omm.XmlSerializer.deserialize(file.read())
+
+    if top_file:
+        system = pdb.createSystem(nonbondedMethod=app.CutoffNonPeriodic,
+                nonbondedCutoff=1.0*u.nanometer, constraints=app.HBonds,
+                implicitSolvent=app.OBC1)
+    else:
+        forcefield = load_forcefield(*settings['forcefield'])
+        system = forcefield.createSystem(pdb.topology, nonbondedMethod=app.CutoffNonPeriodic,
+                nonbondedCutoff=1.0*u.nanometer, constraints=app.HBonds)
+
+    if cache_path:
+        # Concurrent tasks may build the same system, replace atomically
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(omm.XmlSerializer.serialize(system))
+        os.replace(tmp_path, cache_path)
+
+    return system
@@ -0,0 +1,3 @@
+from .loader import ContactMapSequence, split_blocks
+from .registry import ModelRegistry
+from .shared import shared_array
@@ -0,0 +1,94 @@
+import time
+import numpy as np
+from keras.callbacks import Callback
+
+
+class BudgetedEarlyStopping(Callback):
+    """
+    Stops training once the monitored loss has not improved for
+    `patience` epochs, or before an epoch that would exceed the
+    wall-clock budget, and restores the weights of the best epoch.
+
+    Training is only stopped at epoch boundaries so every epoch is
+    validated and other callbacks see complete logs. The duration of
+    the next epoch is estimated from the slowest epoch so far.
+
+    """
+    def __init__(self, monitor='val_loss', patience=None, min_delta=0.,
+                 time_budget=None, restore_best_weights=True):
+        """
+        Parameters
+        ----------
+        monitor : str
+            loss to monitor, smaller is better
+
+        patience : int
+            number of epochs without improvement after which training
+            is stopped. If None, only the time budget is enforced.
+
+        min_delta : float
+            minimum decrease of the monitored loss counted as improvement
+
+        time_budget : float
+            wall-clock seconds available for training. If None, only
+            the patience is enforced.
+
+        restore_best_weights : bool
+            if True, restore the weights of the epoch with the smallest
+            monitored loss when training ends
+
+        """
+        super().__init__()
+        self.monitor = monitor
+        self.patience = patience
+        self.min_delta = abs(min_delta)
+        self.time_budget = time_budget
+        self.restore_best_weights = restore_best_weights
+
+    def on_train_begin(self, logs=None):
+        self.best = np.inf
+        self.best_epoch = None
+        self.best_weights = None
+        self.wait = 0
+        self.stopped_epoch = None
+        self.stop_reason = None
+        self.start_time = time.time()
+        self.max_epoch_time = 0.
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        now = time.time()
+        self.max_epoch_time = max(self.max_epoch_time, now - self.epoch_start)
+
+        current = (logs or {}).get(self.monitor)
+        if current is not None:
+            if current < self.best - self.min_delta:
+                self.best = current
+                self.best_epoch = epoch
+                self.wait = 0
+                if self.restore_best_weights:
+                    self.best_weights = self.model.get_weights()
+            else:
+                self.wait += 1
+
+        if self.patience is not None and self.wait >= self.patience:
+            self.stop_reason = 'patience'
+        elif (self.time_budget is not None and
+              now - self.start_time + self.max_epoch_time > self.time_budget):
+            self.stop_reason = 'time_budget'
+
+        if self.stop_reason:
+            self.stopped_epoch = epoch
+            self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        if self.stop_reason:
+            print(f'Stopped training after epoch {self.stopped_epoch + 1} '
+                  f'({self.stop_reason})')
+
+        if self.best_weights is not None:
+            print(f'Restoring weights of epoch {self.best_epoch + 1}, '
+                  f'{self.monitor}: {self.best:.6f}')
+            self.model.set_weights(self.best_weights)
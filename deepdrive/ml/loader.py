@@ -0,0 +1,186 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from keras.utils import Sequence
+
+
+def split_blocks(num_frames, block_size, valid_fraction=0.2, seed=None):
+    """
+    Index-based train/validation split over contiguous blocks of frames.
+    Splitting whole blocks, rather than single frames, keeps every read
+    aligned with the hdf5 chunks of the dataset and does not copy data.
+
+    Parameters
+    ----------
+    num_frames : int
+        total number of frames in the dataset
+
+    block_size : int
+        number of frames per block, typically the hdf5 chunk size
+
+    valid_fraction : float
+        fraction of blocks assigned to the validation set
+
+    seed : int
+        seed of the random block assignment
+
+    Returns
+    -------
+    tuple of (train_blocks, valid_blocks), each an int array of
+    shape (num_blocks, 2) holding [start, stop) frame ranges
+
+    """
+    starts = np.arange(0, num_frames, block_size)
+    blocks = np.stack([starts, np.minimum(starts + block_size, num_frames)], axis=1)
+
+    order = np.random.RandomState(seed).permutation(len(blocks))
+    num_valid = int(round(valid_fraction * len(blocks)))
+    if len(blocks) > 1:
+        num_valid = min(max(num_valid, 1), len(blocks) - 1)
+
+    # Keep each split in file order for sequential reads
+    valid = np.sort(order[:num_valid])
+    train = np.sort(order[num_valid:])
+
+    return blocks[train], blocks[valid]
+
+
+class ContactMapSequence(Sequence):
+    """
+    Out-of-core batch loader of contact maps for keras fit_generator.
+
+    Frames are read straight from the hdf5 file through a
+    deepdrive.preproc.ContactMapReader. Each epoch the blocks are
+    shuffled and grouped into windows of roughly `window_batches`
+    batches; a window is read with one contiguous read per block,
+    its frames are shuffled and then served as batches while the next
+    window is prefetched on a background thread. Peak memory is two
+    windows, independent of the dataset size.
+
+    Batches run across window boundaries, so every epoch has the same
+    ceil(num_frames / batch_size) batches, as keras fixes the steps
+    per epoch to the length of the first.
+
+    The sequence shuffles itself, so it must be consumed in order:
+    use fit_generator(..., shuffle=False, workers=0).
+
+    """
+    def __init__(self, reader, blocks, batch_size, shuffle=True,
+                 window_batches=4, seed=None, prefetch=True):
+        """
+        Parameters
+        ----------
+        reader : deepdrive.preproc.ContactMapReader
+            reader of an open cvae-input h5 file
+
+        blocks : np.ndarray
+            [start, stop) frame ranges to load, see split_blocks
+
+        batch_size : int
+            number of frames per batch
+
+        shuffle : bool
+            if True, shuffle blocks and frames every epoch
+
+        window_batches : int
+            approximate number of batches read into memory at once
+
+        seed : int
+            seed of the shuffling
+
+        prefetch : bool
+            if True, read the next window on a background thread
+
+        """
+        self.reader = reader
+        self.blocks = np.asarray(blocks)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.window_frames = max(window_batches * batch_size, 1)
+        self.rng = np.random.RandomState(seed)
+
+        self._executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        self._futures = {}
+        self._current = None
+
+        self._plan()
+
+    @property
+    def num_frames(self):
+        return int(np.sum(self.blocks[:, 1] - self.blocks[:, 0]))
+
+    def __len__(self):
+        return -(-self.num_frames // self.batch_size)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(f'Batch {index} out of range of {len(self)} batches')
+        start = index * self.batch_size
+        stop = min(start + self.batch_size, self.num_frames)
+
+        # Slices of the windows holding frames [start, stop) of the epoch
+        pieces = []
+        w = np.searchsorted(self._offsets, start, side='right') - 1
+        while start < stop:
+            offset, end = self._offsets[w], min(stop, self._offsets[w + 1])
+            pieces.append(self._window(w)[start - offset:end - offset])
+            start, w = end, w + 1
+
+        x = pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+        return x, x
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self._plan()
+        elif self._current is None or self._current[0] != 0:
+            self._prefetch(0)
+
+    def _plan(self):
+        """Assign blocks to windows and windows to batches for the next epoch."""
+        order = self.rng.permutation(len(self.blocks)) if self.shuffle \
+                else np.arange(len(self.blocks))
+        sizes = self.blocks[order, 1] - self.blocks[order, 0]
+
+        # Greedily fill windows with whole blocks
+        self._windows, window, window_size = [], [], 0
+        for block, size in zip(order, sizes):
+            window.append(block)
+            window_size += size
+            if window_size >= self.window_frames:
+                self._windows.append((window, window_size))
+                window, window_size = [], 0
+        if window:
+            self._windows.append((window, window_size))
+
+        self._perms = [self.rng.permutation(size) if self.shuffle else None
+                       for _, size in self._windows]
+
+        # First frame of each window in the epoch
+        self._offsets = np.cumsum([0] + [size for _, size in self._windows])
+
+        # Drop windows cached or prefetched for the previous epoch
+        for future in self._futures.values():
+            future.cancel()
+        self._futures = {}
+        self._current = None
+        self._prefetch(0)
+
+    def _load(self, window, perm):
+        blocks, _ = window
+        data = np.concatenate([self.reader[start:stop]
+                               for start, stop in self.blocks[blocks]])
+        return data if perm is None else data[perm]
+
+    def _prefetch(self, w):
+        if self._executor and w < len(self._windows) and w not in self._futures:
+            self._futures[w] = self._executor.submit(self._load, self._windows[w],
+                                                     self._perms[w])
+
+    def _window(self, w):
+        if self._current is None or self._current[0] != w:
+            future = self._futures.pop(w, None)
+            data = future.result() if future else self._load(self._windows[w],
+                                                             self._perms[w])
+            self._current = (w, data)
+            self._prefetch(w + 1)
+
+        return self._current[1]
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import fcntl
+
+
+class ModelRegistry:
+    """
+    Append-only registry of trained models stored as a JSON lines file.
+    Each training task appends a single entry describing its model, so
+    selecting the best model, or querying models of earlier pipeline
+    iterations, takes one read of one file.
+
+    Appends take an exclusive lock on the file so that concurrent
+    training tasks can safely register models in the same registry.
+
+    Example
+    -------
+    registry = ModelRegistry('data/ml/registry.jsonl')
+    registry.register(model_id='0', out_path=cvae_dir, final_val_loss=0.1)
+    best = registry.best('final_val_loss', out_path=cvae_dir)
+
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            path of the JSON lines registry file, created on first use
+
+        """
+        self.path = path
+
+    def register(self, **entry):
+        """
+        Append an entry to the registry. A `timestamp` field is added
+        if not given. Path valued fields should be absolute so entries
+        remain valid from any working directory.
+
+        Returns
+        -------
+        dict : the registered entry
+
+        """
+        entry.setdefault('timestamp', time.time())
+        line = json.dumps(entry) + '\n'
+
+        with open(self.path, 'a+') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                # Terminate a line left incomplete by an interrupted writer
+                if file.seek(0, os.SEEK_END):
+                    file.seek(file.tell() - 1)
+                    if file.read(1) != '\n':
+                        line = '\n' + line
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+        return entry
+
+    def entries(self, **filters):
+        """
+        Returns
+        -------
+        list of registered entries, in registration order, whose fields
+        equal all given `filters`. Incomplete lines are skipped.
+
+        """
+        if not os.path.exists(self.path):
+            return []
+
+        entries = []
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    continue
+                if all(entry.get(key) == value for key, value in filters.items()):
+                    entries.append(entry)
+
+        return entries
+
+    def best(self, key='final_val_loss', **filters):
+        """
+        Returns
+        -------
+        entry matching `filters` with the smallest value of `key`,
+        or None if no entry matches
+
+        """
+        entries = [entry for entry in self.entries(**filters)
+                   if entry.get(key) is not None]
+        return min(entries, key=lambda entry: entry[key], default=None)
@@ -0,0 +1,43 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from numpy.lib.format import open_memmap
+
+# Memory-backed file system on Linux, so shared arrays stay in RAM
+SHM_DIR = '/dev/shm'
+
+
+@contextmanager
+def shared_array(array, directory=None):
+    """
+    Context manager copying an array to a .npy file that processes
+    attach to with np.load(path, mmap_mode='r'), so they share one copy
+    of the data in the page cache instead of each holding their own.
+    The file is removed on exit.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        array to share
+
+    directory : str
+        directory of the file, defaults to /dev/shm if it exists and
+        to the temporary directory otherwise
+
+    Yields
+    ------
+    str path of the .npy file
+
+    """
+    if directory is None:
+        directory = SHM_DIR if os.path.isdir(SHM_DIR) else None
+    fd, path = tempfile.mkstemp(suffix='.npy', prefix='shared-', dir=directory)
+    os.close(fd)
+    try:
+        out = open_memmap(path, mode='w+', dtype=array.dtype, shape=array.shape)
+        out[:] = array
+        out.flush()
+        del out
+        yield path
+    finally:
+        os.remove(path)
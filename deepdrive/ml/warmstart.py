@@ -0,0 +1,74 @@
+import os
+import numpy as np
+
+
+def optimizer_state_path(ae_weight_path):
+    """
+    Path of the optimizer state saved alongside the autoencoder weights,
+    i.e. <dir>/optimizer-<model_id>.npz for <dir>/ae-weight-<model_id>.h5
+
+    """
+    dirname, basename = os.path.split(ae_weight_path)
+    model_id = os.path.splitext(basename)[0].replace('ae-weight-', '', 1)
+    return os.path.join(dirname, f'optimizer-{model_id}.npz')
+
+
+def save_optimizer_state(model, path):
+    """
+    Save the optimizer weights (e.g. RMSprop accumulators) of a
+    compiled keras model so training can resume from them.
+
+    """
+    np.savez(path, *model.optimizer.get_weights())
+
+
+def load_optimizer_state(model, path):
+    """
+    Restore optimizer weights saved by save_optimizer_state into a
+    compiled keras model with the same architecture and optimizer.
+
+    """
+    with np.load(path) as data:
+        weights = [data[f'arr_{i}'] for i in range(len(data.files))]
+
+    # Optimizer weights are only created with the training function
+    model._make_train_function()
+    model.optimizer.set_weights(weights)
+
+
+def is_compatible(ae_weight_path, latent_dim, input_shape, registry=None):
+    """
+    Check whether previously trained weights can initialize a model
+    with the given latent dimension and input shape.
+
+    Parameters
+    ----------
+    ae_weight_path : str
+        autoencoder weights of a previously trained model
+
+    latent_dim : int
+        latent dimension of the model to initialize
+
+    input_shape : tuple
+        shape of a single contact map of the model to initialize
+
+    registry : deepdrive.ml.ModelRegistry, optional
+        registry the previous model was registered in. If the weights
+        are not registered, they are assumed to be compatible and
+        loading them will fail if they are not.
+
+    """
+    if not os.path.exists(ae_weight_path):
+        return False
+
+    if registry is None:
+        return True
+
+    entries = registry.entries(ae_weight_path=os.path.abspath(ae_weight_path))
+    if not entries:
+        return True
+
+    # The latest registration describes the weights on disk
+    entry = entries[-1]
+    return (entry['latent_dim'] == latent_dim and
+            tuple(entry['input_shape']) == tuple(input_shape))
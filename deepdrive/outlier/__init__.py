@@ -0,0 +1,6 @@
+from .knn import (knn_query, knn_outlier_scores, local_outlier_factor,
+                  top_outliers)
+from .store import EmbeddingStore, file_digest
+from .seeds import (seed_priorities, diverse_subset, write_seed_manifest,
+                    SeedQueue)
+from .pdb import outlier_pdb_name, write_sim_pdbs
@@ -0,0 +1,135 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.neighbors import KDTree, BallTree
+
+TREES = {'kd_tree': KDTree, 'ball_tree': BallTree}
+
+
+def knn_query(data, k, algorithm='kd_tree', batch_size=65536, num_workers=1):
+    """
+    Find the k nearest neighbors of every point of data, excluding the
+    point itself. The index is built once and queried in batches which
+    are distributed over threads; tree queries release the GIL.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        points of shape (N, dim), e.g. latent space embeddings
+
+    k : int
+        number of neighbors
+
+    algorithm : str
+        spatial index, 'kd_tree' or 'ball_tree'
+
+    batch_size : int
+        number of points per query
+
+    num_workers : int
+        number of threads querying the index
+
+    Returns
+    -------
+    tuple of (dist, ind), arrays of shape (N, k) with the distances
+    and indices of the neighbors in increasing order of distance
+
+    """
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    if k >= len(data):
+        raise ValueError(f'k={k} must be smaller than the number of points {len(data)}')
+
+    tree = TREES[algorithm](data)
+
+    dist = np.empty((len(data), k), dtype=np.float64)
+    ind = np.empty((len(data), k), dtype=np.int64)
+
+    def query(start):
+        stop = min(start + batch_size, len(data))
+        # The nearest neighbor of each point is the point itself
+        batch_dist, batch_ind = tree.query(data[start:stop], k=k + 1)
+        dist[start:stop] = batch_dist[:, 1:]
+        ind[start:stop] = batch_ind[:, 1:]
+
+    starts = range(0, len(data), batch_size)
+    if num_workers > 1:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(query, starts))
+    else:
+        for start in starts:
+            query(start)
+
+    return dist, ind
+
+
+def local_outlier_factor(dist, ind):
+    """
+    Local outlier factor of each point given its k nearest neighbors.
+    Scores near 1 are inliers, larger scores are outliers.
+
+    Parameters
+    ----------
+    dist, ind : np.ndarray
+        neighbor distances and indices returned by knn_query
+
+    """
+    k_distance = dist[:, -1]
+    reach_dist = np.maximum(dist, k_distance[ind])
+    lrd = 1. / (reach_dist.mean(axis=1) + 1e-10)
+    return lrd[ind].mean(axis=1) / lrd
+
+
+def knn_outlier_scores(data, k=20, method='lof', algorithm='kd_tree',
+                       batch_size=65536, num_workers=1):
+    """
+    Score every point of data by how isolated it is from its
+    k nearest neighbors. Larger scores are more outlying.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        points of shape (N, dim), e.g. latent space embeddings
+
+    k : int
+        number of neighbors
+
+    method : str
+        'lof' for the local outlier factor or 'kdist' for the
+        distance to the k-th nearest neighbor
+
+    algorithm, batch_size, num_workers :
+        see knn_query
+
+    Returns
+    -------
+    np.ndarray of shape (N,) holding the outlier score of each point
+
+    """
+    if method not in ('lof', 'kdist'):
+        raise ValueError(f'Invalid method {method}, expected lof or kdist')
+    if k < 1:
+        raise ValueError(f'k={k} must be at least 1')
+
+    dist, ind = knn_query(data, k, algorithm, batch_size, num_workers)
+
+    if method == 'kdist':
+        return dist[:, -1]
+
+    return local_outlier_factor(dist, ind)
+
+
+def top_outliers(scores, num_outliers):
+    """
+    Returns
+    -------
+    indices of the `num_outliers` largest scores, most outlying first.
+    Of equal scores, the lowest indices are selected first.
+
+    """
+    num_outliers = min(num_outliers, len(scores))
+    if num_outliers <= 0:
+        return np.empty(0, dtype=np.int64)
+    threshold = np.partition(scores, -num_outliers)[-num_outliers]
+    above = np.flatnonzero(scores > threshold)
+    tied = np.flatnonzero(scores == threshold)[:num_outliers - len(above)]
+    inds = np.concatenate([above, tied])
+    return inds[np.argsort(-scores[inds], kind='stable')]
@@ -0,0 +1,44 @@
+import os
+import MDAnalysis as mda
+from deepdrive.utils import get_id
+
+
+def outlier_pdb_name(traj_fname, frame):
+    """
+    File name of the outlier PDB file of a trajectory frame. Simulations
+    are numbered from 0 in each MD directory, so the name holds the
+    directory of the trajectory, e.g. pipeline-1, besides its sim_id.
+
+    """
+    sim_dir = os.path.basename(os.path.dirname(os.path.abspath(traj_fname)))
+    sim_id = get_id(traj_fname, 'output-', 'dcd')
+    return f'outlier-{sim_dir}-{sim_id}-{frame}.pdb'
+
+
+def write_sim_pdbs(pdb_fname, traj_fname, frames, shared_path):
+    """
+    Write the given frames of a single simulation to PDB files, opening
+    the Universe once and visiting the frames in sorted order.
+
+    This module only imports MDAnalysis and deepdrive.utils, so
+    processes spawned to run this function start quickly.
+
+    Returns
+    -------
+    int : number of PDB files written
+
+    """
+    u = mda.Universe(pdb_fname, traj_fname)
+
+    # For documentation on mda.Writer methods see:
+    #   https://www.mdanalysis.org/mdanalysis/documentation_pages/coordinates/PDB.html
+    #   https://www.mdanalysis.org/mdanalysis/_modules/MDAnalysis/coordinates/PDB.html#PDBWriter._update_frame
+
+    for ts in u.trajectory[frames]:
+        pdb_fname = os.path.join(shared_path, outlier_pdb_name(traj_fname, ts.frame))
+        with mda.Writer(pdb_fname) as writer:
+            # Write a single coordinate set to a PDB file
+            writer._update_frame(u)
+            writer._write_timestep(ts)
+
+    return len(frames)
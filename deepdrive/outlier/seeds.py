@@ -0,0 +1,237 @@
+import os
+import json
+import numpy as np
+from sklearn.neighbors import KDTree
+
+
+def _normalized(values):
+    top = values.max() if len(values) else 0.
+    return values / top if top > 0 else np.zeros_like(values)
+
+
+def seed_priorities(embeddings, candidates, explored, scores=None, k=20,
+                    novelty_weight=1.):
+    """
+    Rank candidate seeds of the MD stage by how outlying and how far
+    from explored regions of the latent space they are.
+
+    Parameters
+    ----------
+    embeddings : np.ndarray
+        latent space embeddings of shape (N, dim)
+
+    candidates : np.ndarray
+        indices of the candidate frames, e.g. the selected outliers
+
+    explored : np.ndarray
+        indices of the frames of explored regions, e.g. the frames
+        simulations were started from
+
+    scores : np.ndarray
+        outlier score of each candidate, larger is more outlying. If
+        None, the distance of each candidate to its k-th nearest
+        neighbor is used.
+
+    k : int
+        number of neighbors of the default outlier score
+
+    novelty_weight : float
+        weight of the novelty relative to the outlier score
+
+    Returns
+    -------
+    tuple of (scores, novelty, priority), arrays of shape
+    (len(candidates),) where novelty is the latent space distance to
+    the nearest explored frame and priority the sum of the outlier
+    score and the weighted novelty, each scaled to a maximum of 1
+
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    points = embeddings[candidates]
+
+    if scores is None:
+        k = min(k, len(embeddings) - 1)
+        # The nearest neighbor of each candidate is the candidate itself
+        dist, _ = KDTree(embeddings).query(points, k=k + 1)
+        scores = dist[:, -1]
+    scores = np.asarray(scores, dtype=np.float64)
+
+    novelty = np.zeros(len(candidates))
+    if len(explored) and len(candidates):
+        novelty = KDTree(embeddings[explored]).query(points, k=1)[0][:, 0]
+
+    priority = _normalized(scores) + novelty_weight * _normalized(novelty)
+    return scores, novelty, priority
+
+
+def diverse_subset(embeddings, candidates, min_distance=0., groups=None,
+                   max_per_group=None):
+    """
+    Greedily select a diverse subset of candidate frames, e.g. outliers
+    in order of decreasing priority. A candidate is selected unless it
+    is within min_distance in latent space of a selected candidate or
+    max_per_group candidates of its group were already selected.
+
+    The neighbors of all candidates within min_distance are found with
+    a single k-d tree query.
+
+    Parameters
+    ----------
+    embeddings : np.ndarray
+        latent space embeddings of shape (N, dim)
+
+    candidates : np.ndarray
+        indices of the candidate frames, in order of preference
+
+    min_distance : float
+        latent space distance within which candidates are redundant,
+        0 to disable
+
+    groups : np.ndarray
+        non-negative integer group of each candidate, e.g. the
+        simulation it was sampled from
+
+    max_per_group : int
+        maximum number of selected candidates per group, None to disable
+
+    Returns
+    -------
+    np.ndarray of the positions in candidates of the selected
+    candidates, in increasing order
+
+    """
+    candidates = np.asarray(candidates, dtype=np.int64)
+    selected = np.zeros(len(candidates), dtype=bool)
+    redundant = np.zeros(len(candidates), dtype=bool)
+
+    neighbors = None
+    if min_distance > 0 and len(candidates):
+        points = np.asarray(embeddings[candidates], dtype=np.float64)
+        neighbors = KDTree(points).query_radius(points, r=min_distance)
+
+    counts = None
+    if max_per_group is not None and len(candidates):
+        groups = np.asarray(groups, dtype=np.int64)
+        counts = np.zeros(groups.max() + 1, dtype=np.int64)
+
+    for i in range(len(candidates)):
+        if redundant[i]:
+            continue
+        if counts is not None:
+            if counts[groups[i]] >= max_per_group:
+                continue
+            counts[groups[i]] += 1
+        selected[i] = True
+        if neighbors is not None:
+            redundant[neighbors[i]] = True
+
+    return np.flatnonzero(selected)
+
+
+def write_seed_manifest(path, seeds):
+    """
+    Atomically write the candidate seeds of the MD stage, highest
+    priority first.
+
+    Parameters
+    ----------
+    path : str
+        JSON file to write
+
+    seeds : list
+        dicts describing each seed, with at least the keys `pdb`, the
+        absolute path of its PDB file, and `priority`
+
+    """
+    seeds = sorted(seeds, key=lambda seed: seed['priority'], reverse=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'seeds': seeds}, file, indent=2)
+    os.replace(tmp_path, path)
+
+
+class SeedQueue:
+    """
+    Persisted queue of the seeds of the MD stage. The seeds of each
+    manifest written by the outlier stage are added once; the MD stage
+    pops the seeds of highest priority and the remaining seeds carry
+    forward to later iterations.
+
+    Example
+    -------
+    queue = SeedQueue('data/shared/seed-queue.json')
+    queue.add_manifest('data/shared/pipeline-1/seeds.json')
+    pdb_files = [seed['pdb'] for seed in queue.pop(num_sims)]
+    queue.save()
+
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            path of the JSON queue file. It is loaded if it exists.
+
+        """
+        self.path = path
+        self.seeds = []
+        self.manifests = []
+
+        if os.path.exists(path):
+            with open(path) as file:
+                data = json.load(file)
+            self.seeds = data['seeds']
+            self.manifests = data['manifests']
+
+    def __len__(self):
+        return len(self.seeds)
+
+    def add_manifest(self, manifest_path, decay=1.):
+        """
+        Add the seeds of a manifest unless it was added before.
+
+        Parameters
+        ----------
+        manifest_path : str
+            manifest written by write_seed_manifest
+
+        decay : float
+            factor applied to the priority of the queued seeds, which
+            were ranked against older models and explored regions
+
+        Returns
+        -------
+        True if the seeds were added
+
+        """
+        manifest_path = os.path.abspath(manifest_path)
+        if manifest_path in self.manifests:
+            return False
+
+        with open(manifest_path) as file:
+            seeds = json.load(file)['seeds']
+
+        for seed in self.seeds:
+            seed['priority'] *= decay
+        self.seeds.extend(seeds)
+        self.manifests.append(manifest_path)
+        return True
+
+    def pop(self, num_seeds):
+        """
+        Remove and return the num_seeds seeds of highest priority whose
+        PDB file exists, highest priority first. Seeds whose PDB file
+        was removed are dropped.
+
+        """
+        self.seeds = sorted((seed for seed in self.seeds if os.path.exists(seed['pdb'])),
+                            key=lambda seed: seed['priority'], reverse=True)
+        seeds, self.seeds = self.seeds[:num_seeds], self.seeds[num_seeds:]
+        return seeds
+
+    def save(self):
+        """Atomically write the queue to disk."""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'seeds': self.seeds, 'manifests': self.manifests}, file, indent=2)
+        os.replace(tmp_path, self.path)
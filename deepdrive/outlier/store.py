@@ -0,0 +1,225 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+
+def file_digest(path, length=16):
+    """Hex digest of the contents of a file, e.g. of encoder weights."""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()[:length]
+
+
+def frame_digest(frame):
+    """Hex digest of a single frame used to detect rewritten sources."""
+    return hashlib.sha1(np.ascontiguousarray(frame).tobytes()).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Persistent store of latent space embeddings keyed by the model
+    that computed them and the trajectory frames they were computed
+    from, so frames are found whichever cvae-input file holds them,
+    e.g. the input of a later pipeline iteration.
+
+    Embeddings of each (model_key, traj_file) pair cover the trajectory
+    frames [0, frames) and are stored as a raw float32 file that only
+    grows, next to a JSON metadata file. Since simulations only append
+    frames, a rerun with the same model only needs to embed frames past
+    the stored range. A digest of the last stored frame detects
+    trajectories that were rewritten, which invalidates the entry.
+
+    Layout
+    ------
+    <root>/<model_key>/<traj_key>.f32
+    <root>/<model_key>/<traj_key>.json
+
+    Example
+    -------
+    store = EmbeddingStore('data/outlier/embeddings')
+    ranges = store.gather(model_key, frame_index, embeddings, frame_at)
+    for start, stop, traj_file in ranges:
+        embeddings[start:stop] = embed(start, stop)
+        if traj_file is not None:
+            store.append(model_key, traj_file, embeddings[start:stop],
+                         frame_at(stop - 1))
+
+    """
+    def __init__(self, root):
+        """
+        Parameters
+        ----------
+        root : str
+            directory of the store, created on first use
+
+        """
+        self.root = root
+
+    def _paths(self, model_key, traj_file):
+        traj_key = hashlib.sha1(os.path.abspath(traj_file).encode()).hexdigest()[:16]
+        base = os.path.join(self.root, model_key, traj_key)
+        return f'{base}.f32', f'{base}.json'
+
+    def meta(self, model_key, traj_file):
+        """
+        Returns
+        -------
+        dict with traj_file, frames, latent_dim and last_frame_digest
+        of the stored embeddings, or None if there are none
+
+        """
+        _, meta_path = self._paths(model_key, traj_file)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as file:
+            return json.load(file)
+
+    def frames(self, model_key, traj_file, frame_at=None):
+        """
+        Number of leading frames of traj_file with stored embeddings.
+
+        Parameters
+        ----------
+        frame_at : callable, optional
+            returns the contact map of trajectory frame i, or None if
+            it is not available. If the last stored frame is available,
+            stored embeddings are only reused if its digest matches,
+            otherwise the entry is invalidated and 0 is returned.
+
+        """
+        meta = self.meta(model_key, traj_file)
+        if meta is None or not meta['frames']:
+            return 0
+
+        if frame_at is not None:
+            try:
+                frame = frame_at(meta['frames'] - 1)
+                valid = frame is None or frame_digest(frame) == meta['last_frame_digest']
+            except (IndexError, ValueError):
+                valid = False
+            if not valid:
+                self.invalidate(model_key, traj_file)
+                return 0
+
+        return meta['frames']
+
+    def append(self, model_key, traj_file, embeddings, last_frame):
+        """
+        Append embeddings of the frames following the stored ones.
+
+        Parameters
+        ----------
+        embeddings : np.ndarray
+            embeddings of shape (num_frames, latent_dim)
+
+        last_frame : np.ndarray
+            contact map of the last embedded frame, see frames
+
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        data_path, meta_path = self._paths(model_key, traj_file)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+
+        meta = self.meta(model_key, traj_file) or {
+            'traj_file': os.path.abspath(traj_file), 'frames': 0,
+            'latent_dim': embeddings.shape[1], 'last_frame_digest': None}
+
+        if embeddings.shape[1] != meta['latent_dim']:
+            raise ValueError(f'Expected latent dimension {meta["latent_dim"]}, '
+                             f'got {embeddings.shape[1]}')
+
+        with open(data_path, 'ab') as file:
+            # Drop data of an append interrupted before its metadata was saved
+            file.truncate(meta['frames'] * meta['latent_dim'] * 4)
+            file.write(embeddings.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+        meta['frames'] += len(embeddings)
+        meta['last_frame_digest'] = frame_digest(last_frame)
+
+        tmp_path = f'{meta_path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(meta, file)
+        os.replace(tmp_path, meta_path)
+
+    def load(self, model_key, traj_file):
+        """
+        Returns
+        -------
+        read-only np.memmap of shape (frames, latent_dim) of the stored
+        embeddings, or None if there are none
+
+        """
+        meta = self.meta(model_key, traj_file)
+        if meta is None or not meta['frames']:
+            return None
+        data_path, _ = self._paths(model_key, traj_file)
+        return np.memmap(data_path, dtype=np.float32, mode='r',
+                         shape=(meta['frames'], meta['latent_dim']))
+
+    def gather(self, model_key, frame_index, out, frame_at=None):
+        """
+        Copy the stored embeddings of the frames of a cvae-input file
+        into out and find the frames left to embed.
+
+        Parameters
+        ----------
+        frame_index : deepdrive.preproc.FrameIndex
+            index of the trajectory frames of the cvae-input file
+
+        out : np.ndarray
+            embeddings of the global frames of the cvae-input file
+
+        frame_at : callable, optional
+            returns the contact map of global frame i, to detect
+            rewritten trajectories, see frames
+
+        Returns
+        -------
+        list of (start, stop, traj_file) global frame ranges left to
+        embed. traj_file is the trajectory whose stored embeddings the
+        embeddings of the range extend, in order, or None if they do
+        not follow the stored frames of the trajectory.
+
+        """
+        if len(frame_index) != len(out):
+            raise ValueError(f'Frame index of {len(frame_index)} frames does not '
+                             f'match {len(out)} embeddings')
+
+        ranges = []
+        # Frames of each trajectory stored now and after appending the ranges
+        stored, planned = {}, {}
+        for offset, sim, start, count in zip(frame_index.offsets, frame_index.sims,
+                                             frame_index.starts, frame_index.counts):
+            traj_file = frame_index.traj_files[sim]
+            if traj_file not in stored:
+                traj_frame_at = None
+                if frame_at is not None:
+                    def traj_frame_at(frame, traj_file=traj_file):
+                        ind = frame_index.find(traj_file, [frame])[0]
+                        return frame_at(ind) if ind >= 0 else None
+                stored[traj_file] = self.frames(model_key, traj_file, traj_frame_at)
+                planned[traj_file] = stored[traj_file]
+
+            reused = int(np.clip(stored[traj_file] - start, 0, count))
+            if reused:
+                out[offset:offset + reused] = self.load(model_key, traj_file)[start:start + reused]
+
+            if reused < count:
+                if start + reused == planned[traj_file]:
+                    planned[traj_file] = start + count
+                else:
+                    traj_file = None
+                ranges.append((int(offset + reused), int(offset + count), traj_file))
+
+        return ranges
+
+    def invalidate(self, model_key, traj_file):
+        """Remove the stored embeddings of traj_file."""
+        for path in self._paths(model_key, traj_file):
+            if os.path.exists(path):
+                os.remove(path)
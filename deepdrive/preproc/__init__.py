@@ -1 +1,7 @@
-from .preproc import cm_to_cvae
+from .preproc import (cm_to_cvae, stream_cm_to_cvae, append_cm_to_cvae,
+                      triu_to_full_batch, pack_triu_batch, unpack_triu_batch,
+                      PackedContactMaps, open_contact_maps)
+from .contacts import contact_map_triu
+from .reader import ContactMapReader
+from .manifest import PreprocManifest
+from .frame_index import FrameIndex
@@ -0,0 +1,78 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import pdist
+
+# Above this number of atoms, neighbor search with a k-d tree is faster
+# than computing all pairwise distances (see benchmarks/bench_contact_map.py)
+KDTREE_MIN_ATOMS = 2000
+
+
+def triu_pair_index(rows, cols, num_atoms):
+    """
+    Position of the atom pairs (rows[k], cols[k]) with rows[k] < cols[k]
+    in the strict upper triangle of a num_atoms x num_atoms matrix,
+    flattened in the order of np.triu_indices(num_atoms, 1).
+
+    """
+    rows = rows.astype(np.int64)
+    return num_atoms * rows - rows * (rows + 1) // 2 + cols - rows - 1
+
+
+def contact_map_triu(positions, cutoff=8.0, method='auto', packed=False):
+    """
+    Contact map of a single frame: the strict upper triangle of the
+    matrix marking atom pairs closer than `cutoff`.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        array of shape (num_atoms, 3) of the selected atoms, e.g. the
+        C-alpha atoms, in the unit of `cutoff`
+
+    cutoff : float
+        distance below which two atoms are in contact
+
+    method : str
+        'dense' computes all pairwise distances, 'kdtree' only finds
+        the pairs within `cutoff` using a k-d tree, which scales with
+        the number of contacts rather than the number of pairs. 'auto'
+        uses 'kdtree' from KDTREE_MIN_ATOMS atoms on.
+
+    packed : bool
+        if True, return the bit-packed contact map, as written by
+        deepdrive.preproc.pack_triu_batch
+
+    Returns
+    -------
+    np.ndarray of dtype bool and shape (triu_len,), or of dtype uint8
+    and shape (ceil(triu_len / 8),) if `packed` is True
+
+    """
+    num_atoms = len(positions)
+    triu_len = num_atoms * (num_atoms - 1) // 2
+
+    if method == 'auto':
+        method = 'kdtree' if num_atoms >= KDTREE_MIN_ATOMS else 'dense'
+
+    if method == 'dense':
+        contacts = pdist(positions, 'sqeuclidean') < cutoff ** 2
+        return np.packbits(contacts) if packed else contacts
+
+    if method != 'kdtree':
+        raise ValueError(f'Invalid contact map method: {method}')
+
+    pairs = cKDTree(positions).query_pairs(cutoff, output_type='ndarray')
+    # query_pairs includes pairs at exactly the cutoff distance
+    diff = positions[pairs[:, 0]] - positions[pairs[:, 1]]
+    pairs = pairs[np.einsum('ij,ij->i', diff, diff) < cutoff ** 2]
+    index = triu_pair_index(pairs.min(axis=1), pairs.max(axis=1), num_atoms)
+
+    if not packed:
+        contacts = np.zeros(triu_len, dtype=bool)
+        contacts[index] = True
+        return contacts
+
+    # Set the bits directly instead of packing a full boolean triangle
+    contacts = np.zeros((triu_len + 7) // 8, dtype=np.uint8)
+    np.bitwise_or.at(contacts, index >> 3, (0x80 >> (index & 7)).astype(np.uint8))
+    return contacts
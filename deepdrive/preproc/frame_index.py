@@ -0,0 +1,160 @@
+import os
+import numpy as np
+
+
+class FrameIndex:
+    """
+    Maps global frame indices of a cvae-input file back to the simulation
+    and trajectory frame they were computed from.
+
+    The index is a list of segments, each a run of consecutive global
+    frames taken from consecutive frames of one simulation. Simulations
+    of different lengths and frames appended by incremental
+    preprocessing are both represented without assumptions about the
+    order of the data. Lookups are vectorized with np.searchsorted.
+
+    Example
+    -------
+    index = FrameIndex.load('cvae-input-index.npz')
+    sims, frames = index.locate(outlier_inds)
+    traj_file = index.traj_files[sims[0]]
+
+    """
+    def __init__(self, traj_files=(), pdb_files=(), offsets=(), sims=(),
+                 starts=(), counts=()):
+        """
+        Parameters
+        ----------
+        traj_files : sequence
+            trajectory file of each simulation
+
+        pdb_files : sequence
+            topology PDB file of each simulation
+
+        offsets : sequence
+            global frame index of the first frame of each segment
+
+        sims : sequence
+            simulation (index into traj_files) of each segment
+
+        starts : sequence
+            trajectory frame of the first frame of each segment
+
+        counts : sequence
+            number of frames in each segment
+
+        """
+        self.traj_files = [str(file) for file in traj_files]
+        self.pdb_files = [str(file) for file in pdb_files]
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.sims = np.asarray(sims, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    def __len__(self):
+        """Total number of indexed frames."""
+        return int(self.counts.sum())
+
+    def append(self, traj_file, pdb_file, start, count):
+        """
+        Record that the next `count` global frames are the trajectory
+        frames [start, start + count) of the given simulation.
+
+        """
+        if count <= 0:
+            return
+
+        if traj_file in self.traj_files:
+            sim = self.traj_files.index(traj_file)
+        else:
+            sim = len(self.traj_files)
+            self.traj_files.append(traj_file)
+            self.pdb_files.append(pdb_file)
+
+        self.offsets = np.append(self.offsets, len(self))
+        self.sims = np.append(self.sims, sim)
+        self.starts = np.append(self.starts, start)
+        self.counts = np.append(self.counts, count)
+
+    def extend(self, other):
+        """
+        Append the frames of another index, e.g. of the cvae-input
+        file of an earlier pipeline iteration, after those of this one.
+
+        """
+        for sim, start, count in zip(other.sims, other.starts, other.counts):
+            self.append(other.traj_files[sim], other.pdb_files[sim],
+                        int(start), int(count))
+
+    def locate(self, inds):
+        """
+        Parameters
+        ----------
+        inds : array_like
+            global frame indices
+
+        Returns
+        -------
+        tuple of arrays (sims, frames) holding the simulation index
+        (into traj_files and pdb_files) and trajectory frame of each index
+
+        """
+        inds = np.asarray(inds, dtype=np.int64)
+        if len(inds) and (inds.min() < 0 or inds.max() >= len(self)):
+            raise IndexError(f'frame index out of range for {len(self)} frames')
+
+        segments = np.searchsorted(self.offsets, inds, side='right') - 1
+        frames = self.starts[segments] + inds - self.offsets[segments]
+
+        return self.sims[segments], frames
+
+    def find(self, traj_file, frames):
+        """
+        Inverse of locate.
+
+        Parameters
+        ----------
+        traj_file : str
+            trajectory file of a simulation
+
+        frames : array_like
+            trajectory frames of the simulation
+
+        Returns
+        -------
+        np.ndarray of the global index of each frame, -1 for frames
+        that are not in the index
+
+        """
+        frames = np.asarray(frames, dtype=np.int64)
+        inds = np.full(frames.shape, -1, dtype=np.int64)
+        if traj_file not in self.traj_files:
+            return inds
+
+        segments = self.sims == self.traj_files.index(traj_file)
+        for offset, start, count in zip(self.offsets[segments], self.starts[segments],
+                                        self.counts[segments]):
+            found = (frames >= start) & (frames < start + count)
+            inds[found] = offset + frames[found] - start
+
+        return inds
+
+    def covers(self, other):
+        """True if every frame of another index is also a frame of this one."""
+        return all(np.all(self.find(other.traj_files[sim], np.arange(start, start + count)) >= 0)
+                   for sim, start, count in zip(other.sims, other.starts, other.counts))
+
+    def save(self, path):
+        """Atomically write the index to a .npz file."""
+        tmp_path = f'{path}.tmp.npz'
+        np.savez(tmp_path,
+                 traj_files=np.array(self.traj_files, dtype=str),
+                 pdb_files=np.array(self.pdb_files, dtype=str),
+                 offsets=self.offsets, sims=self.sims,
+                 starts=self.starts, counts=self.counts)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(**{key: data[key] for key in data.files})
@@ -0,0 +1,60 @@
+import os
+import json
+
+
+class PreprocManifest:
+    """
+    Persisted record of the contact map files already converted into a
+    cvae input file. For each source file it stores the number of
+    converted frames along with the file size and modification time so
+    that unchanged files can be skipped without opening them.
+
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            path of the JSON manifest file. It is loaded if it exists.
+
+        """
+        self.path = path
+        self.files = {}
+
+        if os.path.exists(path):
+            with open(path) as file:
+                self.files = json.load(file)['files']
+
+    def __contains__(self, filename):
+        return os.path.abspath(filename) in self.files
+
+    def frames(self, filename):
+        """Number of frames of `filename` already converted."""
+        entry = self.files.get(os.path.abspath(filename))
+        return entry['frames'] if entry else 0
+
+    def is_modified(self, filename):
+        """
+        True if `filename` is new or its size or modification
+        time changed since it was last recorded.
+
+        """
+        entry = self.files.get(os.path.abspath(filename))
+        if entry is None:
+            return True
+        stat = os.stat(filename)
+        return stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']
+
+    def update(self, filename, frames):
+        """Record that the first `frames` frames of `filename` are converted."""
+        stat = os.stat(filename)
+        self.files[os.path.abspath(filename)] = {'frames': frames,
+                                                 'size': stat.st_size,
+                                                 'mtime': stat.st_mtime}
+
+    def save(self):
+        """Atomically write the manifest to disk."""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'files': self.files}, file, indent=2)
+        os.replace(tmp_path, self.path)
@@ -1,11 +1,171 @@
 import numpy as np
-from molecules.utils import triu_to_full
+from functools import lru_cache
 
 
-def cm_to_cvae(cm_data_lists): 
+def triu_num_residues(triu_len):
+    """Number of residues of a contact map with triu_len upper triangle entries."""
+    return int(np.ceil((triu_len * 2) ** 0.5))
+
+
+@lru_cache(maxsize=None)
+def _triu_gather_index(triu_len):
+    """
+    Cached map from each entry of a flattened, padded full contact map to
+    a column of the upper triangle batch extended by a column of zeros
+    (padding) and a column of ones (diagonal). Computed once per size.
+
+    """
+    num_res = triu_num_residues(triu_len)
+    dim = num_res + num_res % 2
+
+    rows, cols = np.triu_indices(num_res, 1)
+    index = np.full((dim, dim), triu_len, dtype=np.intp)
+    index[rows, cols] = np.arange(triu_len)
+    index[cols, rows] = np.arange(triu_len)
+    index[np.diag_indices(num_res)] = triu_len + 1
+
+    return index.ravel()
+
+
+def triu_to_full_batch(cm_batch, out=None, dtype=np.float64):
+    """
+    Vectorized conversion of a batch of upper triangle contact maps
+    to full symmetric contact maps with a unit diagonal. Odd matrix
+    dimensions are padded with a row and column of zeros.
+
+    Parameters
+    ----------
+    cm_batch : np.ndarray
+        array of shape (num_frames, triu_len) holding the strict upper
+        triangle of each contact map
+
+    out : np.ndarray, optional
+        preallocated C-contiguous buffer of shape (num_frames, dim, dim)
+        to write into. Every entry, including padding, is overwritten.
+
+    dtype : np.dtype
+        dtype of the allocated buffer if `out` is not given
+
+    Returns
+    -------
+    np.ndarray of shape (num_frames, dim, dim) where dim is the number
+    of residues rounded up to the next even number
+
+    """
+    num_frames, triu_len = cm_batch.shape
+    index = _triu_gather_index(triu_len)
+    dim = int(round(len(index) ** 0.5))
+
+    if out is None:
+        out = np.empty((num_frames, dim, dim), dtype=dtype)
+    elif not out.flags.c_contiguous:
+        raise ValueError('out must be a C-contiguous array')
+
+    # Append the padding and diagonal values as extra columns so that
+    # the full matrices can be gathered in a single vectorized take
+    extended = np.empty((num_frames, triu_len + 2), dtype=out.dtype)
+    extended[:, :triu_len] = cm_batch
+    extended[:, triu_len] = 0
+    extended[:, triu_len + 1] = 1
+
+    np.take(extended, index, axis=1, out=out.reshape(num_frames, dim * dim))
+
+    return out
+
+
+def pack_triu_batch(cm_batch):
+    """
+    Bit-pack a batch of binary upper triangle contact maps.
+
+    Parameters
+    ----------
+    cm_batch : np.ndarray
+        array of shape (num_frames, triu_len) with nonzero entries
+        marking contacts
+
+    Returns
+    -------
+    np.ndarray of dtype uint8 and shape (num_frames, ceil(triu_len / 8))
+
+    """
+    return np.packbits(cm_batch > 0, axis=1)
+
+
+def unpack_triu_batch(packed_batch, triu_len, dtype=np.float32):
+    """
+    Inverse of pack_triu_batch.
+
+    Parameters
+    ----------
+    packed_batch : np.ndarray
+        uint8 array of shape (num_frames, ceil(triu_len / 8))
+
+    triu_len : int
+        number of upper triangle entries per contact map
+
+    dtype : np.dtype
+        dtype of the returned array
+
+    Returns
+    -------
+    np.ndarray of shape (num_frames, triu_len)
+
+    """
+    bits = np.unpackbits(packed_batch, axis=1)[:, :triu_len]
+    return bits.astype(dtype, copy=False)
+
+
+class PackedContactMaps:
+    """
+    Read-only view of a bit-packed contact map dataset written by
+    deepdrive.md.ContactMapReporter, of shape (num_frames, ceil(triu_len / 8)),
+    in the (triu_len, num_frames) layout of unpacked MD contact map
+    datasets, so it can be passed to cm_to_cvae and stream_cm_to_cvae.
+
+    """
+    def __init__(self, dset, dtype=np.float32):
+        self.dset = dset
+        self.dtype = np.dtype(dtype)
+        self.triu_len = int(dset.attrs['triu_len'])
+        self.shape = (self.triu_len, len(dset))
+
+    def __getitem__(self, key):
+        """Supports selections of the form [:, frames] only."""
+        if not (isinstance(key, tuple) and len(key) == 2 and key[0] == slice(None)):
+            raise IndexError('PackedContactMaps only supports [:, frames] selections')
+        return self.unpack(self.dset[key[1]]).T
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[:, :]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def unpack(self, packed_batch):
+        if packed_batch.ndim == 1:
+            return self.unpack(packed_batch[np.newaxis])[0]
+        return unpack_triu_batch(packed_batch, self.triu_len, self.dtype)
+
+
+def open_contact_maps(h5_file, name='contact_maps'):
+    """
+    Contact map dataset of an MD output-cm h5 file in the
+    (triu_len, num_frames) layout, whether written packed by
+    deepdrive.md.ContactMapReporter or unpacked by molecules.
+
+    Returns
+    -------
+    h5py dataset or PackedContactMaps
+
+    """
+    dset = h5_file[name]
+    if dset.attrs.get('packed', False):
+        return PackedContactMaps(dset)
+    return dset
+
+
+def cm_to_cvae(cm_data_lists):
     """
-    A function converting the 2d upper triangle information of contact maps 
-    read from hdf5 file to full contact map and reshape to the format ready 
+    A function converting the 2d upper triangle information of contact maps
+    read from hdf5 file to full contact map and reshape to the format ready
     for cvae.
 
     Parameters
@@ -16,17 +176,178 @@ def cm_to_cvae(cm_data_lists):
     """
     cm_all = np.hstack(cm_data_lists)
 
-    # Transfer upper triangle to full matrix
-    cm_data_full = np.array(list(map(triu_to_full, cm_all.T)))
+    # Transfer upper triangle to full, padded matrix
+    cm_data_full = triu_to_full_batch(cm_all.T)
 
-    # Padding if odd dimension occurs in image 
-    pad_f = lambda x: (0,0) if x % 2 == 0 else (0,1) 
-    padding_buffer = [(0,0)] 
-    for x in cm_data_full.shape[1:]: 
-        padding_buffer.append(pad_f(x))
-    cm_data_full = np.pad(cm_data_full, padding_buffer, mode='constant')
+    # Reshape matrix to 4d tensor
+    cvae_input = cm_data_full.reshape(cm_data_full.shape + (1,))
 
-    # Reshape matrix to 4d tensor 
-    cvae_input = cm_data_full.reshape(cm_data_full.shape + (1,))   
-    
     return cvae_input
+
+
+def stream_cm_to_cvae(cm_data_lists, cvae_input_file, chunk_size=1024,
+                      name='contact_maps', packed=False, start_frames=None):
+    """
+    Streaming version of cm_to_cvae. Reads the upper triangle contact
+    maps in chunks of `chunk_size` frames, converts each chunk to the
+    padded cvae format and writes it into a preallocated dataset. Peak
+    memory depends on `chunk_size`, not on the total number of frames.
+
+    Parameters
+    ----------
+    cm_data_lists : list
+        list containing h5py dataset objects of contact matrices
+        with shape (triu_len, num_frames)
+
+    cvae_input_file : h5py.File
+        open, writable h5 file to store the cvae input in
+
+    chunk_size : int
+        number of frames to read, convert and write at a time
+
+    name : str
+        name of the dataset created in `cvae_input_file`
+
+    packed : bool
+        if True, store the bit-packed upper triangle of each contact map
+        instead of the full padded matrix. The dataset attributes
+        `packed`, `triu_len`, `num_residues` and `padding` describe the
+        layout; see deepdrive.preproc.ContactMapReader.
+
+    start_frames : list
+        first frame to convert for each dataset in `cm_data_lists`,
+        by default all frames are converted
+
+    Returns
+    -------
+    h5py dataset of shape (num_frames, dim, dim, 1), or of shape
+    (num_frames, ceil(triu_len / 8)) if `packed` is True
+
+    """
+    if start_frames is None:
+        start_frames = [0] * len(cm_data_lists)
+
+    num_frames = sum(cm_data.shape[1] - start
+                     for cm_data, start in zip(cm_data_lists, start_frames))
+
+    cvae_input = _create_cvae_dataset(cvae_input_file, name, num_frames,
+                                      cm_data_lists[0].shape[0],
+                                      chunk_size, packed)
+
+    _write_cvae_chunks(cm_data_lists, cvae_input, 0, start_frames, chunk_size)
+
+    return cvae_input
+
+
+def append_cm_to_cvae(cm_data_lists, cvae_input, start_frames, chunk_size=1024):
+    """
+    Append the frames of each contact map dataset starting at the
+    corresponding entry of `start_frames` to the end of an existing
+    cvae input dataset created by stream_cm_to_cvae. The dataset keeps
+    its storage format (dense or bit-packed).
+
+    Parameters
+    ----------
+    cm_data_lists : list
+        list containing h5py dataset objects of contact matrices
+        with shape (triu_len, num_frames)
+
+    cvae_input : h5py.Dataset
+        resizable dataset created by stream_cm_to_cvae
+
+    start_frames : list
+        first frame to convert for each dataset in `cm_data_lists`
+
+    chunk_size : int
+        number of frames to read, convert and write at a time
+
+    Returns
+    -------
+    int : number of frames appended
+
+    """
+    num_new = sum(cm_data.shape[1] - start
+                  for cm_data, start in zip(cm_data_lists, start_frames))
+
+    offset = len(cvae_input)
+    cvae_input.resize(offset + num_new, axis=0)
+
+    _write_cvae_chunks(cm_data_lists, cvae_input, offset,
+                       start_frames, chunk_size)
+
+    return num_new
+
+
+def _create_cvae_dataset(cvae_input_file, name, num_frames, triu_len,
+                         chunk_size, packed):
+    """
+    Create a resizable dataset for num_frames contact maps in either
+    the dense padded cvae format or the bit-packed format.
+
+    """
+    # Number of residues, padded to an even matrix dimension
+    num_res = triu_num_residues(triu_len)
+    dim = num_res + num_res % 2
+
+    if packed:
+        frame_shape, dtype = ((triu_len + 7) // 8,), np.uint8
+    else:
+        frame_shape, dtype = (dim, dim, 1), np.float64
+
+    # Store roughly 1MB of frames per hdf5 chunk so that frames can be
+    # read back individually without touching the whole dataset
+    frame_bytes = int(np.prod(frame_shape)) * np.dtype(dtype).itemsize
+    chunk_frames = max(1, min(chunk_size, num_frames, 2**20 // frame_bytes))
+
+    cvae_input = cvae_input_file.create_dataset(name,
+                                                shape=(num_frames,) + frame_shape,
+                                                maxshape=(None,) + frame_shape,
+                                                dtype=dtype,
+                                                chunks=(chunk_frames,) + frame_shape)
+
+    if packed:
+        # Metadata needed to unpack and pad the contact maps
+        cvae_input.attrs['packed'] = True
+        cvae_input.attrs['triu_len'] = triu_len
+        cvae_input.attrs['num_residues'] = num_res
+        cvae_input.attrs['padding'] = dim - num_res
+
+    return cvae_input
+
+
+def _write_cvae_chunks(cm_data_lists, cvae_input, offset, start_frames,
+                       chunk_size):
+    """
+    Convert frames [start, end) of each contact map dataset chunk by
+    chunk and write them contiguously into cvae_input from offset on.
+
+    """
+    packed = bool(cvae_input.attrs.get('packed', False))
+
+    if not packed:
+        # Reuse a single buffer for every chunk
+        max_frames = max(cm_data.shape[1] - first
+                         for cm_data, first in zip(cm_data_lists, start_frames))
+        buffer = np.empty((min(chunk_size, max_frames),) + cvae_input.shape[1:3],
+                          dtype=cvae_input.dtype)
+
+    for cm_data, first in zip(cm_data_lists, start_frames):
+        for start in range(first, cm_data.shape[1], chunk_size):
+            if packed and isinstance(cm_data, PackedContactMaps):
+                # Both are packed the same way, copy the bytes as is
+                chunk = cm_data.dset[start:start + chunk_size]
+                cvae_input[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+                continue
+
+            # Only chunk_size frames are held in memory at a time
+            chunk = cm_data[:, start:start + chunk_size].T
+            if packed:
+                chunk = pack_triu_batch(chunk)
+            else:
+                chunk = triu_to_full_batch(chunk, out=buffer[:len(chunk)])
+                chunk = chunk[..., np.newaxis]
+            cvae_input[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+
+    return offset
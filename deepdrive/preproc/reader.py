@@ -0,0 +1,123 @@
+import numpy as np
+from .preproc import triu_to_full_batch, unpack_triu_batch
+
+
+class ContactMapReader:
+    """
+    Read access to the contact map dataset of a preprocessed cvae-input
+    h5 file. Contact maps are always returned in the padded cvae format
+    (num_frames, dim, dim, 1); bit-packed datasets written with
+    stream_cm_to_cvae(..., packed=True) are unpacked on demand.
+
+    Example
+    -------
+    with open_h5('cvae-input.h5') as file:
+        reader = ContactMapReader(file)
+        for start, batch in reader.batches(1024):
+            ...
+
+    """
+    def __init__(self, h5_file, name='contact_maps', dtype=np.float32,
+                 batch_size=1024):
+        """
+        Parameters
+        ----------
+        h5_file : h5py.File
+            open cvae-input h5 file
+
+        name : str
+            name of the contact map dataset
+
+        dtype : np.dtype
+            dtype of unpacked contact maps. Dense datasets are
+            returned with their stored dtype.
+
+        batch_size : int
+            max number of frames unpacked at a time when reading
+            large selections of a packed dataset
+
+        """
+        self.dset = h5_file[name]
+        self.packed = bool(self.dset.attrs.get('packed', False))
+        self.batch_size = batch_size
+
+        if self.packed:
+            self.dtype = np.dtype(dtype)
+            self.triu_len = int(self.dset.attrs['triu_len'])
+            dim = int(self.dset.attrs['num_residues'] + self.dset.attrs['padding'])
+            self.shape = (len(self.dset), dim, dim, 1)
+        else:
+            self.dtype = self.dset.dtype
+            self.shape = self.dset.shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        """
+        Read the contact maps selected by an integer, a slice or an
+        array of frame indices. Index arrays need not be sorted or unique.
+
+        """
+        if isinstance(key, (int, np.integer)):
+            return self._convert(self.dset[key][np.newaxis])[0]
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return self._read_range(start, stop)
+            key = np.arange(start, stop, step)
+
+        # h5py only supports increasing, unique index lists
+        unique, inverse = np.unique(np.asarray(key), return_inverse=True)
+        return self._convert(self.dset[unique])[inverse]
+
+    def batches(self, batch_size=None, start=0, stop=None):
+        """
+        Generator over consecutive batches of contact maps.
+
+        Parameters
+        ----------
+        batch_size : int
+            number of frames per batch, defaults to self.batch_size
+
+        start : int
+            first frame to read
+
+        stop : int
+            frame to stop reading at, defaults to the end of the dataset
+
+        Yields
+        ------
+        tuple of the index of the first frame in the batch and
+        the batch of contact maps
+
+        """
+        batch_size = batch_size or self.batch_size
+        stop = len(self) if stop is None else stop
+        for batch_start in range(start, stop, batch_size):
+            batch_stop = min(batch_start + batch_size, stop)
+            yield batch_start, self._read_range(batch_start, batch_stop)
+
+    def _read_range(self, start, stop):
+        if not self.packed:
+            return self.dset[start:stop]
+
+        # Unpack into a preallocated array batch by batch to
+        # avoid holding intermediate copies of the whole range
+        out = np.empty((max(stop - start, 0),) + self.shape[1:], dtype=self.dtype)
+        for batch_start in range(start, stop, self.batch_size):
+            batch_stop = min(batch_start + self.batch_size, stop)
+            self._convert(self.dset[batch_start:batch_stop],
+                          out=out[batch_start - start:batch_stop - start])
+        return out
+
+    def _convert(self, batch, out=None):
+        if not self.packed:
+            return batch
+
+        triu = unpack_triu_batch(batch, self.triu_len, self.dtype)
+        if out is None:
+            out = np.empty((len(batch),) + self.shape[1:], dtype=self.dtype)
+        triu_to_full_batch(triu, out=out[..., 0])
+        return out
@@ -32,6 +32,20 @@ class TaskManager(metaclass=ABCMeta):
         if self.gpu_reqs:
             task.gpu_reqs = self.gpu_reqs
 
+    def environment_setup(self):
+        """
+        Returns
+        -------
+        list of shell commands loading modules and activating the
+        conda environment for DeepDriveMD script dependencies.
+
+        """
+        return ['module load python/3.6.6-anaconda3-5.3.0',
+                'module load hdf5/1.10.3',
+                'module load cuda/10.1.168',
+                '. /sw/summit/python/3.6/anaconda3/5.3.0/etc/profile.d/conda.sh',
+                f'conda activate {self.prefix}/conda-env/']
+
     def load_environment(self, task):
         """
         Loads modules and activates conda environment for
@@ -41,11 +55,7 @@ class TaskManager(metaclass=ABCMeta):
         ----------
         task : radical.entk.Task
         """
-        task.pre_exec.extend(['module load python/3.6.6-anaconda3-5.3.0',
-                              'module load hdf5/1.10.3',
-                              'module load cuda/10.1.168',
-                              '. /sw/summit/python/3.6/anaconda3/5.3.0/etc/profile.d/conda.sh',
-                              f'conda activate {self.prefix}/conda-env/'])
+        task.pre_exec.extend(self.environment_setup())
 
     def set_python_executable(self, task):
         """
@@ -57,6 +67,38 @@ class TaskManager(metaclass=ABCMeta):
         """
         task.executable = [f'{self.prefix}/conda-env/bin/python']
 
+    def use_worker(self, task, queue_dir, timeout=600., max_workers=1):
+        """
+        Run the script of task.arguments in a warm worker of the node,
+        see deepdrive.worker, instead of in a new python process. A
+        worker is started with the environment of load_environment by
+        the first task needing it, which then skips the environment
+        setup. Call instead of load_environment and
+        set_python_executable, once task.arguments is set.
+
+        Parameters
+        ----------
+        task : radical.entk.Task
+
+        queue_dir : str
+            directory of the worker queues, one per node
+
+        timeout : float
+            seconds to wait for a worker to start before running the
+            script in a new process
+
+        max_workers : int
+            number of workers per node and GPUs, e.g. the number of
+            tasks of the stage that may run there at once
+        """
+        task.executable = [f'{self.prefix}/conda-env/bin/python']
+        task.arguments = [f'{self.prefix}/deepdrive/worker/client.py',
+                          '--queue_dir', queue_dir,
+                          '--setup', '; '.join(self.environment_setup()),
+                          '--timeout', f'{timeout}',
+                          '--max_workers', f'{max_workers}',
+                          '--'] + list(task.arguments)
+
     @abstractmethod
     def tasks(self, pipeline_id):
         """
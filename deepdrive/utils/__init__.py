@@ -1 +1,2 @@
-from .utils import get_id
+from .utils import get_id, prefetch
+from .profiling import TaskProfiler
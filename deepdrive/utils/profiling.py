@@ -0,0 +1,384 @@
+import os
+import sys
+import json
+import time
+import atexit
+import socket
+import resource
+from glob import glob
+from contextlib import contextmanager
+
+# Environment variables set in the pre_exec of profiled tasks by DeepDriveMD
+PROFILE_DIR_ENV = 'DEEPDRIVE_PROFILE_DIR'
+TASK_START_ENV = 'DEEPDRIVE_TASK_START'
+EXEC_START_ENV = 'DEEPDRIVE_EXEC_START'
+TASK_ENVS = {'uid': 'DEEPDRIVE_TASK_UID',
+             'stage': 'DEEPDRIVE_STAGE',
+             'pipeline_id': 'DEEPDRIVE_PIPELINE_ID'}
+
+# Profilers to be saved at exit
+_pending = []
+
+# Number of profiles saved by this process without a task uid
+_saved = 0
+
+# Number of tasks begun by this process with reset_peak_rss
+_tasks_begun = 0
+
+# Whether the peak memory of this process covers the current task only,
+# False once it ran earlier tasks without resetting the peak
+_task_peak = True
+
+
+def _io_counters():
+    """
+    Bytes read and written by this process. rchar and wchar count all
+    reads and writes, read_bytes and write_bytes those hitting storage.
+
+    """
+    try:
+        with open('/proc/self/io') as file:
+            return {key: int(value) for key, value in
+                    (line.split(':') for line in file)}
+    except OSError:
+        return {}
+
+
+def _peak_rss():
+    """Peak resident set size of this process in bytes since the last reset."""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of this process, so profiles of
+    the next task report its own peak, for long-lived processes running
+    several tasks, see deepdrive.worker. Where the kernel does not
+    support it, later profiles report the peak of the whole process
+    and set peak_rss_scope to 'process'.
+
+    """
+    global _task_peak, _tasks_begun
+    _tasks_begun += 1
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        _task_peak = False
+
+
+class TaskProfiler:
+    """
+    Records the phase timings, peak memory and I/O of a task and saves
+    them as a JSON file in the directory given by the
+    DEEPDRIVE_PROFILE_DIR environment variable, which DeepDriveMD sets
+    for every task when profiling. The profile is saved when the
+    process exits, also on errors, or by save_pending in processes
+    running several tasks. Without a directory, nothing is saved.
+
+    For tasks profiled by DeepDriveMD, the time spent before the
+    profiler is created is recorded as the 'pre_exec' phase, running
+    the task's pre_exec commands, and the 'import' phase, from the end
+    of pre_exec to the creation of the profiler.
+
+    Phases are either timed with the phase context manager or, for
+    consecutive phases of a script, started with mark, which ends the
+    phase started by the previous mark.
+
+    Example
+    -------
+    profiler = TaskProfiler('cvae')
+    profiler.mark('read')
+    data = load()
+    profiler.mark('compute')
+    model.train(data)
+    with profiler.phase('write'):
+        model.save()
+
+    """
+    def __init__(self, name, profile_dir=None):
+        """
+        Parameters
+        ----------
+        name : str
+            name of the task type, e.g. the script name
+
+        profile_dir : str
+            directory to save the profile in, defaults to the
+            DEEPDRIVE_PROFILE_DIR environment variable
+
+        """
+        self.name = name
+        self.profile_dir = profile_dir or os.environ.get(PROFILE_DIR_ENV)
+        self.start = time.time()
+        self.phases = []
+        self._current = None
+        self._io_start = _io_counters()
+
+        task_start = os.environ.get(TASK_START_ENV)
+        exec_start = os.environ.get(EXEC_START_ENV)
+        if task_start and exec_start:
+            self.phases.append(('pre_exec', float(task_start), float(exec_start)))
+            self.phases.append(('import', float(exec_start), self.start))
+
+        if self.profile_dir:
+            atexit.register(self.save)
+            _pending.append(self)
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager timing the enclosed code as phase `name`."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, start, time.time()))
+
+    def mark(self, name=None):
+        """End the phase started by the previous mark and start phase `name`."""
+        now = time.time()
+        if self._current:
+            self.phases.append((self._current[0], self._current[1], now))
+        self._current = (name, now) if name else None
+
+    def record(self):
+        """
+        Returns
+        -------
+        dict describing the task so far
+
+        """
+        io_end = _io_counters()
+        # The peak of children is over all children the process waited
+        # for and cannot be reset, so it is only kept for its first task
+        children_rss = None
+        if _tasks_begun <= 1:
+            children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+        record = {key: os.environ.get(env) for key, env in TASK_ENVS.items()}
+        record.update({
+            'name': self.name,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'argv': sys.argv,
+            'start': min([self.start] + [start for _, start, _ in self.phases]),
+            'end': time.time(),
+            'phases': [{'name': name, 'start': start, 'end': end}
+                       for name, start, end in self.phases],
+            'peak_rss': _peak_rss(),
+            'peak_rss_scope': 'task' if _task_peak else 'process',
+            'children_peak_rss': children_rss,
+            'io': {key: io_end[key] - self._io_start.get(key, 0)
+                   for key in ('rchar', 'wchar', 'read_bytes', 'write_bytes')
+                   if key in io_end}
+        })
+        return record
+
+    def save(self):
+        """
+        Write the profile to <profile_dir>/<name>-<uid>.json, with the
+        task uid exported by DeepDriveMD, or to
+        <profile_dir>/<name>-<host>-<pid>-<n>.json for the n-th
+        profile saved by a process running tasks outside DeepDriveMD
+
+        Returns
+        -------
+        path of the written file, or None if profiling is disabled
+
+        """
+        self.mark(None)
+
+        if not self.profile_dir:
+            return None
+
+        global _saved
+        os.makedirs(self.profile_dir, exist_ok=True)
+        uid = os.environ.get(TASK_ENVS['uid'])
+        if uid:
+            path = os.path.join(self.profile_dir, f'{self.name}-{uid}.json')
+        else:
+            _saved += 1
+            path = os.path.join(self.profile_dir, f'{self.name}-{socket.gethostname()}-'
+                                                  f'{os.getpid()}-{_saved}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.record(), file)
+        os.replace(tmp_path, path)
+        return path
+
+
+def save_pending():
+    """
+    Save the profiles of all TaskProfilers not saved yet instead of at
+    exit, for long-lived processes running several tasks, see
+    deepdrive.worker.
+
+    Returns
+    -------
+    list of the paths of the written files
+
+    """
+    paths = []
+    while _pending:
+        profiler = _pending.pop()
+        atexit.unregister(profiler.save)
+        paths.append(profiler.save())
+    return paths
+
+
+def load_profiles(profile_dir):
+    """
+    Load the stage records written by DeepDriveMD and the task
+    profiles written by TaskProfiler in the pipeline-<id>
+    subdirectories of profile_dir.
+
+    Returns
+    -------
+    tuple of (stages, tasks), lists of dicts
+
+    """
+    stages_path = os.path.join(profile_dir, 'stages.json')
+    stages = []
+    if os.path.exists(stages_path):
+        with open(stages_path) as file:
+            stages = json.load(file)
+
+    tasks = []
+    for path in sorted(glob(os.path.join(profile_dir, 'pipeline-*', '*.json'))):
+        with open(path) as file:
+            tasks.append(json.load(file))
+
+    return stages, tasks
+
+
+def stage_start(stage, tasks):
+    """
+    Start of a stage: the start of its first task if profiled, else its
+    submission, which may precede its start by the preceding stages.
+
+    """
+    starts = [task['start'] for task in tasks if task.get('uid') in stage['tasks']]
+    return min(starts, default=stage['submit'])
+
+
+def chrome_trace(stages, tasks):
+    """
+    Timeline of stages, tasks and task phases in the Chrome trace
+    event format, viewable in chrome://tracing or Perfetto. Each
+    pipeline iteration is a process whose first thread shows the
+    stages and whose other threads show one task each.
+
+    Returns
+    -------
+    dict to be saved as JSON
+
+    """
+    times = [stage['submit'] for stage in stages] + [task['start'] for task in tasks]
+    origin = min(times, default=0.)
+    us = lambda t: (t - origin) * 1e6
+
+    def pid_of(pipeline_id):
+        return int(pipeline_id) + 1 if pipeline_id is not None else 0
+
+    events, threads = [], {}
+
+    def tid_of(pid, name):
+        if (pid, name) not in threads:
+            threads[(pid, name)] = sum(key[0] == pid for key in threads)
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': pid,
+                           'tid': threads[(pid, name)], 'args': {'name': name}})
+        return threads[(pid, name)]
+
+    for stage in stages:
+        pid = pid_of(stage['pipeline_id'])
+        tid = tid_of(pid, 'stages')
+        start = stage_start(stage, tasks)
+        events.append({'ph': 'X', 'name': stage['stage'], 'cat': 'stage',
+                       'pid': pid, 'tid': tid, 'ts': us(start),
+                       'dur': (stage['end'] - start) * 1e6,
+                       'args': {'tasks': len(stage['tasks']),
+                                'submit_ms': (stage['submit'] - origin) * 1e3}})
+
+    for task in tasks:
+        pid = pid_of(task.get('pipeline_id'))
+        tid = tid_of(pid, f'{task.get("stage") or task["name"]} {task.get("uid") or task["pid"]}')
+        events.append({'ph': 'X', 'name': task['name'], 'cat': 'task',
+                       'pid': pid, 'tid': tid, 'ts': us(task['start']),
+                       'dur': (task['end'] - task['start']) * 1e6,
+                       'args': {'host': task['host'], 'peak_rss': task['peak_rss'],
+                                **task['io']}})
+        for phase in task['phases']:
+            events.append({'ph': 'X', 'name': phase['name'], 'cat': 'phase',
+                           'pid': pid, 'tid': tid, 'ts': us(phase['start']),
+                           'dur': (phase['end'] - phase['start']) * 1e6})
+
+    for pid in sorted({key[0] for key in threads}):
+        events.append({'ph': 'M', 'name': 'process_name', 'pid': pid,
+                       'args': {'name': f'iteration {pid - 1}' if pid else 'other'}})
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def summary_table(stages, tasks):
+    """
+    Per iteration and stage: wall time, number of tasks, mean duration
+    of each task phase, maximum peak RSS and total bytes read and
+    written by the tasks.
+
+    Returns
+    -------
+    str holding the formatted table
+
+    """
+    rows = {}
+    for task in tasks:
+        if task.get('pipeline_id') is None:
+            continue
+        key = (int(task['pipeline_id']), task.get('stage') or task['name'])
+        row = rows.setdefault(key, {'start': task['start'], 'wall': None, 'tasks': []})
+        row['start'] = min(row['start'], task['start'])
+        row['tasks'].append(task)
+
+    for stage in stages:
+        key = (int(stage['pipeline_id']), stage['stage'])
+        row = rows.setdefault(key, {'wall': None, 'tasks': []})
+        row['start'] = stage_start(stage, row['tasks'])
+        row['wall'] = stage['end'] - row['start']
+
+    phases = []
+    for task in tasks:
+        for phase in task['phases']:
+            if phase['name'] not in phases:
+                phases.append(phase['name'])
+
+    header = ['iter', 'stage', 'wall (s)', 'tasks'] + \
+             [f'{phase} (s)' for phase in phases] + \
+             ['peak RSS (MB)', 'read (MB)', 'written (MB)']
+    lines = [header]
+    # Stages of each iteration in the order they started
+    for (pipeline_id, stage), row in sorted(rows.items(),
+                                            key=lambda item: (item[0][0], item[1]['start'])):
+        row_tasks = row['tasks']
+        line = [str(pipeline_id), stage,
+                f'{row["wall"]:.1f}' if row['wall'] is not None else '-',
+                str(len(row_tasks))]
+        for phase in phases:
+            durations = [p['end'] - p['start'] for task in row_tasks
+                         for p in task['phases'] if p['name'] == phase]
+            line.append(f'{sum(durations) / len(row_tasks):.1f}' if durations else '-')
+        line.append(f'{max([t["peak_rss"] for t in row_tasks], default=0) / 2**20:.0f}')
+        line.append(f'{sum(t["io"].get("rchar", 0) for t in row_tasks) / 2**20:.0f}')
+        line.append(f'{sum(t["io"].get("wchar", 0) for t in row_tasks) / 2**20:.0f}')
+        lines.append(line)
+
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    return '\n'.join(' '.join(value.rjust(width) for value, width in zip(line, widths))
+                     for line in lines)
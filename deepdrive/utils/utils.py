@@ -1,3 +1,7 @@
+import queue
+import threading
+
+
 def get_id(filename, prefix, ext):
     """
     Given a path to a file in the form of <path>/<prefix><id>.<ext>
@@ -28,3 +32,44 @@ def get_id(filename, prefix, ext):
         raise Exception(f'ext: {ext} not in filename: {filename}')
 
     return filename.split(prefix)[1].split(ext)[0][:-1]
+
+def prefetch(iterable, size=1):
+    """
+    Iterate over `iterable` while a background thread produces up to
+    `size` items ahead of the consumer. Useful to overlap reading the
+    next batch of data with processing the current one.
+
+    Parameters
+    ----------
+    iterable : iterable
+        items to iterate over, produced on the background thread
+
+    size : int
+        max number of items buffered ahead of the consumer
+
+    Example
+    -------
+    for start, batch in prefetch(reader.batches(1024)):
+        embeddings = encoder.embed(batch)
+
+    """
+    buffer = queue.Queue(maxsize=size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                buffer.put((item, None))
+        except Exception as error:
+            buffer.put((None, error))
+        buffer.put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    while True:
+        item, error = buffer.get()
+        if error is not None:
+            raise error
+        if item is done:
+            return
+        yield item
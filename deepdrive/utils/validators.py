@@ -7,6 +7,12 @@ def validate_positive(ctx, param, value):
         raise click.BadParameter(f'must be greater than or equal to 0, currently {value}')
     return value
 
+def validate_at_least_one(ctx, param, value):
+    """Check that param value, if given, is at least 1."""
+    if value is not None and value < 1:
+        raise click.BadParameter(f'must be greater than or equal to 1, currently {value}')
+    return value
+
 def validate_between_zero_and_one(ctx, param, value):
     """Check that param value is between 0 and 1"""
     if value < 0 or value > 1:
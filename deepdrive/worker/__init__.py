@@ -0,0 +1,2 @@
+from .client import submit, node_queue_dir
+from .server import WorkerServer
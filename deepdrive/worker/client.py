@@ -0,0 +1,267 @@
+"""
+Client of the warm workers of deepdrive.worker.server. Submits a script
+and its arguments to the workers of the node and returns its exit code,
+starting a worker first if none is idle.
+
+Only depends on the standard library and click, so it starts in a
+fraction of the time of the scripts it submits. It can be run by path,
+without importing the deepdrive package:
+
+python deepdrive/worker/client.py --queue_dir data/worker \
+    --setup 'conda activate env' -- scripts/dbscan.py --sim_path ...
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import click
+import shlex
+import socket
+import subprocess
+from glob import glob
+
+# Seconds after which a worker whose heartbeat file was not touched is dead
+HEARTBEAT_TIMEOUT = 30.
+
+
+def node_queue_dir(queue_dir):
+    """
+    Queue directory of the worker of this node and of the GPUs visible
+    to this process, so tasks running on different GPUs of a node run
+    in different workers.
+
+    """
+    name = socket.gethostname()
+    devices = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if devices:
+        name = f'{name}-gpu{devices.replace(",", "_")}'
+    return os.path.join(queue_dir, name)
+
+
+def is_alive(queue_dir, slot=0, timeout=HEARTBEAT_TIMEOUT):
+    """Whether the worker of a slot is serving queue_dir."""
+    try:
+        path = os.path.join(queue_dir, f'heartbeat-{slot}')
+        return time.time() - os.path.getmtime(path) < timeout
+    except OSError:
+        return False
+
+
+def is_starting(queue_dir, slot=0, startup_timeout=600.):
+    """Whether a client started the worker of a slot less than startup_timeout ago."""
+    try:
+        path = os.path.join(queue_dir, f'starting-{slot}')
+        return time.time() - os.path.getmtime(path) < startup_timeout
+    except OSError:
+        return False
+
+
+def is_busy(queue_dir, slot=0):
+    """Whether the worker of a slot claimed a request it did not finish."""
+    try:
+        return bool(os.listdir(os.path.join(queue_dir, 'running', f'{slot}')))
+    except OSError:
+        return False
+
+
+def start_worker(queue_dir, slot=0, setup='', python=sys.executable, preload=(),
+                 startup_timeout=600.):
+    """
+    Start the worker of a slot of queue_dir in the background, unless
+    another client on the node is already starting it.
+
+    Parameters
+    ----------
+    queue_dir : str
+        queue directory of the node
+
+    slot : int
+        slot of the worker, each slot runs at most one worker
+
+    setup : str
+        shell commands setting up the environment of the worker, e.g.
+        module loads and conda activation
+
+    python : str
+        python executable of the worker
+
+    preload : list
+        scripts the worker imports before serving requests
+
+    startup_timeout : float
+        seconds after which a worker that did not start is started again
+
+    """
+    os.makedirs(queue_dir, exist_ok=True)
+    lock_path = os.path.join(queue_dir, f'starting-{slot}')
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        if is_starting(queue_dir, slot, startup_timeout):
+            return
+        os.utime(lock_path)
+    else:
+        os.close(fd)
+
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    command = ' '.join(['exec', shlex.quote(python), shlex.quote(server),
+                        '--queue_dir', shlex.quote(queue_dir),
+                        '--slot', f'{slot}'] +
+                       [f'--preload {shlex.quote(script)}' for script in preload])
+    if setup:
+        command = f'{setup}\n{command}'
+
+    with open(os.path.join(queue_dir, f'worker-{slot}.log'), 'a') as log:
+        # Detached from the task so it outlives it
+        subprocess.Popen(['bash', '-c', command], stdout=log, stderr=log,
+                         stdin=subprocess.DEVNULL, start_new_session=True)
+
+
+def _scale_workers(queue_dir, max_workers, setup, script):
+    """
+    Start a worker in a free slot if the pending requests outnumber the
+    idle and starting workers.
+
+    Returns
+    -------
+    bool whether a worker of queue_dir is alive
+
+    """
+    alive = [slot for slot in range(max_workers) if is_alive(queue_dir, slot)]
+    idle = [slot for slot in alive if not is_busy(queue_dir, slot)]
+    free = [slot for slot in range(max_workers)
+            if slot not in alive and not is_starting(queue_dir, slot)]
+    starting = max_workers - len(alive) - len(free)
+    pending = len(glob(os.path.join(queue_dir, 'requests', '*.json')))
+    if free and pending > len(idle) + starting:
+        start_worker(queue_dir, free[0], setup, preload=[script])
+    return bool(alive)
+
+
+def submit(queue_dir, script, args, env=None, setup='', timeout=None,
+           max_workers=1, poll_interval=0.1):
+    """
+    Run script with args in a worker serving queue_dir and wait for it
+    to finish. While the request waits and no worker is idle, a worker
+    is started in one of the max_workers slots of queue_dir, so up to
+    max_workers requests run at once. The output of the script is
+    written to the stdout and stderr of this process.
+
+    Parameters
+    ----------
+    queue_dir : str
+        queue directory of the node
+
+    script : str
+        path of a script whose `main` is a click command
+
+    args : list
+        command line arguments of the script
+
+    env : dict
+        environment variables set while the script runs, defaults to
+        the DEEPDRIVE_ variables of this process
+
+    setup : str
+        shell commands setting up the environment of a started worker
+
+    timeout : float
+        seconds to wait for a worker to pick up the request while no
+        worker is alive, e.g. because workers fail to start, before
+        withdrawing it, or None to wait indefinitely. Time spent
+        waiting behind busy workers that are alive does not count.
+
+    max_workers : int
+        number of worker slots of queue_dir
+
+    Returns
+    -------
+    int exit code of the script, or None if the request was withdrawn
+
+    """
+    if env is None:
+        env = {key: value for key, value in os.environ.items()
+               if key.startswith('DEEPDRIVE_')}
+
+    request_id = f'{time.time():.6f}-{uuid.uuid4().hex[:8]}'
+    request = {'id': request_id, 'script': os.path.abspath(script),
+               'args': list(args), 'cwd': os.getcwd(), 'env': env}
+
+    for name in ['requests', 'running', 'results']:
+        os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+
+    # Requests appear atomically for the workers
+    request_path = os.path.join(queue_dir, 'requests', f'{request_id}.json')
+    with open(f'{request_path}.tmp', 'w') as file:
+        json.dump(request, file)
+    os.replace(f'{request_path}.tmp', request_path)
+
+    result_path = os.path.join(queue_dir, 'results', f'{request_id}.json')
+    last_alive = time.time()
+    while not os.path.exists(result_path):
+        time.sleep(poll_interval)
+        if os.path.exists(request_path):
+            if _scale_workers(queue_dir, max_workers, setup, script):
+                last_alive = time.time()
+            elif timeout is not None and time.time() - last_alive > timeout:
+                try:
+                    os.remove(request_path)
+                    return None
+                except FileNotFoundError:
+                    # Picked up in the meantime
+                    continue
+            continue
+
+        # Claimed requests are in the running directory of the slot
+        for path in glob(os.path.join(queue_dir, 'running', '*', f'{request_id}.json')):
+            slot = os.path.basename(os.path.dirname(path))
+            if not is_alive(queue_dir, slot) and not os.path.exists(result_path):
+                raise RuntimeError(f'Worker {slot} of {queue_dir} died running {script}')
+
+    with open(result_path) as file:
+        result = json.load(file)
+
+    for name, stream in [('stdout', sys.stdout), ('stderr', sys.stderr)]:
+        with open(result[name]) as file:
+            stream.write(file.read())
+        os.remove(result[name])
+    os.remove(result_path)
+
+    return result['exit_code']
+
+
+@click.command(context_settings={'ignore_unknown_options': True})
+@click.option('-q', '--queue_dir', required=True,
+              type=click.Path(),
+              help='Directory of the queue directories of each node')
+
+@click.option('-s', '--setup', default='',
+              help='Shell commands setting up the environment of the worker '
+                   'and of the fallback cold run')
+
+@click.option('-t', '--timeout', default=600., type=float,
+              help='Seconds to wait for a worker to start before running '
+                   'the script in a cold process')
+
+@click.option('-w', '--max_workers', default=1, type=click.IntRange(min=1),
+              help='Number of workers per node and GPUs running requests at once')
+
+@click.argument('script', type=click.Path(exists=True))
+@click.argument('args', nargs=-1, type=click.UNPROCESSED)
+
+def main(queue_dir, setup, timeout, max_workers, script, args):
+    exit_code = submit(node_queue_dir(queue_dir), script, args, setup=setup,
+                       timeout=timeout, max_workers=max_workers)
+    if exit_code is None:
+        # No worker picked up the request, run the script as a cold task would
+        print(f'No worker available, running {script} cold', file=sys.stderr)
+        command = ' '.join(['exec', shlex.quote(sys.executable), shlex.quote(script)] +
+                           [shlex.quote(arg) for arg in args])
+        exit_code = subprocess.call(['bash', '-c', f'{setup}\n{command}' if setup else command])
+
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
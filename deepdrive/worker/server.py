@@ -0,0 +1,267 @@
+"""
+Warm worker running the click scripts of DeepDriveMD tasks in a
+long-lived process, so the modules they import, e.g. Keras,
+TensorFlow and MDAnalysis, and the state they cache, e.g. the
+encoder of the outlier stage, stay loaded between tasks.
+
+Tasks submit requests with deepdrive.worker.client through a queue
+directory on a shared file system, served by the workers of one or
+more slots:
+
+    requests/<id>.json          submitted by clients
+    running/<slot>/<id>.json    claimed by the worker of a slot
+    results/<id>.json           exit code and output files of the script
+    heartbeat-<slot>            touched while the worker of a slot is alive
+    starting-<slot>             created by the client starting the worker
+
+python deepdrive/worker/server.py --queue_dir data/worker/<hostname> --slot 0
+"""
+import os
+import sys
+import json
+import time
+import click
+import threading
+import traceback
+import importlib.util
+from glob import glob
+from contextlib import contextmanager
+from deepdrive.utils.profiling import save_pending, reset_peak_rss
+from deepdrive.worker.client import HEARTBEAT_TIMEOUT
+
+
+@contextmanager
+def _redirected(stdout_path, stderr_path):
+    """
+    Redirect sys.stdout and sys.stderr, and the file descriptors used
+    by child processes, to files.
+
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    streams, saved = (sys.stdout, sys.stderr), (os.dup(1), os.dup(2))
+    with open(stdout_path, 'w') as out, open(stderr_path, 'w') as err:
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        sys.stdout, sys.stderr = out, err
+        try:
+            yield
+        finally:
+            out.flush()
+            err.flush()
+            sys.stdout, sys.stderr = streams
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+
+@contextmanager
+def _task_context(request):
+    """Run with the arguments, environment and working directory of a request."""
+    argv, environ, cwd = sys.argv, dict(os.environ), os.getcwd()
+    sys.argv = [request['script']] + request['args']
+    os.environ.update(request['env'])
+    os.chdir(request['cwd'])
+    try:
+        yield
+    finally:
+        sys.argv = argv
+        os.environ.clear()
+        os.environ.update(environ)
+        os.chdir(cwd)
+
+
+class WorkerServer:
+    """
+    Serves the requests of a queue directory one at a time, running the
+    `main` click command of the requested script in this process. Each
+    script is imported once, on its first request, so module level
+    state of a script is kept between its requests. The workers of
+    other slots may serve the same queue directory concurrently.
+
+    Example
+    -------
+    WorkerServer('data/worker/node1', preload=['scripts/dbscan.py']).serve()
+
+    """
+    def __init__(self, queue_dir, slot=0, preload=(), idle_timeout=600.,
+                 poll_interval=0.05):
+        """
+        Parameters
+        ----------
+        queue_dir : str
+            queue directory of the worker
+
+        slot : int
+            slot of the worker in queue_dir
+
+        preload : list
+            scripts imported before serving requests
+
+        idle_timeout : float
+            seconds without requests after which the worker exits
+
+        poll_interval : float
+            seconds between checks for new requests
+
+        """
+        self.queue_dir = queue_dir
+        self.slot = slot
+        self.running_dir = os.path.join(queue_dir, 'running', f'{slot}')
+        self.preload = preload
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self._modules = {}
+        self._stop = threading.Event()
+
+        for name in ['requests', 'results']:
+            os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+        os.makedirs(self.running_dir, exist_ok=True)
+
+    def module(self, script):
+        """Module of script, imported on first use."""
+        script = os.path.abspath(script)
+        if script not in self._modules:
+            name = os.path.splitext(os.path.basename(script))[0]
+            spec = importlib.util.spec_from_file_location(name, script)
+            module = importlib.util.module_from_spec(spec)
+            # As when run by path, scripts may import the modules next to
+            # them. Registering the module lets child processes unpickle
+            # its functions.
+            sys.path.insert(0, os.path.dirname(script))
+            sys.modules[name] = module
+            spec.loader.exec_module(module)
+            self._modules[script] = module
+        return self._modules[script]
+
+    def run(self, request):
+        """
+        Run the script of a request and write its result.
+
+        Returns
+        -------
+        int exit code of the script
+
+        """
+        prefix = os.path.join(self.queue_dir, 'results', request['id'])
+        stdout_path, stderr_path = f'{prefix}.out', f'{prefix}.err'
+
+        # Profiles of the request report its own peak memory
+        reset_peak_rss()
+        with _redirected(stdout_path, stderr_path), _task_context(request):
+            try:
+                script = request['script']
+                self.module(script).main.main(request['args'],
+                                              prog_name=os.path.basename(script),
+                                              standalone_mode=False)
+                exit_code = 0
+            except click.ClickException as e:
+                e.show()
+                exit_code = e.exit_code
+            except click.Abort:
+                print('Aborted!', file=sys.stderr)
+                exit_code = 1
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                # Profiles are saved at the end of each task, not at exit
+                save_pending()
+
+        result = {'id': request['id'], 'exit_code': exit_code,
+                  'stdout': stdout_path, 'stderr': stderr_path}
+        result_path = f'{prefix}.json'
+        with open(f'{result_path}.tmp', 'w') as file:
+            json.dump(result, file)
+        os.replace(f'{result_path}.tmp', result_path)
+        os.remove(os.path.join(self.running_dir, f'{request["id"]}.json'))
+        return exit_code
+
+    def claim(self):
+        """
+        Claim the oldest request of the queue.
+
+        Returns
+        -------
+        dict of the request, or None if the queue is empty
+
+        """
+        for path in sorted(glob(os.path.join(self.queue_dir, 'requests', '*.json'))):
+            running_path = os.path.join(self.running_dir, os.path.basename(path))
+            try:
+                # Requests withdrawn by their client are skipped
+                os.rename(path, running_path)
+            except FileNotFoundError:
+                continue
+            with open(running_path) as file:
+                return json.load(file)
+        return None
+
+    def _touch_heartbeat(self):
+        path = os.path.join(self.queue_dir, f'heartbeat-{self.slot}')
+        with open(path, 'a'):
+            os.utime(path)
+
+    def _heartbeat(self):
+        while not self._stop.wait(HEARTBEAT_TIMEOUT / 3):
+            self._touch_heartbeat()
+
+    def serve(self):
+        """Serve requests until the worker was idle for idle_timeout seconds."""
+        for script in self.preload:
+            self.module(script)
+
+        # Requests claimed by a previous worker of the slot that died
+        # were failed by their clients
+        for path in glob(os.path.join(self.running_dir, '*.json')):
+            os.remove(path)
+
+        self._touch_heartbeat()
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        # Clients waiting for the worker to start may start another one from now on
+        try:
+            os.remove(os.path.join(self.queue_dir, f'starting-{self.slot}'))
+        except FileNotFoundError:
+            pass
+
+        last_request = time.time()
+        try:
+            while time.time() - last_request < self.idle_timeout:
+                request = self.claim()
+                if request is None:
+                    time.sleep(self.poll_interval)
+                    continue
+                self.run(request)
+                last_request = time.time()
+        finally:
+            # Clients of requests submitted from now on start a new worker
+            self._stop.set()
+            heartbeat.join()
+            os.remove(os.path.join(self.queue_dir, f'heartbeat-{self.slot}'))
+
+
+@click.command()
+@click.option('-q', '--queue_dir', required=True,
+              type=click.Path(),
+              help='Queue directory of the worker')
+
+@click.option('-s', '--slot', default=0, type=int,
+              help='Slot of the worker in the queue directory')
+
+@click.option('-p', '--preload', multiple=True,
+              type=click.Path(exists=True),
+              help='Script imported before serving requests')
+
+@click.option('-t', '--idle_timeout', default=600., type=float,
+              help='Seconds without requests after which the worker exits')
+
+def main(queue_dir, slot, preload, idle_timeout):
+    WorkerServer(queue_dir, slot, preload, idle_timeout).serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,28 @@ from examples.cvae_dbscan.taskmanagers.outlier import OPTICSTaskManager
               type=click.Path(exists=True),
               help='Path to initial pdb file')
 
-def main(pdb_path):
+@click.option('-a', '--async_mode', is_flag=True,
+              help='Overlap MD of the next iteration with ML and '
+                   'outlier detection of the current one')
+
+@click.option('-s', '--max_staleness', default=1, type=int,
+              help='Number of iterations the outliers seeding MD may lag '
+                   'behind in async mode')
+
+@click.option('-b', '--backend', default='entk',
+              type=click.Choice(['entk', 'local']),
+              help='Run on EnTK, or as local subprocesses without the '
+                   'RabbitMQ and MongoDB services')
+
+@click.option('-P', '--profile', is_flag=True,
+              help='Record stage and task timelines in data/profile, '
+                   'see scripts/profile_report.py')
+
+@click.option('-w', '--worker', is_flag=True,
+              help='Run ML and outlier tasks in warm workers that keep '
+                   'their imports loaded between iterations')
+
+def main(pdb_path, async_mode, max_staleness, backend, profile, worker):
     # Create directory structure to store pipeline data
     data_dir = os.path.join(os.getcwd(), 'data')
     for dir_name in ['md', 'preproc', 'ml', 'outlier', 'shared']:
@@ -72,6 +93,7 @@ def main(pdb_path):
 
     ml_kwargs = {
         'num_ml' : 1,
+        'worker': worker,
         'cpu_reqs': { 
             'processes': 1,
             'process_type': None,
@@ -87,6 +109,7 @@ def main(pdb_path):
     }
 
     outlier_kwargs = {
+        'worker': worker,
         'cpu_reqs': { 
             'processes': 1,
             'process_type': None,
@@ -116,7 +139,11 @@ def main(pdb_path):
                                  preprocs=preprocs,
                                  ml_algs=ml_algs,
                                  outlier_algs=outlier_algs,
-                                 resources=resources)
+                                 resources=resources,
+                                 async_mode=async_mode,
+                                 max_staleness=max_staleness,
+                                 backend=backend,
+                                 profile_dir=os.path.join(data_dir, 'profile') if profile else None)
 
     # Start running program on Summit.
     cvae_optics_dd.run()
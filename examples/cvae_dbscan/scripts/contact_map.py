@@ -4,7 +4,11 @@ import click
 from glob import glob
 from contextlib import ExitStack
 from molecules.utils import open_h5
-from deepdrive.preproc import cm_to_cvae
+from deepdrive.preproc import (cm_to_cvae, stream_cm_to_cvae,
+                               append_cm_to_cvae, open_contact_maps,
+                               PreprocManifest, FrameIndex)
+from deepdrive.utils import get_id, TaskProfiler
+from deepdrive.utils.validators import validate_at_least_one
 
 
 @click.command()
@@ -16,36 +20,191 @@ from deepdrive.preproc import cm_to_cvae
               type=click.Path(exists=True),
               help='2D contact map h5 file')
 
-def main(sim_path, out):
+@click.option('-s', '--stream', is_flag=True,
+              help='Convert contact maps in chunks of frames to bound memory usage')
+
+@click.option('-c', '--chunk_size', default=1024, type=int,
+              callback=validate_at_least_one,
+              help='Number of frames converted at a time in streaming mode')
+
+@click.option('-p', '--packed', is_flag=True,
+              help='Store bit-packed upper triangles instead of full matrices')
+
+@click.option('-I', '--incremental', is_flag=True,
+              help='Only convert frames not already recorded in the '
+                   'manifest of an existing cvae-input.h5')
+
+@click.option('-P', '--previous', default=None,
+              type=click.Path(),
+              help='Output directory of an earlier preprocessing task. Frames '
+                   'recorded in its manifest are not converted again, the '
+                   'incremental output only holds the frames converted since')
+
+def main(sim_path, out, stream, chunk_size, packed, incremental, previous):
+
+    # Reading, converting and writing contact maps are interleaved
+    profiler = TaskProfiler('contact_map')
+    profiler.mark('compute')
 
     # Define wildcard path to contact matrix data
     cm_filepath = os.path.join(sim_path, 'output-cm-*.h5')
 
     # Collect contact matrix file names sorted by sim_id
-    cm_files = sorted(glob(cm_filepath))
+    cm_files = sorted(map(os.path.abspath, glob(cm_filepath)))
 
     if not cm_files: 
         raise FileNotFoundError(f'No h5 files found, recheck your input path {sim_path}')
 
+    # Path of the aggregated cvae input file
+    cvae_input_path = os.path.join(out, 'cvae-input.h5')
+
+    # Maps frames of the cvae input file to simulation trajectory frames
+    index_path = os.path.join(out, 'cvae-input-index.npz')
+
+    # Record of the frames already converted from each contact map file
+    manifest_path = os.path.join(out, 'cvae-input-manifest.json')
+
+    manifest = PreprocManifest(manifest_path)
+
+    new_output = False
+    if incremental and previous and not os.path.exists(manifest_path):
+        new_output = seed_from_previous(previous, manifest)
+
+    if incremental and manifest.files and (new_output or (
+            os.path.exists(cvae_input_path) and os.path.exists(index_path))):
+        if append_new_frames(cm_files, cvae_input_path, index_path, manifest,
+                             chunk_size, profiler, packed, new_output):
+            return
+
+        # Previously converted data was rewritten, start from scratch
+        manifest.files = {}
+
     with ExitStack() as stack:
         # Open all h5 files and add them to exit stack
         open_cm_files = map(lambda file: stack.enter_context(open_h5(file)), 
                             cm_files)
 
-        # Iterate through open h5 files and get contact_map datasets 
-        cm_data = list(map(lambda file: file['contact_maps'], open_cm_files))
+        # Iterate through open h5 files and get contact_map datasets,
+        # packed or not, in the (triu_len, num_frames) layout
+        cm_data = list(map(open_contact_maps, open_cm_files))
         
-        # Compress all .h5 files into one in cvae format 
-        cvae_input = cm_to_cvae(cm_data)
+        # Create and open contact map aggregation output file
+        cvae_input_file = stack.enter_context(h5py.File(cvae_input_path, 'w'))
 
-        # Create .h5 as cvae input
-        cvae_input_file = os.path.join(out, 'cvae-input.h5')
+        if stream or packed or incremental:
+            # Convert and write chunk_size frames at a time
+            stream_cm_to_cvae(cm_data, cvae_input_file, chunk_size, packed=packed)
+        else:
+            # Compress all .h5 files into one in cvae format
+            cvae_input = cm_to_cvae(cm_data)
 
-        # Create and open contact map aggregation output file
-        cvae_input_file = stack.enter_context(h5py.File(cvae_input_file, 'w'))
+            # Write aggregated contact map dataset to file
+            cvae_input_file.create_dataset('contact_maps', data=cvae_input)
+
+        profiler.mark('write')
+
+        # Frames are written in the order of cm_files
+        frame_index = FrameIndex()
+        for file, data in zip(cm_files, cm_data):
+            frame_index.append(*sim_files(file), 0, data.shape[1])
+        frame_index.save(index_path)
+
+        if incremental:
+            for file, data in zip(cm_files, cm_data):
+                manifest.update(file, data.shape[1])
+            manifest.save()
+
+
+def sim_files(cm_file):
+    """Trajectory and PDB file of the simulation that wrote cm_file."""
+    sim_id = get_id(cm_file, 'output-cm-', 'h5')
+    sim_path = os.path.dirname(cm_file)
+    return (os.path.join(sim_path, f'output-{sim_id}.dcd'),
+            os.path.join(sim_path, f'input-{sim_id}.pdb'))
+
+
+def seed_from_previous(previous, manifest):
+    """
+    Start the manifest from the one of an earlier preprocessing task.
+    The frames it records stay in the cvae input file of that task and
+    are not converted again, so preprocessing time only depends on the
+    new frames. Readers concatenate the cvae input files of all tasks.
+
+    Returns
+    -------
+    True if the earlier manifest was found
+
+    """
+    previous_path = os.path.join(previous, os.path.basename(manifest.path))
+
+    if not os.path.exists(previous_path):
+        print(f'No incremental preprocessing output in {previous}, starting from scratch')
+        return False
+
+    manifest.files = PreprocManifest(previous_path).files
+    return True
+
+
+def append_new_frames(cm_files, cvae_input_path, index_path, manifest,
+                      chunk_size, profiler, packed=False, new_output=False):
+    """
+    Append only the frames not yet recorded in the manifest to an existing
+    cvae input file, or write them to a new one if new_output is True.
+    Files whose size and modification time are unchanged are skipped
+    without being opened.
+
+    Returns
+    -------
+    False if a previously converted file lost frames or was removed and
+    the cvae input file needs to be rebuilt, otherwise True.
+
+    """
+    if any(not os.path.exists(file) for file in manifest.files):
+        return False
+
+    modified = [file for file in cm_files if manifest.is_modified(file)]
+
+    if not modified and not new_output:
+        print('No new contact map frames to preprocess')
+        return True
+
+    # A new cvae input file is written even without new frames, its
+    # layout is taken from the first contact map file
+    files = modified or cm_files[:1]
+
+    with ExitStack() as stack:
+        cm_data = [open_contact_maps(stack.enter_context(open_h5(file)))
+                   for file in files]
+        start_frames = [manifest.frames(file) for file in files]
+        num_frames = [data.shape[1] for data in cm_data]
+
+        if any(frames < start for frames, start in zip(num_frames, start_frames)):
+            return False
+
+        if new_output:
+            cvae_input_file = stack.enter_context(h5py.File(cvae_input_path, 'w'))
+            num_new = len(stream_cm_to_cvae(cm_data, cvae_input_file, chunk_size,
+                                            packed=packed, start_frames=start_frames))
+            frame_index = FrameIndex()
+        else:
+            cvae_input_file = stack.enter_context(h5py.File(cvae_input_path, 'a'))
+            num_new = append_cm_to_cvae(cm_data, cvae_input_file['contact_maps'],
+                                        start_frames, chunk_size)
+            frame_index = FrameIndex.load(index_path)
+
+    profiler.mark('write')
+
+    # New frames are appended in the order of files
+    for file, start, frames in zip(files, start_frames, num_frames):
+        frame_index.append(*sim_files(file), start, frames - start)
+    frame_index.save(index_path)
+
+    for file, frames in zip(files, num_frames):
+        manifest.update(file, frames)
+    manifest.save()
 
-        # Write aggregated contact map dataset to file
-        cvae_input_file.create_dataset('contact_maps', data=cvae_input)
+    print(f'Appended {num_new} new contact map frames from {len(modified)} files')
+    return True
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
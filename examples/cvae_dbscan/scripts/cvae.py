@@ -1,6 +1,10 @@
 import os
+import time
 import click
+import multiprocessing
 import numpy as np
+from contextlib import ExitStack
+from keras import backend as K
 from keras.optimizers import RMSprop
 from molecules.utils import open_h5
 from molecules.ml.unsupervised import (VAE, EncoderConvolution2D, 
@@ -9,61 +13,95 @@ from molecules.ml.unsupervised import (VAE, EncoderConvolution2D,
                                        DecoderHyperparams)
 from molecules.ml.unsupervised.callbacks import (EmbeddingCallback,
                                                 LossHistory)
+from deepdrive.preproc import ContactMapReader
+from deepdrive.ml import (ContactMapSequence, ModelRegistry, split_blocks,
+                          shared_array)
+from deepdrive.ml.callbacks import BudgetedEarlyStopping
+from deepdrive.ml.warmstart import (is_compatible, optimizer_state_path,
+                                    save_optimizer_state,
+                                    load_optimizer_state)
+from deepdrive.utils import TaskProfiler
 from deepdrive.utils.validators import validate_positive
 
 
-@click.command()
-@click.option('-i', '--input', 'input_path', required=True,
-              type=click.Path(exists=True),
-              help='Path to file containing preprocessed contact matrix data')
+def load_shuffled(input_path, seed):
+    """Contact maps of input_path in memory, in random order."""
+    with open_h5(input_path) as input_file:
+        data = ContactMapReader(input_file)[:]
 
-@click.option('-o', '--out', 'out_path', required=True,
-              type=click.Path(exists=True),
-              help='Output directory for model data')
+    # Shuffle data before train validation split
+    np.random.seed(seed)
+    np.random.shuffle(data)
+    return data
 
-@click.option('-m', '--model_id', required=True,
-              help='Model ID in for file naming')
 
-@click.option('-g', '--gpu', default=0, type=int,
-              callback=validate_positive,
-              help='GPU id')
+def load_dataset(input_path, batch_size, out_of_core, seed, shared_path=None):
+    """
+    Train and validation data of the contact maps of input_path.
 
-@click.option('-e', '--epochs', default=100, type=int,
-              callback=validate_positive,
-              help='Number of epochs to train for')
+    Parameters
+    ----------
+    shared_path : str
+        .npy file of the shuffled contact maps, shared by the processes
+        of a sweep, read instead of input_path
 
-@click.option('-b', '--batch_size', default=512, type=int,
-              callback=validate_positive,
-              help='Batch size for training')
+    Returns
+    -------
+    tuple of (stack, train, valid, embed_data, input_shape) where stack
+    keeps the input file open for out-of-core training until closed
 
-@click.option('-d', '--latent_dim', default=3, type=int,
-              callback=validate_positive,
-              help='Number of dimensions in latent space')
+    """
+    stack = ExitStack()
 
-def main(input_path, out_path, model_id, gpu, epochs, batch_size, latent_dim):
+    if shared_path:
+        # Contact maps shuffled by the parent process, mapped read-only
+        data = np.load(shared_path, mmap_mode='r')
+        input_shape = data.shape[1:]
+    elif not out_of_core:
+        data = load_shuffled(input_path, seed)
+        input_shape = data.shape[1:]
+    else:
+        # Out-of-core training keeps the input file open until training is done
+        input_file = stack.enter_context(open_h5(input_path))
 
-    # Set CUDA environment variables
-    os.environ['CUDA_DEVICE_ORDER'] = 'PCI_BUS_ID'
-    os.environ['CUDA_VISIBLE_DEVICES'] = str(gpu)
+        # Access contact matrix data from h5 file, unpacking
+        # bit-packed contact maps if necessary
+        reader = ContactMapReader(input_file)
 
-    with open_h5(input_path) as input_file:
+        # Get shape of an individual contact matrix
+        # (ignore total number of matrices)
+        input_shape = reader.shape[1:]
 
-        # Access contact matrix data from h5 file
-        data = np.array(input_file['contact_maps'])
+        # 80-20 train validation split over hdf5 chunks of frames
+        block_size = reader.dset.chunks[0] if reader.dset.chunks else batch_size
+        train_blocks, valid_blocks = split_blocks(len(reader), block_size,
+                                                  valid_fraction=0.2, seed=seed)
 
-    # Shuffle data before train validation split
-    np.random.shuffle(data)
+        # Batches are read from the h5 file as they are needed
+        train = ContactMapSequence(reader, train_blocks, batch_size, seed=seed)
+        valid = ContactMapSequence(reader, valid_blocks, batch_size, shuffle=False)
+
+        # Embed random frames of the whole dataset, in which
+        # case idx refers to frames of the cvae-input file
+        return stack, train, valid, reader, input_shape
 
     # 80-20 train validation split index
     split = int(0.8 * len(data))
 
     # Partition input data into 80-20 train valid split
     train, valid = data[:split], data[split:]
+    return stack, train, valid, train, input_shape
 
-    # Get shape of an individual contact matrix
-    # (ignore total number of matrices)
-    input_shape = train.shape[1:]
 
+def train_model(train, valid, embed_data, input_shape, input_path, out_path,
+                model_id, latent_dim, epochs, batch_size, out_of_core,
+                registry_path, warm_start, warm_epochs, patience, min_delta,
+                time_budget, profiler=None):
+    """
+    Train one CVAE and write its weights, hyperparameters, embeddings
+    and losses to out_path with model_id in the file names.
+
+    """
     # Set model hyperparameters for encoder and decoder
     shared_hparams = {'num_conv_layers': 4,
                       'filters': [64, 64, 64, 64],
@@ -98,16 +136,61 @@ def main(input_path, out_path, model_id, gpu, epochs, batch_size, latent_dim):
                decoder=decoder,
                optimizer=optimizer)
 
+    registry = ModelRegistry(registry_path) if registry_path else None
+
+    # Fine-tune a compatible model of the previous iteration instead of
+    # training from a random initialization
+    warm_started = False
+    if warm_start and is_compatible(warm_start, latent_dim,
+                                    input_shape, registry):
+        try:
+            cvae.load_weights(warm_start)
+        except ValueError as e:
+            print(f'Cannot warm start from {warm_start}: {e}')
+        else:
+            warm_started = True
+            opt_path = optimizer_state_path(warm_start)
+            if os.path.exists(opt_path):
+                load_optimizer_state(cvae.graph, opt_path)
+            if warm_epochs is not None:
+                epochs = warm_epochs
+            print(f'Warm started from {warm_start}, training for {epochs} epochs')
+
     # Define callbacks to report model performance for analysis
-    embed_callback = EmbeddingCallback(train, cvae)
+    embed_callback = EmbeddingCallback(embed_data, cvae)
     loss_callback = LossHistory()
 
-    cvae.train(data=train, validation_data=valid,
-               batch_size=batch_size, epochs=epochs,
-               callbacks=[embed_callback, loss_callback])
+    # Stop on convergence or time budget and keep the best weights
+    callbacks = [embed_callback, loss_callback]
+    stop_callback = None
+    if patience is not None or time_budget is not None:
+        stop_callback = BudgetedEarlyStopping(patience=patience,
+                                              min_delta=min_delta,
+                                              time_budget=time_budget)
+        callbacks.append(stop_callback)
+
+    train_start = time.time()
+
+    if out_of_core:
+        # VAE.train only accepts in-memory arrays, so fit the underlying
+        # keras model directly. The sequences shuffle and prefetch
+        # themselves and must be consumed in order on this thread.
+        cvae.graph.fit_generator(train, validation_data=valid,
+                                 epochs=epochs, shuffle=False, workers=0,
+                                 callbacks=callbacks)
+    else:
+        cvae.train(data=train, validation_data=valid,
+                   batch_size=batch_size, epochs=epochs,
+                   callbacks=callbacks)
+
+    train_time = time.time() - train_start
+
+    if profiler:
+        profiler.mark('write')
 
     # Define file paths to store model performance and weights
     ae_weight_path = os.path.join(out_path, f'ae-weight-{model_id}.h5')
+    opt_path = optimizer_state_path(ae_weight_path)
     encoder_weight_path = os.path.join(out_path, f'encoder-weight-{model_id}.h5')
     encoder_hparams_path = os.path.join(out_path, f'encoder-hparams-{model_id}.pkl')
     decoder_hparams_path = os.path.join(out_path, f'decoder-hparams-{model_id}.pkl')
@@ -121,12 +204,221 @@ def main(input_path, out_path, model_id, gpu, epochs, batch_size, latent_dim):
     # Save encoder weights seperately so the full model doesn't need to be
     # loaded during the outlier detection stage.
     cvae.save_weights(ae_weight_path)
+    save_optimizer_state(cvae.graph, opt_path)
     encoder.save_weights(encoder_weight_path)
     encoder_hparams.save(encoder_hparams_path)
     decoder_hparams.save(decoder_hparams_path)
     embed_callback.save(embed_path=embed_path, idx_path=idx_path)
     loss_callback.save(loss_path=loss_path, val_loss_path=val_loss_path)
 
+    if stop_callback and stop_callback.best_weights is not None:
+        # The saved weights are those of the best epoch, so the saved
+        # validation loss history ends there. Selecting models by the
+        # last validation loss, as dbscan.py does without a registry,
+        # then uses the loss of the saved weights.
+        np.save(val_loss_path, loss_callback.val_losses[:stop_callback.best_epoch + 1])
+
+    if registry:
+        # Register the model so later stages can select it with one read
+        val_losses = [float(loss) for loss in loss_callback.val_losses]
+        # Validation loss of the saved, possibly restored, weights
+        final_val_loss = val_losses[-1]
+        if stop_callback and stop_callback.best_weights is not None:
+            final_val_loss = float(stop_callback.best)
+        registry.register(
+            model_id=model_id,
+            out_path=os.path.abspath(out_path),
+            input_path=os.path.abspath(input_path),
+            latent_dim=latent_dim,
+            input_shape=list(input_shape),
+            epochs=len(val_losses),
+            final_val_loss=final_val_loss,
+            best_val_loss=min(val_losses),
+            train_time=train_time,
+            stop_reason=stop_callback.stop_reason if stop_callback else None,
+            warm_start=os.path.abspath(warm_start) if warm_started else None,
+            ae_weight_path=os.path.abspath(ae_weight_path),
+            encoder_weight_path=os.path.abspath(encoder_weight_path),
+            encoder_hparams_path=os.path.abspath(encoder_hparams_path),
+            decoder_hparams_path=os.path.abspath(decoder_hparams_path),
+            optimizer_path=os.path.abspath(opt_path))
+
+
+def train_models(gpu, models, dataset_kwargs, random_state=None,
+                 profiler=None, **kwargs):
+    """
+    Train the models of a sweep one after the other on a GPU, sharing
+    the data loaded once by load_dataset.
+
+    Parameters
+    ----------
+    gpu : int
+        id of the GPU to train on
+
+    models : list
+        tuples of (model_id, latent_dim, warm_start)
+
+    dataset_kwargs : dict
+        arguments of load_dataset
+
+    random_state : tuple
+        state of the numpy random generator after shuffling the data,
+        restored before each model so it trains as if it were alone.
+        Defaults to the state after load_dataset.
+
+    kwargs
+        arguments of train_model shared by the models
+
+    """
+    # Set CUDA environment variables
+    os.environ['CUDA_DEVICE_ORDER'] = 'PCI_BUS_ID'
+    os.environ['CUDA_VISIBLE_DEVICES'] = str(gpu)
+
+    stack, train, valid, embed_data, input_shape = load_dataset(**dataset_kwargs)
+    if random_state is None:
+        random_state = np.random.get_state()
+    with stack:
+        for model_id, latent_dim, warm_start in models:
+            # Start from an empty graph for each model, and when run
+            # repeatedly by a warm worker, see deepdrive.worker
+            K.clear_session()
+            np.random.set_state(random_state)
+            if profiler:
+                profiler.mark('compute')
+            train_model(train, valid, embed_data, input_shape,
+                        dataset_kwargs['input_path'], model_id=model_id,
+                        latent_dim=latent_dim, warm_start=warm_start,
+                        profiler=profiler, **kwargs)
+
+
+@click.command()
+@click.option('-i', '--input', 'input_path', required=True,
+              type=click.Path(exists=True),
+              help='Path to file containing preprocessed contact matrix data')
+
+@click.option('-o', '--out', 'out_path', required=True,
+              type=click.Path(exists=True),
+              help='Output directory for model data')
+
+@click.option('-m', '--model_id', 'model_ids', required=True, multiple=True,
+              help='Model ID in for file naming. Repeat with --latent_dim '
+                   'to train a sweep of models on data loaded once')
+
+@click.option('-g', '--gpu', 'gpus', default=[0], type=int, multiple=True,
+              help='GPU id. Repeat to train the models of a sweep in one '
+                   'process per GPU')
+
+@click.option('-e', '--epochs', default=100, type=int,
+              callback=validate_positive,
+              help='Number of epochs to train for')
+
+@click.option('-b', '--batch_size', default=512, type=int,
+              callback=validate_positive,
+              help='Batch size for training')
+
+@click.option('-d', '--latent_dim', 'latent_dims', default=[3], type=int,
+              multiple=True,
+              help='Number of dimensions in latent space, one per --model_id')
+
+@click.option('-O', '--out_of_core', is_flag=True,
+              help='Stream training batches from the h5 file instead of '
+                   'loading all contact maps into memory')
+
+@click.option('-s', '--seed', default=None, type=int,
+              help='Seed of the train validation split and shuffling')
+
+@click.option('-r', '--registry', 'registry_path', default=None,
+              type=click.Path(),
+              help='Model registry file to register the trained model in')
+
+@click.option('-w', '--warm_start', 'warm_starts', multiple=True,
+              type=click.Path(),
+              help='Autoencoder weights of a previous model to initialize '
+                   'training from, one per --model_id if given. Ignored '
+                   'if missing or incompatible')
+
+@click.option('-W', '--warm_epochs', default=None, type=int,
+              help='Number of epochs to train for when warm started. '
+                   'Defaults to --epochs')
+
+@click.option('-p', '--patience', default=None, type=int,
+              help='Stop training after this many epochs without '
+                   'improvement of the validation loss')
+
+@click.option('--min_delta', default=0., type=float,
+              callback=validate_positive,
+              help='Minimum decrease of the validation loss counted '
+                   'as improvement')
+
+@click.option('-t', '--time_budget', default=None, type=float,
+              help='Wall-clock seconds available for training each model. '
+                   'Training stops before an epoch that would exceed the budget')
+
+@click.option('-S', '--shm_dir', default=None, type=click.Path(exists=True),
+              help='Directory of the contact maps shared by the processes '
+                   'of a sweep, defaults to /dev/shm')
+
+def main(input_path, out_path, model_ids, gpus, epochs, batch_size, latent_dims,
+         out_of_core, seed, registry_path, warm_starts, warm_epochs,
+         patience, min_delta, time_budget, shm_dir):
+
+    if len(latent_dims) != len(model_ids):
+        raise click.BadParameter('Pass one --latent_dim per --model_id')
+    if warm_starts and len(warm_starts) != len(model_ids):
+        raise click.BadParameter('Pass one --warm_start per --model_id')
+    if min(gpus + latent_dims) < 0:
+        raise click.BadParameter('--gpu and --latent_dim must be greater '
+                                 'than or equal to 0')
+
+    models = list(zip(model_ids, latent_dims, warm_starts or [None] * len(model_ids)))
+    # More processes than models would idle
+    gpus = gpus[:len(models)]
+
+    train_kwargs = {'out_path': out_path, 'epochs': epochs, 'batch_size': batch_size,
+                    'out_of_core': out_of_core, 'registry_path': registry_path,
+                    'warm_epochs': warm_epochs, 'patience': patience,
+                    'min_delta': min_delta, 'time_budget': time_budget}
+    dataset_kwargs = {'input_path': input_path, 'batch_size': batch_size,
+                      'out_of_core': out_of_core, 'seed': seed}
+
+    profiler = TaskProfiler('cvae')
+    profiler.mark('read')
+
+    if len(gpus) == 1:
+        # Models of a sweep are trained one after the other on the same data
+        train_models(gpus[0], models, dataset_kwargs, profiler=profiler,
+                     **train_kwargs)
+        return
+
+    # One process per GPU trains every len(gpus)-th model. Contact maps
+    # loaded in memory are shuffled once and mapped by all processes,
+    # out-of-core processes each stream batches from the h5 file.
+    with ExitStack() as stack:
+        random_state = None
+        if not out_of_core:
+            data = load_shuffled(input_path, seed)
+            random_state = np.random.get_state()
+            dataset_kwargs['shared_path'] = stack.enter_context(shared_array(data, shm_dir))
+            del data
+
+        profiler.mark('compute')
+
+        # Processes are spawned, TensorFlow does not support fork
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=train_models,
+                                     args=(gpu, models[i::len(gpus)],
+                                           dataset_kwargs, random_state),
+                                     kwargs=train_kwargs)
+                     for i, gpu in enumerate(gpus)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    failed = [gpu for gpu, process in zip(gpus, processes) if process.exitcode]
+    if failed:
+        raise RuntimeError(f'Training on GPUs {failed} failed')
+
 
 if __name__ == '__main__':
     main()
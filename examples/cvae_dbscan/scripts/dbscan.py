@@ -1,41 +1,120 @@
 import os
 import json
+import time
 import click
+import multiprocessing
 import numpy as np
 from glob import glob
-import MDAnalysis as mda
-from MDAnalysis.analysis import distances
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.format import open_memmap
 from molecules.utils import open_h5
-from molecules.ml.unsupervised.cluster import optics_clustering
-from molecules.ml.unsupervised import (VAE, EncoderConvolution2D, 
-                                       DecoderConvolution2D,
-                                       EncoderHyperparams,
-                                       DecoderHyperparams)
-from deepdrive.utils import get_id
-from deepdrive.utils.validators import (validate_positive,
+from deepdrive.utils import get_id, prefetch, TaskProfiler
+from deepdrive.ml import ModelRegistry
+from deepdrive.outlier import (knn_outlier_scores, top_outliers,
+                               EmbeddingStore, file_digest,
+                               seed_priorities, diverse_subset,
+                               write_seed_manifest, outlier_pdb_name,
+                               write_sim_pdbs)
+from deepdrive.preproc import ContactMapReader, FrameIndex, open_contact_maps
+from deepdrive.utils.validators import (validate_positive, validate_at_least_one,
                                         validate_between_zero_and_one)
 
 
-def generate_embeddings(encoder_hparams_path, encoder_weight_path, cm_path):
-    encoder_hparams = EncoderHyperparams.load(encoder_hparams_path)
+# Keras, TensorFlow and the models of molecules are imported on first
+# use. Processes spawned to write PDB files import this script again
+# and only need the light imports above.
 
-    with open_h5(cm_path) as file:
+# Encoder of the last call of load_encoder, reused by long-lived
+# processes running several outlier tasks, see deepdrive.worker
+_encoder_cache = {}
+
+
+def load_encoder(encoder_hparams_path, encoder_weight_path, input_shape):
+    """
+    Encoder with the given hyperparameters and weights. The encoder of
+    the previous call is returned if the files and the input shape did
+    not change since.
+
+    """
+    try:
+        mtime = os.path.getmtime(encoder_weight_path)
+    except OSError:
+        mtime = None
+    key = (os.path.abspath(encoder_hparams_path),
+           os.path.abspath(encoder_weight_path), mtime, tuple(input_shape))
 
-        # Access contact matrix data from h5 file
-        data = file['contact_maps']
+    if key not in _encoder_cache:
+        from keras import backend as K
+        from molecules.ml.unsupervised import (EncoderConvolution2D,
+                                               EncoderHyperparams)
 
-        # Get shape of an individual contact matrix
-        # (ignore total number of matrices)
-        input_shape = data.shape[1:]
+        # Free the graph of the previous encoder
+        _encoder_cache.clear()
+        K.clear_session()
 
+        encoder_hparams = EncoderHyperparams.load(encoder_hparams_path)
         encoder = EncoderConvolution2D(input_shape=input_shape,
                                        hyperparameters=encoder_hparams)
 
         # Load best model weights
         encoder.load_weights(encoder_weight_path)
+        _encoder_cache[key] = encoder
+
+    return _encoder_cache[key]
+
+
+def generate_embeddings(encoder_hparams_path, encoder_weight_path, cm_path,
+                        batch_size=1024, embed_path=None, store=None,
+                        model_key=None, frame_index=None):
+    from molecules.ml.unsupervised import EncoderHyperparams
+    encoder_hparams = EncoderHyperparams.load(encoder_hparams_path)
+
+    with open_h5(cm_path) as file:
 
-        # Create contact matrix embeddings
-        cm_embeddings, *_ = encoder.embed(data)
+        # Access contact matrix data from h5 file. Bit-packed
+        # contact maps are unpacked one batch at a time.
+        data = ContactMapReader(file, batch_size=batch_size)
+
+        # Preallocate the embeddings, on disk if embed_path is given
+        shape = (len(data), encoder_hparams.latent_dim)
+        if embed_path:
+            cm_embeddings = open_memmap(embed_path, mode='w+',
+                                        dtype=np.float32, shape=shape)
+        else:
+            cm_embeddings = np.empty(shape, dtype=np.float32)
+
+        # Frames embedded by the same encoder in a previous run are
+        # reused from the embedding store, whichever cvae-input file
+        # they were read from. Only new frames are encoded.
+        ranges = [(0, len(data), None)]
+        if store is not None:
+            ranges = store.gather(model_key, frame_index, cm_embeddings,
+                                  lambda i: data.dset[i])
+            num_new = sum(stop - start for start, stop, _ in ranges)
+            print(f'Embedding {num_new} new frames of {cm_path}, '
+                  f'reused {len(data) - num_new}')
+
+        if ranges:
+            # Get shape of an individual contact matrix
+            # (ignore total number of matrices)
+            input_shape = data.shape[1:]
+
+            encoder = load_encoder(encoder_hparams_path, encoder_weight_path,
+                                   input_shape)
+
+        for start, stop, traj_file in ranges:
+            # Create contact matrix embeddings one batch at a time while
+            # the next batch is read from the h5 file in the background
+            for batch_start, batch in prefetch(data.batches(start=start, stop=stop)):
+                batch_embeddings, *_ = encoder.embed(batch)
+                cm_embeddings[batch_start:batch_start + len(batch)] = batch_embeddings
+
+            if traj_file is not None:
+                store.append(model_key, traj_file, cm_embeddings[start:stop],
+                             data.dset[stop - 1])
+
+    if embed_path:
+        cm_embeddings.flush()
 
     return cm_embeddings
 
@@ -67,30 +146,120 @@ def perform_clustering(eps_path, encoder_weight_path, cm_embeddings, min_samples
 
     return outlier_inds, labels
 
-def write_rewarded_pdbs(rewarded_inds, sim_path, shared_path):
-    # Get list of simulation trajectory files (Assume all are equal length (ns))
-    traj_fnames = sorted(glob(os.path.join(sim_path, 'output-*.dcd')))
-
-    # Get list of simulation PDB files
-    pdb_fnames = sorted(glob(os.path.join(sim_path, 'input-*.pdb')))
-
-    # Get total number of simulations
-    sim_count = len(traj_fnames)
-
+def load_frame_index(cm_path, sim_path):
+    """
+    Load the frame index written by the preprocessing stage beside
+    cm_path. For cvae input files preprocessed without an index, the
+    index is rebuilt from the contact map files in sim_path, whose
+    frames are concatenated in sorted file order.
+
+    """
+    index_path = os.path.join(os.path.dirname(cm_path), 'cvae-input-index.npz')
+    if os.path.exists(index_path):
+        return FrameIndex.load(index_path)
+
+    frame_index = FrameIndex()
+    for cm_file in sorted(glob(os.path.join(sim_path, 'output-cm-*.h5'))):
+        sim_id = get_id(cm_file, 'output-cm-', 'h5')
+        with open_h5(cm_file) as file:
+            num_frames = open_contact_maps(file).shape[1]
+        frame_index.append(os.path.join(sim_path, f'output-{sim_id}.dcd'),
+                           os.path.join(sim_path, f'input-{sim_id}.pdb'),
+                           0, num_frames)
+    return frame_index
+
+def history_cm_paths(cm_path, frame_index):
+    """
+    cvae-input files of the pipeline iterations up to the one of
+    cm_path, oldest first. Earlier files are only included if their
+    frame index exists, since their simulation paths are not known,
+    and if the files of later iterations, starting with cm_path and
+    its frame_index, do not already hold all their frames, which
+    would be embedded twice.
+
+    """
+    pipeline_dir = os.path.dirname(os.path.abspath(cm_path))
+    prefix, _, current = os.path.basename(pipeline_dir).rpartition('-')
+    if prefix != 'pipeline' or not current.isdigit():
+        raise ValueError('History requires cm_path in a pipeline-<id> directory, '
+                         f'got {cm_path}')
+    basename = os.path.basename(cm_path)
+
+    cm_paths = [cm_path]
+    covered = FrameIndex()
+    covered.extend(frame_index)
+    for i in reversed(range(int(current))):
+        path = os.path.join(os.path.dirname(pipeline_dir), f'pipeline-{i}', basename)
+        index_path = os.path.join(os.path.dirname(path), 'cvae-input-index.npz')
+        if not os.path.exists(index_path):
+            continue
+        path_index = FrameIndex.load(index_path)
+        if covered.covers(path_index):
+            print(f'Skipping {path}, its frames are in the files of later iterations')
+            continue
+        covered.extend(path_index)
+        cm_paths.insert(0, path)
+
+    return cm_paths
+
+def write_rewarded_pdbs(rewarded_inds, frame_index, shared_path, num_workers=1):
     # Get simulation indices and frame number coresponding to outliers
-    reward_locs = map(lambda outlier: divmod(outlier, sim_count), rewarded_inds)
-
-    # For documentation on mda.Writer methods see:
-    #   https://www.mdanalysis.org/mdanalysis/documentation_pages/coordinates/PDB.html
-    #   https://www.mdanalysis.org/mdanalysis/_modules/MDAnalysis/coordinates/PDB.html#PDBWriter._update_frame
-
-    for frame, sim_id in reward_locs:
-        pdb_fname = os.path.join(shared_path, f'outlier-{sim_id}-{frame}.pdb')
-        u = mda.Universe(pdb_fnames[sim_id], traj_fnames[sim_id])
-        with mda.Writer(pdb_fname) as writer:
-            # Write a single coordinate set to a PDB file
-            writer._update_frame(u)
-            writer._write_timestep(u.trajectory[frame])
+    sims, frames = frame_index.locate(rewarded_inds)
+
+    # Group outlier frames by simulation so each trajectory is opened once
+    groups = []
+    for sim in np.unique(sims):
+        groups.append((frame_index.pdb_files[sim], frame_index.traj_files[sim],
+                       np.unique(frames[sims == sim]).tolist(), shared_path))
+
+    start = time.time()
+
+    # Process simulations in parallel, largest groups first
+    groups.sort(key=lambda group: len(group[2]), reverse=True)
+    if num_workers > 1 and len(groups) > 1:
+        # Processes are spawned, TensorFlow is initialized and does not
+        # support fork. They only import the light deepdrive.outlier.pdb.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as executor:
+            num_written = sum(executor.map(write_sim_pdbs, *zip(*groups)))
+    else:
+        num_written = sum(write_sim_pdbs(*group) for group in groups)
+
+    elapsed = time.time() - start
+    print(f'Wrote {num_written} outlier PDB files from {len(groups)} simulations '
+          f'in {elapsed:.2f}s ({num_written / max(elapsed, 1e-9):.1f} frames/s)')
+
+def rank_seeds(outlier_inds, frame_index, cm_embeddings, shared_path,
+               scores=None, n_neighbors=20, novelty_weight=1.):
+    """
+    Seeds of the MD stage written by write_rewarded_pdbs, ranked by
+    outlier score and latent space distance to the frames earlier
+    simulations were started from.
+
+    Returns
+    -------
+    list of dicts to be written by write_seed_manifest
+
+    """
+    sims, frames = frame_index.locate(outlier_inds)
+    # Global indices of the first frame of each simulation
+    explored = frame_index.offsets[frame_index.starts == 0]
+    outlier_scores, novelty, priority = seed_priorities(
+        cm_embeddings, outlier_inds, explored, scores, n_neighbors, novelty_weight)
+
+    seeds = []
+    for i, (sim, frame) in enumerate(zip(sims, frames)):
+        traj_fname = frame_index.traj_files[sim]
+        sim_id = get_id(traj_fname, 'output-', 'dcd')
+        # Same name as written by write_rewarded_pdbs
+        pdb_fname = os.path.join(shared_path, outlier_pdb_name(traj_fname, frame))
+        seeds.append({'pdb': os.path.abspath(pdb_fname),
+                      'sim_id': sim_id,
+                      'frame': int(frame),
+                      'outlier_score': float(outlier_scores[i]),
+                      'novelty': float(novelty[i]),
+                      'priority': float(priority[i])})
+    return seeds
 
 
 @click.command()
@@ -126,38 +295,190 @@ def write_rewarded_pdbs(rewarded_inds, sim_path, shared_path):
               callback=validate_positive,
               help='GPU id')
 
-def main(sim_path, shared_path, cm_path, cvae_path, min_samples, gpu):
+@click.option('-o', '--outlier_path', default=None,
+              type=click.Path(exists=True),
+              help='Outlier directory to store embeddings in. If not given, '
+                   'embeddings are kept in memory.')
+
+@click.option('-b', '--batch_size', default=1024, type=int,
+              callback=validate_positive,
+              help='Number of contact maps embedded at a time')
+
+@click.option('-w', '--num_workers', default=1, type=int,
+              callback=validate_positive,
+              help='Number of processes writing outlier PDB files')
+
+@click.option('-r', '--registry', 'registry_path', default=None,
+              type=click.Path(),
+              help='Model registry file to select the best model from. '
+                   'Falls back to scanning val-loss-*.npy files in cvae_path.')
+
+@click.option('-e', '--engine', default='optics',
+              type=click.Choice(['optics', 'lof', 'kdist']),
+              help='Outlier detection engine: OPTICS clustering, or a kNN '
+                   'index scoring points by local outlier factor or '
+                   'k-distance')
+
+@click.option('-k', '--n_neighbors', default=20, type=int,
+              callback=validate_at_least_one,
+              help='Number of neighbors of the lof and kdist engines')
+
+@click.option('-n', '--num_outliers', default=500, type=int,
+              callback=validate_positive,
+              help='Number of highest scoring outliers selected by the '
+                   'lof and kdist engines')
+
+@click.option('-S', '--embed_store', default=None, type=click.Path(),
+              help='Directory of a persistent embedding store. Frames '
+                   'embedded by the same encoder in earlier runs are reused.')
+
+@click.option('-H', '--history', is_flag=True,
+              help='Detect outliers among the frames of all pipeline '
+                   'iterations instead of only the current one')
+
+@click.option('-M', '--seed_manifest', default=None, type=click.Path(),
+              help='JSON file to write the outlier PDB files to, ranked '
+                   'by priority for seeding the MD stage')
+
+@click.option('-N', '--novelty_weight', default=1., type=float,
+              callback=validate_positive,
+              help='Weight of the latent space distance to explored '
+                   'regions relative to the outlier score in the seed '
+                   'priority')
+
+@click.option('-D', '--min_distance', default=0., type=float,
+              callback=validate_positive,
+              help='Minimum latent space distance between the selected '
+                   'outliers. Outliers closer to a higher priority outlier '
+                   'are dropped.')
+
+@click.option('-C', '--max_per_sim', default=None, type=int,
+              callback=validate_at_least_one,
+              help='Maximum number of outliers selected per simulation')
+
+def main(sim_path, shared_path, cm_path, cvae_path, min_samples, gpu,
+         outlier_path, batch_size, num_workers, registry_path, engine,
+         n_neighbors, num_outliers, embed_store, history, seed_manifest,
+         novelty_weight, min_distance, max_per_sim):
 
     # Set CUDA environment variables
     os.environ['CUDA_DEVICE_ORDER'] = 'PCI_BUS_ID'
     os.environ['CUDA_VISIBLE_DEVICES'] = str(gpu)
+
+    profiler = TaskProfiler('outlier')
+    profiler.mark('read')
     
     # Identify the latest models with lowest validation loss
     # Gather validation loss reports from each model in the current pipeline round
     # Find the minimum validation loss by taking the model_id associated with
     # the smallest validation loss during the last epoch. 
-    best_model_id = get_id(min(glob(os.path.join(cvae_path, 'val-loss-*.npy')),
-                               key=lambda loss_path: np.load(loss_path)[-1]),
-                           'val-loss-','npy')
-
-    # Define paths to best model and hyperparameters
-    encoder_hparams_path = os.path.join(cvae_path, f'encoder-hparams-{best_model_id}.pkl')
-    encoder_weight_path = os.path.join(cvae_path, f'encoder-weight-{best_model_id}.h5')
+    best_model = None
+    if registry_path:
+        # Single read of the registry, restricted to this pipeline round
+        best_model = ModelRegistry(registry_path).best('final_val_loss',
+                                                       out_path=os.path.abspath(cvae_path))
+
+    if best_model:
+        # Define paths to best model and hyperparameters
+        best_model_id = best_model['model_id']
+        encoder_hparams_path = best_model['encoder_hparams_path']
+        encoder_weight_path = best_model['encoder_weight_path']
+    else:
+        best_model_id = get_id(min(glob(os.path.join(cvae_path, 'val-loss-*.npy')),
+                                   key=lambda loss_path: np.load(loss_path)[-1]),
+                               'val-loss-','npy')
+
+        # Define paths to best model and hyperparameters
+        encoder_hparams_path = os.path.join(cvae_path, f'encoder-hparams-{best_model_id}.pkl')
+        encoder_weight_path = os.path.join(cvae_path, f'encoder-weight-{best_model_id}.h5')
+
+    profiler.mark('embed')
+
+    # Memory map embeddings to disk if an outlier directory is given
+    embed_path = None
+    if outlier_path:
+        embed_path = os.path.join(outlier_path, f'embeddings-{best_model_id}.npy')
+
+    # Stored embeddings are keyed by the contents of the encoder weights
+    # and the trajectory frames they were computed from
+    store, model_key = None, None
+    if embed_store:
+        store = EmbeddingStore(embed_store)
+        model_key = f'{best_model_id}-{file_digest(encoder_weight_path)}'
+
+    cm_index = load_frame_index(cm_path, sim_path)
+    cm_paths = history_cm_paths(cm_path, cm_index) if history else [cm_path]
 
     # Generate embeddings for all contact matrices produced during MD stage
-    cm_embeddings = generate_embeddings(encoder_hparams_path, 
-                                        encoder_weight_path, cm_path)
+    # and map embedding indices back to simulation trajectory frames
+    cm_embeddings, frame_index = [], FrameIndex()
+    for path in cm_paths:
+        path_index = cm_index if path == cm_path else load_frame_index(path, sim_path)
+        cm_embeddings.append(generate_embeddings(encoder_hparams_path,
+                                                 encoder_weight_path, path,
+                                                 batch_size,
+                                                 embed_path if path == cm_path else None,
+                                                 store, model_key, path_index))
+        frame_index.extend(path_index)
+
+    if len(cm_embeddings) > 1:
+        cm_embeddings = np.concatenate(cm_embeddings)
+    else:
+        cm_embeddings = cm_embeddings[0]
 
     # Performs DBSCAN clustering on embeddings
     #outlier_inds, labels = perform_clustering(eps_path, encoder_weight_path,
     #                                          cm_embeddings, min_samples, eps)
 
-    # Performs OPTICS clustering on embeddings
-    outlier_inds, labels = optics_clustering(cm_embeddings, min_samples)
-
+    profiler.mark('outliers')
+    start = time.time()
+
+    scores = None
+    if engine == 'optics':
+        from molecules.ml.unsupervised.cluster import optics_clustering
+
+        # Performs OPTICS clustering on embeddings
+        outlier_inds, labels = optics_clustering(cm_embeddings, min_samples)
+    else:
+        # Score embeddings with a kNN index queried in parallel
+        scores = knn_outlier_scores(cm_embeddings, k=n_neighbors,
+                                    method=engine, num_workers=num_workers)
+        outlier_inds = top_outliers(scores, num_outliers)
+
+    print(f'Selected {len(outlier_inds)} outliers of {len(cm_embeddings)} '
+          f'frames with {engine} in {time.time() - start:.2f}s')
+
+    dedup = min_distance > 0 or max_per_sim is not None
+    seeds = None
+    if seed_manifest or dedup:
+        # Rank the outliers, most promising seeds first
+        outlier_inds = np.asarray(outlier_inds)
+        seeds = rank_seeds(outlier_inds, frame_index, cm_embeddings, shared_path,
+                           scores[outlier_inds] if scores is not None else None,
+                           n_neighbors, novelty_weight)
+        order = np.argsort([-seed['priority'] for seed in seeds], kind='stable')
+        outlier_inds = outlier_inds[order]
+        seeds = [seeds[i] for i in order]
+
+    if dedup:
+        # Drop outliers close to better ones in latent space, which would
+        # seed simulations of the same region
+        sims, _ = frame_index.locate(outlier_inds)
+        keep = diverse_subset(cm_embeddings, outlier_inds, min_distance,
+                              sims, max_per_sim)
+        print(f'Kept {len(keep)} of {len(outlier_inds)} outliers at a latent '
+              f'distance of at least {min_distance}, at most {max_per_sim} per simulation')
+        outlier_inds = outlier_inds[keep]
+        seeds = [seeds[i] for i in keep]
+
+    profiler.mark('write')
 
     # Write rewarded PDB files to shared path
-    write_rewarded_pdbs(outlier_inds, sim_path, shared_path)
+    write_rewarded_pdbs(outlier_inds, frame_index, shared_path, num_workers)
+
+    if seed_manifest:
+        # The MD stage starts from the seeds of highest priority first
+        write_seed_manifest(seed_manifest, seeds)
 
 if __name__ == '__main__':
     main()
@@ -2,11 +2,12 @@ import os
 import click
 import simtk.unit as u
 from deepdrive.md import openmm_simulate_amber_fs_pep
+from deepdrive.utils import TaskProfiler
 from deepdrive.utils.validators import validate_positive
 
 
 @click.command()
-@click.option('-p', '--pdb', 'pdb_path' required=True,
+@click.option('-p', '--pdb', 'pdb_path', required=True,
               type=click.Path(exists=True),
               help='PDB file')
 
@@ -37,16 +38,50 @@ from deepdrive.utils.validators import validate_positive
               callback=validate_positive,
               help='ID of gpu to use for the simulation')
 
-def main(pdb_path, out_path, sim_id, topol, chk, length, report, gpu):
+@click.option('-P', '--platform', default='CUDA',
+              type=click.Choice(['CUDA', 'OpenCL', 'CPU']),
+              help='OpenMM platform')
+
+@click.option('-f', '--flush', default=None, type=float,
+              help='Time interval (ps) between bulk writes of buffered '
+                   'reports, defaults to writing every report')
+
+@click.option('-a', '--async_flush', is_flag=True,
+              help='Write buffered reports on a background thread')
+
+@click.option('-k', '--checkpoint', default=None, type=float,
+              help='Time interval (ps) between checkpoints, defaults to '
+                   'the flush interval')
+
+@click.option('-S', '--system_cache', default=None,
+              type=click.Path(),
+              help='Directory caching the serialized OpenMM system of each topology')
+
+@click.option('-R', '--restart', is_flag=True,
+              help='Skip minimization and equilibration of an already '
+                   'equilibrated structure')
+
+def main(pdb_path, out_path, sim_id, topol, chk, length, report, gpu,
+         platform, flush, async_flush, checkpoint, system_cache, restart):
+    # Trajectory and contact maps are written while simulating
+    profiler = TaskProfiler('md')
+    profiler.mark('compute')
+
     openmm_simulate_amber_fs_pep(pdb_path,
                                  checkpnt=chk,
                                  GPU_index=gpu,
+                                 platform=platform,
                                  checkpnt_fname=os.path.join(out_path, f'checkpnt-{sim_id}.chk'),
                                  output_traj=os.path.join(out_path, f'output-{sim_id}.dcd'),
                                  output_log=os.path.join(out_path, f'output-{sim_id}.log'),
                                  output_cm=os.path.join(out_path, f'output-cm-{sim_id}.h5'),
                                  report_time=report * u.picoseconds,
-                                 sim_time=length * u.nanoseconds)
+                                 sim_time=length * u.nanoseconds,
+                                 flush_time=flush * u.picoseconds if flush else None,
+                                 async_flush=async_flush,
+                                 checkpoint_time=checkpoint * u.picoseconds if checkpoint else None,
+                                 system_cache=system_cache,
+                                 restart=restart)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,96 @@
+import os
+import click
+import simtk.unit as u
+from deepdrive.md import openmm_simulate_replicas
+from deepdrive.utils import TaskProfiler
+from deepdrive.utils.validators import validate_positive, validate_at_least_one
+
+
+@click.command()
+@click.option('-p', '--pdb', 'pdb_paths', required=True, multiple=True,
+              type=click.Path(exists=True),
+              help='PDB file of each simulation')
+
+@click.option('-o', '--out', 'out_path', required=True,
+              type=click.Path(exists=True),
+              help='Output directory for MD simulation data')
+
+@click.option('-i', '--sim_id', 'sim_ids', required=True, multiple=True,
+              help='Simulation ID for file naming, one per PDB file')
+
+@click.option('-l', '--len', 'length', default=10, type=float,
+              callback=validate_positive,
+              help='How long (ns) the system will be simulated')
+
+@click.option('-r', '--report', default=50, type=float,
+              callback=validate_positive,
+              help= 'Time interval (ps) between reports')
+
+@click.option('-g', '--gpu', default=0, type=int,
+              callback=validate_positive,
+              help='ID of gpu to use for the simulations')
+
+@click.option('-P', '--platform', default='CUDA',
+              type=click.Choice(['CUDA', 'OpenCL', 'CPU']),
+              help='OpenMM platform')
+
+@click.option('-n', '--concurrent', default=1, type=int,
+              callback=validate_at_least_one,
+              help='Number of simulations run at a time, in threads')
+
+@click.option('-T', '--threads', default=None, type=int,
+              help='Threads of the CPU platform, split between concurrent '
+                   'simulations. Defaults to all cores')
+
+@click.option('-f', '--flush', default=None, type=float,
+              help='Time interval (ps) between bulk writes of buffered '
+                   'reports, defaults to writing every report')
+
+@click.option('-a', '--async_flush', is_flag=True,
+              help='Write buffered reports on a background thread')
+
+@click.option('-k', '--checkpoint', default=None, type=float,
+              help='Time interval (ps) between checkpoints, defaults to '
+                   'the flush interval')
+
+@click.option('-S', '--system_cache', default=None,
+              type=click.Path(),
+              help='Directory caching the serialized OpenMM system of each topology')
+
+@click.option('-R', '--restart', is_flag=True,
+              help='Skip minimization and equilibration of already '
+                   'equilibrated structures')
+
+def main(pdb_paths, out_path, sim_ids, length, report, gpu, platform,
+         concurrent, threads, flush, async_flush, checkpoint, system_cache,
+         restart):
+    """Run one MD simulation per PDB file in a single process."""
+    if len(pdb_paths) != len(sim_ids):
+        raise click.BadParameter('Pass one --sim_id per --pdb')
+
+    profiler = TaskProfiler('md')
+    profiler.mark('compute')
+
+    # Same file names as one md.py task per simulation
+    replicas = [{'pdb_file': pdb_path,
+                 'checkpnt_fname': os.path.join(out_path, f'checkpnt-{sim_id}.chk'),
+                 'output_traj': os.path.join(out_path, f'output-{sim_id}.dcd'),
+                 'output_log': os.path.join(out_path, f'output-{sim_id}.log'),
+                 'output_cm': os.path.join(out_path, f'output-cm-{sim_id}.h5')}
+                for pdb_path, sim_id in zip(pdb_paths, sim_ids)]
+
+    openmm_simulate_replicas(replicas,
+                             concurrent=min(concurrent, len(replicas)),
+                             threads=threads,
+                             GPU_index=gpu,
+                             platform=platform,
+                             report_time=report * u.picoseconds,
+                             sim_time=length * u.nanoseconds,
+                             flush_time=flush * u.picoseconds if flush else None,
+                             async_flush=async_flush,
+                             checkpoint_time=checkpoint * u.picoseconds if checkpoint else None,
+                             system_cache=system_cache,
+                             restart=restart)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+import os
+import json
+import click
+from deepdrive.utils.profiling import load_profiles, chrome_trace, summary_table
+
+
+@click.command()
+@click.option('-p', '--profile_dir', required=True,
+              type=click.Path(exists=True),
+              help='Profile directory of a DeepDriveMD run')
+
+@click.option('-t', '--trace', 'trace_path', default=None,
+              type=click.Path(),
+              help='Chrome trace output file, defaults to '
+                   '<profile_dir>/trace.json')
+
+def main(profile_dir, trace_path):
+    stages, tasks = load_profiles(profile_dir)
+
+    # Timeline viewable in chrome://tracing or https://ui.perfetto.dev
+    trace_path = trace_path or os.path.join(profile_dir, 'trace.json')
+    with open(trace_path, 'w') as file:
+        json.dump(chrome_trace(stages, tasks), file)
+
+    print(summary_table(stages, tasks))
+    print(f'\nWrote timeline of {len(stages)} stages and {len(tasks)} tasks to {trace_path}')
+
+if __name__ == '__main__':
+    main()
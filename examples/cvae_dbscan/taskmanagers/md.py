@@ -3,11 +3,14 @@ import glob
 import time
 from radical.entk import Task
 from deepdrive import TaskManager
+from deepdrive.outlier import SeedQueue
 
 
 class MDTaskManager(TaskManager):
-    def __init__(self, num_sims, sim_len, initial_sim_len,
-                 cpu_reqs={}, gpu_reqs={}, prefix=os.getcwd()):
+    def __init__(self, num_sims, sim_len, initial_sim_len, flush_time=None,
+                 async_flush=False, checkpoint_time=None, system_cache=True,
+                 restart=True, sims_per_task=1, concurrent_sims=1, platform='CUDA',
+                 seed_decay=1., cpu_reqs={}, gpu_reqs={}, prefix=os.getcwd()):
         """
         Parameters
         ----------
@@ -20,6 +23,39 @@ class MDTaskManager(TaskManager):
         initial_sim_len : int
             Time (ns) to run initial MD simulation batch for
 
+        flush_time : float
+            Time (ps) between bulk writes of buffered trajectory, contact
+            map and log reports. If None, every report is written.
+
+        async_flush : bool
+            write buffered reports on a background thread
+
+        checkpoint_time : float
+            Time (ps) between checkpoints, defaults to flush_time
+
+        system_cache : bool
+            build the OpenMM system of each topology once and cache it
+            in data/md/system-cache
+
+        restart : bool
+            skip minimization and equilibration in iterations > 0
+            seeded by outlier frames of earlier simulations
+
+        sims_per_task : int
+            number of simulations run by each task, in one process
+            sharing imports, force field and system (scripts/md_batch.py)
+
+        concurrent_sims : int
+            number of the simulations of a task run at a time, in threads
+            splitting the cpu_reqs threads between them on the CPU platform
+
+        platform : str
+            OpenMM platform: 'CUDA', 'OpenCL' or 'CPU'
+
+        seed_decay : float
+            factor applied to the priority of seeds carried forward
+            each time the outlier stage ranks new seeds
+
         cpu_reqs : dict
             contains cpu hardware requirments for task
 
@@ -35,10 +71,19 @@ class MDTaskManager(TaskManager):
         self.num_sims = num_sims
         self.sim_len = sim_len
         self.initial_sim_len = initial_sim_len
-
-    def _task(self, pipeline_id, sim_num, time_stamp, md_dir, shared_dir, incomming_pbds):
-
-        pdb_file = os.path.join(md_dir, f'input-{sim_num}.pdb')
+        self.flush_time = flush_time
+        self.async_flush = async_flush
+        self.checkpoint_time = checkpoint_time
+        self.system_cache = system_cache
+        self.restart = restart
+        self.sims_per_task = sims_per_task
+        self.concurrent_sims = concurrent_sims
+        self.platform = platform
+        self.seed_decay = seed_decay
+
+    def _task(self, pipeline_id, sim_nums, time_stamp, md_dir, shared_dir, incomming_pbds):
+
+        pdb_files = [os.path.join(md_dir, f'input-{sim_num}.pdb') for sim_num in sim_nums]
             
         task = Task()
 
@@ -47,18 +92,84 @@ class MDTaskManager(TaskManager):
         self.assign_hardware(task)
 
         # Create output directory for generated files.
-        task.pre_exec.extend([f'mkdir -p {md_dir}',
-                              f'cp {incomming_pbds[sim_num]} {pdb_file}'])
+        task.pre_exec.append(f'mkdir -p {md_dir}')
+        task.pre_exec.extend(f'cp {incomming_pbds[sim_num]} {pdb_file}'
+                             for sim_num, pdb_file in zip(sim_nums, pdb_files))
 
         # Specify python MD task with arguments
-        task.arguments = [f'{self.prefix}/examples/cvae_dbscan/scripts/md.py',
-                          '--pdb', pdb_file,
-                          '--out', md_dir,
-                          '--sim_id', str(sim_num),
-                          '--len', str(self.sim_len if pipeline_id else self.initial_sim_len)]
+        if len(sim_nums) == 1:
+            task.arguments = [f'{self.prefix}/examples/cvae_dbscan/scripts/md.py',
+                              '--pdb', pdb_files[0],
+                              '--sim_id', str(sim_nums[0])]
+        else:
+            task.arguments = [f'{self.prefix}/examples/cvae_dbscan/scripts/md_batch.py',
+                              '--concurrent', str(self.concurrent_sims)]
+            for sim_num, pdb_file in zip(sim_nums, pdb_files):
+                task.arguments.extend(['--pdb', pdb_file, '--sim_id', str(sim_num)])
+            threads = self.cpu_reqs.get('threads_per_process')
+            if threads and self.platform == 'CPU':
+                task.arguments.extend(['--threads', str(threads)])
+
+        task.arguments.extend(['--out', md_dir,
+                               '--len', str(self.sim_len if pipeline_id else self.initial_sim_len)])
+
+        if self.platform != 'CUDA':
+            task.arguments.extend(['--platform', self.platform])
+
+        if self.flush_time:
+            task.arguments.extend(['--flush', str(self.flush_time)])
+        if self.async_flush:
+            task.arguments.append('--async_flush')
+        if self.checkpoint_time:
+            task.arguments.extend(['--checkpoint', str(self.checkpoint_time)])
+        if self.system_cache:
+            task.arguments.extend(['--system_cache', f'{self.prefix}/data/md/system-cache'])
+        # Outlier frames are already equilibrated, unlike the initial PDB
+        # files, which may still seed iterations > 0 in async mode
+        if self.restart and shared_dir != self._seed_dir(0):
+            task.arguments.append('--restart')
 
         return task
 
+    def _seed_dir(self, pipeline_id):
+        """
+        Returns
+        -------
+        PDB directory written by the newest completed outlier stage.
+        This is the directory of pipeline_id itself unless the outlier
+        stage of the previous iteration is still running in async mode.
+
+        """
+        for i in range(pipeline_id, 0, -1):
+            shared_dir = f'{self.prefix}/data/shared/pipeline-{i}'
+            if os.path.exists(os.path.join(shared_dir, 'complete')):
+                return os.path.join(shared_dir, 'pdb')
+
+        # Initial PDB files
+        return f'{self.prefix}/data/shared/pipeline-0/pdb'
+
+    def _seeds(self, shared_dir):
+        """
+        Returns
+        -------
+        list of up to num_sims PDB files to seed MD simulations from.
+        Seeds ranked by the outlier stage in seeds.json are taken in
+        order of priority, and the remaining seeds are queued in
+        data/shared/seed-queue.json for later iterations. Otherwise
+        all PDB files of shared_dir are returned.
+
+        """
+        manifest_path = os.path.join(os.path.dirname(shared_dir), 'seeds.json')
+        if os.path.exists(manifest_path):
+            queue = SeedQueue(f'{self.prefix}/data/shared/seed-queue.json')
+            queue.add_manifest(manifest_path, self.seed_decay)
+            seeds = queue.pop(self.num_sims)
+            queue.save()
+            if seeds:
+                return [seed['pdb'] for seed in seeds]
+
+        return sorted(glob.glob(os.path.join(shared_dir, '*.pdb')))
+
     def tasks(self, pipeline_id):
         """
         Returns
@@ -68,8 +179,8 @@ class MDTaskManager(TaskManager):
         """
 
         md_dir = f'{self.prefix}/data/md/pipeline-{pipeline_id}'
-        shared_dir = f'{self.prefix}/data/shared/pipeline-{pipeline_id}/pdb'
-        incomming_pbds = glob.glob(os.path.join(shared_dir, '*.pdb'))
+        shared_dir = self._seed_dir(pipeline_id)
+        incomming_pbds = self._seeds(shared_dir)
 
         if not incomming_pbds:
             print('No more PDB files to seed MD simulations')
@@ -80,5 +191,6 @@ class MDTaskManager(TaskManager):
 
         # TODO: incorporate or remove timestamp
         time_stamp = int(time.time())
-        return {self._task(pipeline_id, sim_num, time_stamp, md_dir, shared_dir, incomming_pbds)
-                for sim_num in range(num_sims)}
+        return {self._task(pipeline_id, list(range(start, min(start + self.sims_per_task, num_sims))),
+                           time_stamp, md_dir, shared_dir, incomming_pbds)
+                for start in range(0, num_sims, self.sims_per_task)}
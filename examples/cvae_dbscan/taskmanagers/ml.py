@@ -5,13 +5,51 @@ from deepdrive import TaskManager
 
 
 class CVAETaskManager(TaskManager):
-    def __init__(self, num_ml, cpu_reqs={}, gpu_reqs={}, prefix=os.getcwd()):
+    def __init__(self, num_ml, out_of_core=False, warm_start=False,
+                 warm_epochs=20, patience=None, min_delta=0.,
+                 time_budget=None, sweep=False, sweep_gpus=1, worker=False,
+                 cpu_reqs={}, gpu_reqs={}, prefix=os.getcwd()):
         """
         Parameters
         ----------
         num_ml : int
             number of ml models to train
 
+        out_of_core : bool
+            if True, stream training batches from cvae-input.h5
+            instead of loading the whole dataset into memory
+
+        warm_start : bool
+            if True, after the first iteration each model is initialized
+            with the weights of the model with the same model_id from the
+            previous iteration and fine-tuned for `warm_epochs` epochs
+
+        warm_epochs : int
+            number of epochs to fine-tune warm started models for
+
+        patience : int
+            if given, stop training after `patience` epochs without
+            improvement of the validation loss by at least `min_delta`
+
+        min_delta : float
+            minimum decrease of the validation loss counted as improvement
+
+        time_budget : float
+            if given, wall-clock seconds each model may train for.
+            The best weights are kept when training stops early.
+
+        sweep : bool
+            if True, train all models in a single task that loads the
+            contact maps once, instead of one task per model
+
+        sweep_gpus : int
+            number of GPUs of the sweep task, each trained on by one
+            process. The processes map the same copy of the contact maps.
+
+        worker : bool
+            if True, run the tasks in a warm worker per node, see
+            deepdrive.worker, instead of starting python for each task
+
         cpu_reqs : dict
             contains cpu hardware requirments for task
 
@@ -25,23 +63,34 @@ class CVAETaskManager(TaskManager):
         super().__init__(cpu_reqs, gpu_reqs, prefix)
 
         self.num_ml = num_ml
+        self.out_of_core = out_of_core
+        self.warm_start = warm_start
+        self.warm_epochs = warm_epochs
+        self.patience = patience
+        self.min_delta = min_delta
+        self.time_budget = time_budget
+        self.sweep = sweep
+        self.sweep_gpus = sweep_gpus
+        self.worker = worker
 
 
-    def _task(self, pipeline_id, model_id, time_stamp):
+    def _task(self, pipeline_id, model_ids, time_stamp):
 
         # Specify training hyperparameters
         # Select latent dimension for CVAE [3, ... self.num_ml]
-        latent_dim = 3 + model_id
+        latent_dims = [3 + model_id for model_id in model_ids]
         epochs = 100
         batch_size = 512
 
         cvae_dir = f'{self.prefix}/data/ml/pipeline-{pipeline_id}'
         cm_data_path = f'{self.prefix}/data/preproc/pipeline-{pipeline_id}/cvae-input.h5'
+        registry_path = f'{self.prefix}/data/ml/registry.jsonl'
 
         task = Task()
 
-        self.load_environment(task)
-        self.set_python_executable(task)
+        if not self.worker:
+            self.load_environment(task)
+            self.set_python_executable(task)
         self.assign_hardware(task)
 
         # Create output directory for generated files.
@@ -51,11 +100,42 @@ class CVAETaskManager(TaskManager):
         task.arguments = [f'{self.prefix}/examples/cvae_dbscan/scripts/cvae.py',
                           '--input', cm_data_path,
                           '--out', cvae_dir,
-                          '--model_id', f'{model_id}',
                           '--epochs', f'{epochs}',
                           '--batch_size', f'{batch_size}',
-                          '--latent_dim', f'{latent_dim}']
-        
+                          '--registry', registry_path]
+
+        # A sweep trains several models on contact maps loaded once
+        for model_id, latent_dim in zip(model_ids, latent_dims):
+            task.arguments.extend(['--model_id', f'{model_id}',
+                                   '--latent_dim', f'{latent_dim}'])
+
+        if len(model_ids) > 1:
+            for gpu in range(min(self.sweep_gpus, len(model_ids))):
+                task.arguments.extend(['--gpu', f'{gpu}'])
+
+        if self.out_of_core:
+            task.arguments.append('--out_of_core')
+
+        if self.patience is not None:
+            task.arguments.extend(['--patience', f'{self.patience}',
+                                   '--min_delta', f'{self.min_delta}'])
+
+        if self.time_budget is not None:
+            task.arguments.extend(['--time_budget', f'{self.time_budget}'])
+
+        if self.warm_start and pipeline_id > 0:
+            # Models with the same model_id share the latent dimension.
+            # cvae.py trains from scratch if the weights are missing.
+            prev_dir = f'{self.prefix}/data/ml/pipeline-{pipeline_id - 1}'
+            for model_id in model_ids:
+                task.arguments.extend(['--warm_start', f'{prev_dir}/ae-weight-{model_id}.h5'])
+            task.arguments.extend(['--warm_epochs', f'{self.warm_epochs}'])
+
+        if self.worker:
+            # The tasks of a stage may share a node and GPUs
+            num_tasks = 1 if self.sweep else self.num_ml
+            self.use_worker(task, f'{self.prefix}/data/worker/ml', max_workers=num_tasks)
+
         return task
 
 
@@ -68,4 +148,6 @@ class CVAETaskManager(TaskManager):
         """
         # TODO: incorporate or remove timestamp
         time_stamp = int(time.time())
-        return {self._task(pipeline_id, i, time_stamp) for i in range(self.num_ml)}
+        if self.sweep:
+            return {self._task(pipeline_id, list(range(self.num_ml)), time_stamp)}
+        return {self._task(pipeline_id, [i], time_stamp) for i in range(self.num_ml)}
@@ -4,10 +4,49 @@ from deepdrive import TaskManager
 
 
 class OPTICSTaskManager(TaskManager):
-    def __init__(self, cpu_reqs={}, gpu_reqs={}, prefix=os.getcwd()):
+    def __init__(self, engine='optics', n_neighbors=20, num_outliers=500,
+                 embed_store=False, history=False, novelty_weight=1., min_distance=0.,
+                 max_per_sim=None, worker=False,
+                 cpu_reqs={}, gpu_reqs={}, prefix=os.getcwd()):
         """
         Parameters
         ----------
+        engine : str
+            outlier detection engine, 'optics' for OPTICS clustering or
+            'lof' / 'kdist' for kNN index based scoring which scales to
+            millions of frames
+
+        n_neighbors : int
+            number of neighbors of the lof and kdist engines
+
+        num_outliers : int
+            number of outliers selected by the lof and kdist engines
+
+        embed_store : bool
+            if True, keep embeddings in data/outlier/embeddings so frames
+            already embedded by the same encoder are not embedded again
+
+        history : bool
+            if True, detect outliers among the frames of all pipeline
+            iterations rather than only the current one
+
+        novelty_weight : float
+            weight of the latent space distance to explored regions
+            relative to the outlier score in the priority of the seeds
+            written to data/shared/pipeline-<id>/seeds.json
+
+        min_distance : float
+            minimum latent space distance between the outliers seeding
+            MD. Outliers closer to a higher priority outlier are dropped.
+
+        max_per_sim : int
+            maximum number of outliers seeding MD taken from the same
+            simulation
+
+        worker : bool
+            if True, run the tasks in a warm worker per node, see
+            deepdrive.worker, instead of starting python for each task
+
         cpu_reqs : dict
             contains cpu hardware requirments for task
 
@@ -20,6 +59,16 @@ class OPTICSTaskManager(TaskManager):
         """
         super().__init__(cpu_reqs, gpu_reqs, prefix)
 
+        self.engine = engine
+        self.n_neighbors = n_neighbors
+        self.num_outliers = num_outliers
+        self.embed_store = embed_store
+        self.history = history
+        self.novelty_weight = novelty_weight
+        self.min_distance = min_distance
+        self.max_per_sim = max_per_sim
+        self.worker = worker
+
     def tasks(self, pipeline_id):
         """
         Returns
@@ -29,13 +78,16 @@ class OPTICSTaskManager(TaskManager):
         """
         md_dir = f'{self.prefix}/data/md/pipeline-{pipeline_id}'
         cvae_dir = f'{self.prefix}/data/ml/pipeline-{pipeline_id}'
-        shared_path = f'{self.prefix}/data/shared/pipeline-{pipeline_id + 1}/pdb'
+        shared_dir = f'{self.prefix}/data/shared/pipeline-{pipeline_id + 1}'
+        shared_path = f'{shared_dir}/pdb'
         outlier_dir = f'{self.prefix}/data/outlier/pipeline-{pipeline_id}'
         cm_data_path = f'{self.prefix}/data/preproc/pipeline-{pipeline_id}/cvae-input.h5'
+        registry_path = f'{self.prefix}/data/ml/registry.jsonl'
 
         task = Task()
-        self.load_environment(task)
-        self.set_python_executable(task)
+        if not self.worker:
+            self.load_environment(task)
+            self.set_python_executable(task)
         self.assign_hardware(task)
 
         # Create output directories for generated files.
@@ -51,6 +103,35 @@ class OPTICSTaskManager(TaskManager):
                           '--sim_path', md_dir,
                           '--shared_path', shared_path,
                           '--cm_path', cm_data_path,
-                          '--cvae_path', cvae_dir]
+                          '--cvae_path', cvae_dir,
+                          '--outlier_path', outlier_dir,
+                          '--registry', registry_path,
+                          '--num_workers', str(self.cpu_reqs.get('threads_per_process', 1)),
+                          '--engine', self.engine,
+                          '--seed_manifest', f'{shared_dir}/seeds.json',
+                          '--novelty_weight', f'{self.novelty_weight}']
+
+        if self.engine != 'optics':
+            task.arguments.extend(['--n_neighbors', f'{self.n_neighbors}',
+                                   '--num_outliers', f'{self.num_outliers}'])
+
+        if self.embed_store:
+            task.arguments.extend(['--embed_store',
+                                   f'{self.prefix}/data/outlier/embeddings'])
+
+        if self.history:
+            task.arguments.append('--history')
+
+        # Deduplicate outliers in latent space before writing PDB files
+        if self.min_distance > 0:
+            task.arguments.extend(['--min_distance', f'{self.min_distance}'])
+        if self.max_per_sim is not None:
+            task.arguments.extend(['--max_per_sim', f'{self.max_per_sim}'])
+
+        if self.worker:
+            self.use_worker(task, f'{self.prefix}/data/worker/outlier')
+
+        # Mark the PDB files as complete for MD stages seeded from them
+        task.post_exec = [f'touch {shared_dir}/complete']
 
         return {task}
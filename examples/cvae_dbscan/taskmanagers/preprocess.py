@@ -4,10 +4,30 @@ from deepdrive import TaskManager
 
 
 class ContactMatrixTaskManager(TaskManager):
-    def __init__(self, cpu_reqs={}, gpu_reqs={}, prefix=os.getcwd()):
+    def __init__(self, stream=False, chunk_size=1024, packed=False,
+                 incremental=False, cpu_reqs={}, gpu_reqs={}, prefix=os.getcwd()):
         """
         Parameters
         ----------
+        stream : bool
+            if True, convert contact maps in chunks of frames to
+            bound the memory usage of the preprocessing task
+
+        chunk_size : int
+            number of frames converted at a time when streaming
+
+        packed : bool
+            if True, store bit-packed upper triangle contact maps
+            instead of full padded matrices
+
+        incremental : bool
+            if True, only frames not converted by earlier iterations
+            are converted. The manifest of the previous iteration
+            records them, and the cvae-input.h5 of each iteration only
+            holds the frames converted since, as without incremental
+            mode. The history option of the outlier stage considers
+            the frames of all iterations.
+
         cpu_reqs : dict
             contains cpu hardware requirments for task
 
@@ -22,6 +42,14 @@ class ContactMatrixTaskManager(TaskManager):
         """
         super().__init__(cpu_reqs, gpu_reqs, prefix)
 
+        if chunk_size < 1:
+            raise ValueError(f'chunk_size must be at least 1, currently {chunk_size}')
+
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.packed = packed
+        self.incremental = incremental
+
     def tasks(self, pipeline_id):
         """
         Returns
@@ -46,4 +74,17 @@ class ContactMatrixTaskManager(TaskManager):
                           '--sim_path', md_dir,
                           '--out', preproc_dir]
 
+        if self.stream:
+            task.arguments.extend(['--stream',
+                                   '--chunk_size', f'{self.chunk_size}'])
+
+        if self.packed:
+            task.arguments.append('--packed')
+
+        if self.incremental:
+            task.arguments.append('--incremental')
+            if pipeline_id > 0:
+                prev_dir = f'{self.prefix}/data/preproc/pipeline-{pipeline_id - 1}'
+                task.arguments.extend(['--previous', prev_dir])
+
         return {task}
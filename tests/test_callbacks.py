@@ -0,0 +1,77 @@
+import pytest
+
+pytest.importorskip('keras')
+
+from deepdrive.ml import callbacks
+from deepdrive.ml.callbacks import BudgetedEarlyStopping
+
+class StubModel:
+    def __init__(self):
+        self.weights = None
+        self.stop_training = False
+
+    def get_weights(self):
+        return [self.weights]
+
+    def set_weights(self, weights):
+        self.weights = weights[0]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.
+
+    def time(self):
+        return self.now
+
+
+class TestBudgetedEarlyStopping:
+
+    def _train(self, monkeypatch, callback, losses, epoch_time=1.):
+        """Run epochs with the given validation losses until stopped."""
+        clock = Clock()
+        monkeypatch.setattr(callbacks, 'time', clock)
+        model = StubModel()
+        callback.model = model
+        callback.on_train_begin()
+        for epoch, loss in enumerate(losses):
+            model.weights = epoch
+            callback.on_epoch_begin(epoch)
+            clock.now += epoch_time
+            callback.on_epoch_end(epoch, {'val_loss': loss})
+            if model.stop_training:
+                break
+        callback.on_train_end()
+        return model
+
+    def test_patience(self, monkeypatch):
+        callback = BudgetedEarlyStopping(patience=2, min_delta=0.05)
+        # 0.48 is not an improvement of at least min_delta over 0.5
+        model = self._train(monkeypatch, callback, [1., 0.5, 0.48, 0.6, 0.1])
+
+        assert callback.stop_reason == 'patience'
+        assert callback.stopped_epoch == 3
+        assert callback.best_epoch == 1
+        # Weights of the best epoch are restored
+        assert model.weights == 1
+
+    def test_time_budget(self, monkeypatch):
+        callback = BudgetedEarlyStopping(time_budget=3.5)
+        # The fourth epoch would end after the budget and is not started
+        model = self._train(monkeypatch, callback, [1., 0.9, 0.8, 0.7, 0.6])
+
+        assert callback.stop_reason == 'time_budget'
+        assert callback.stopped_epoch == 2
+        assert model.weights == 2
+
+        # The next epoch is estimated to take as long as the slowest
+        callback = BudgetedEarlyStopping(time_budget=3.5)
+        self._train(monkeypatch, callback, [1., 0.9, 0.8], epoch_time=2.)
+        assert callback.stopped_epoch == 0
+
+    def test_no_restore(self, monkeypatch):
+        callback = BudgetedEarlyStopping(patience=1, restore_best_weights=False)
+        model = self._train(monkeypatch, callback, [1., 2., 0.5])
+
+        assert callback.stop_reason == 'patience' and callback.stopped_epoch == 1
+        assert model.weights == 1
@@ -0,0 +1,87 @@
+import tempfile
+from radical.entk import Task, states
+
+from deepdrive import DeepDriveMD, TaskManager
+
+class NoOpTaskManager(TaskManager):
+    def __init__(self, name, log):
+        super().__init__(cpu_reqs={}, gpu_reqs={}, prefix='')
+        self.name = name
+        self.log = log
+
+    def tasks(self, pipeline_id):
+        self.log.append((self.name, pipeline_id))
+        task = Task()
+        task.executable = ['/bin/true']
+        return {task}
+
+
+def run_entk(workflow):
+    """
+    Advance the pipelines of a workflow as the EnTK WFprocessor does,
+    completing each stage as soon as it is scheduled. A resumed
+    pipeline only advances if the post_exec resuming it returns its uid.
+
+    """
+    pipelines = sorted(workflow, key=lambda pipeline: pipeline.name)
+    progress = True
+    while progress:
+        progress = False
+        for pipe in pipelines:
+            if pipe.state in states.FINAL or pipe.completed or \
+                    pipe.state == states.SUSPENDED:
+                continue
+            stage = pipe.stages[pipe.current_stage - 1]
+            if stage.state == states.DONE:
+                # Stalled, no tasks left to schedule
+                continue
+            stage.state = states.DONE
+            progress = True
+
+            resumed = stage.post_exec() if stage.post_exec else None
+            if pipe.state != states.SUSPENDED:
+                pipe._increment_stage()
+            resumed_pipes = [other for other in pipelines
+                             if other is not pipe and other.uid in (resumed or [])]
+            for other in resumed_pipes:
+                other._increment_stage()
+            for other in [pipe] + resumed_pipes:
+                if other.completed:
+                    other.state = states.DONE
+
+
+class TestAsyncMode:
+
+    def _deepdrive(self, max_iter, max_staleness):
+        self.log = []
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        ddmd = DeepDriveMD(md_sims=[NoOpTaskManager('md', self.log)],
+                           preprocs=[NoOpTaskManager('preprocess', self.log)],
+                           ml_algs=[NoOpTaskManager('ml', self.log)],
+                           outlier_algs=[NoOpTaskManager('outlier', self.log)],
+                           resources={}, max_iter=max_iter, pipeline_name='DeepDriveMD',
+                           async_mode=True, max_staleness=max_staleness,
+                           backend='local')
+        ddmd.appman.workdir = self.tmp_dir.name
+        return ddmd
+
+    def test_entk(self):
+        # MD of each iteration waits for the outliers of the previous one
+        ddmd = self._deepdrive(max_iter=3, max_staleness=0)
+        run_entk(ddmd.appman.workflow)
+
+        assert [pipeline.state for pipeline in ddmd.appman.workflow] == [states.DONE] * 2
+        md = [pipeline_id for name, pipeline_id in self.log if name == 'md']
+        outlier = [pipeline_id for name, pipeline_id in self.log if name == 'outlier']
+        assert md == [0, 1, 2] and outlier == [0, 1, 2]
+
+    def test_local(self):
+        ddmd = self._deepdrive(max_iter=3, max_staleness=1)
+        ddmd.run()
+
+        assert [pipeline.state for pipeline in ddmd.appman.workflow] == [states.DONE] * 2
+        assert [pipeline_id for name, pipeline_id in self.log if name == 'md'] == [0, 1, 2]
+        assert ddmd.outlier_iter == 2
+
+    def teardown_method(self):
+        self.tmp_dir.cleanup()
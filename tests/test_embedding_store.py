@@ -0,0 +1,95 @@
+import os
+import tempfile
+import numpy as np
+
+from deepdrive.outlier import EmbeddingStore
+from deepdrive.preproc import FrameIndex
+
+class TestEmbeddingStore:
+
+    @classmethod
+    def setup_class(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = EmbeddingStore(os.path.join(self.tmp_dir.name, 'store'))
+        self.traj_file = os.path.join(self.tmp_dir.name, 'output-0.dcd')
+
+        rng = np.random.RandomState(0)
+        self.frames = rng.rand(10, 4, 4, 1)
+        self.embeddings = rng.rand(10, 3).astype(np.float32)
+
+    def test_append(self):
+        assert self.store.frames('0-abc', self.traj_file) == 0
+        assert self.store.load('0-abc', self.traj_file) is None
+
+        self.store.append('0-abc', self.traj_file, self.embeddings[:6], self.frames[5])
+        self.store.append('0-abc', self.traj_file, self.embeddings[6:], self.frames[9])
+
+        frame_at = lambda i: self.frames[i]
+        assert self.store.frames('0-abc', self.traj_file, frame_at) == 10
+        assert np.array_equal(self.store.load('0-abc', self.traj_file), self.embeddings)
+
+        # Unavailable frames are not checked
+        assert self.store.frames('0-abc', self.traj_file, lambda i: None) == 10
+
+        # Other models do not share embeddings
+        assert self.store.frames('0-def', self.traj_file) == 0
+
+    def test_rewritten_trajectory(self):
+        self.store.append('1-abc', self.traj_file, self.embeddings, self.frames[9])
+
+        frames = self.frames.copy()
+        frames[9] += 1
+        assert self.store.frames('1-abc', self.traj_file, lambda i: frames[i]) == 0
+        assert self.store.load('1-abc', self.traj_file) is None
+
+    def _embed(self, store, frame_index, embeddings, frame_at):
+        """Embed the frames left by gather as generate_embeddings does."""
+        out = np.zeros_like(embeddings)
+        ranges = store.gather('2-abc', frame_index, out, frame_at)
+        for start, stop, traj_file in ranges:
+            out[start:stop] = embeddings[start:stop]
+            if traj_file is not None:
+                store.append('2-abc', traj_file, out[start:stop], frame_at(stop - 1))
+        assert np.array_equal(out, embeddings)
+        return ranges
+
+    def test_gather(self):
+        store = EmbeddingStore(os.path.join(self.tmp_dir.name, 'gather'))
+        trajs = [os.path.join(self.tmp_dir.name, f'output-{i}.dcd') for i in range(2)]
+        # Contact maps and embeddings of trajectory frames
+        frames = {traj: np.random.RandomState(i).rand(20, 4) for i, traj in enumerate(trajs)}
+        embed = {traj: np.random.RandomState(i + 2).rand(20, 3).astype(np.float32)
+                 for i, traj in enumerate(trajs)}
+
+        def cvae_input(segments):
+            frame_index = FrameIndex()
+            for traj, start, count in segments:
+                frame_index.append(traj, 'input.pdb', start, count)
+            data = np.concatenate([frames[traj][start:start + count]
+                                   for traj, start, count in segments])
+            embeddings = np.concatenate([embed[traj][start:start + count]
+                                         for traj, start, count in segments])
+            return frame_index, embeddings, lambda i: data[i]
+
+        # First iteration, nothing is stored
+        ranges = self._embed(store, *cvae_input([(trajs[0], 0, 6), (trajs[1], 0, 4)]))
+        assert ranges == [(0, 6, trajs[0]), (6, 10, trajs[1])]
+
+        # A copied and extended input only embeds the new frames
+        ranges = self._embed(store, *cvae_input([(trajs[1], 0, 4), (trajs[0], 0, 6),
+                                                 (trajs[0], 6, 4)]))
+        assert ranges == [(10, 14, trajs[0])]
+
+        # So does the input of the next iteration holding new frames only
+        ranges = self._embed(store, *cvae_input([(trajs[0], 8, 4), (trajs[1], 4, 2)]))
+        assert ranges == [(2, 4, trajs[0]), (4, 6, trajs[1])]
+        assert store.frames('2-abc', trajs[0]) == 12
+
+        # Frames past a gap in the stored frames are embedded but not stored
+        ranges = self._embed(store, *cvae_input([(trajs[1], 10, 2)]))
+        assert ranges == [(0, 2, None)]
+        assert store.frames('2-abc', trajs[1]) == 6
+
+    @classmethod
+    def teardown_class(self):
+        self.tmp_dir.cleanup()
@@ -0,0 +1,82 @@
+import os
+import pytest
+import tempfile
+import numpy as np
+
+from deepdrive.preproc import FrameIndex
+
+class TestFrameIndex:
+
+    @classmethod
+    def setup_class(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+        # Two simulations of different length, the first one
+        # extended by incremental preprocessing
+        self.index = FrameIndex()
+        self.index.append('output-0.dcd', 'input-0.pdb', 0, 5)
+        self.index.append('output-1.dcd', 'input-1.pdb', 0, 3)
+        self.index.append('output-0.dcd', 'input-0.pdb', 5, 2)
+
+    def test_locate(self):
+        assert len(self.index) == 10
+        assert self.index.traj_files == ['output-0.dcd', 'output-1.dcd']
+
+        sims, frames = self.index.locate([0, 4, 5, 7, 8, 9])
+        assert sims.tolist() == [0, 0, 1, 1, 0, 0]
+        assert frames.tolist() == [0, 4, 0, 2, 5, 6]
+
+        with pytest.raises(IndexError):
+            self.index.locate([10])
+
+    def test_find(self):
+        assert self.index.find('output-0.dcd', [0, 4, 5, 6, 7]).tolist() == [0, 4, 8, 9, -1]
+        assert self.index.find('output-1.dcd', [2, 3]).tolist() == [7, -1]
+        assert self.index.find('output-2.dcd', [0]).tolist() == [-1]
+
+        inds = np.arange(len(self.index))
+        sims, frames = self.index.locate(inds)
+        for ind, sim, frame in zip(inds, sims, frames):
+            assert self.index.find(self.index.traj_files[sim], [frame])[0] == ind
+
+    def test_covers(self):
+        other = FrameIndex()
+        other.append('output-1.dcd', 'input-1.pdb', 1, 2)
+        other.append('output-0.dcd', 'input-0.pdb', 2, 5)
+        assert self.index.covers(other) and self.index.covers(self.index)
+
+        other.append('output-0.dcd', 'input-0.pdb', 6, 2)
+        assert not self.index.covers(other)
+        assert not FrameIndex().covers(self.index)
+
+    def test_save_load(self):
+        path = os.path.join(self.tmp_dir.name, 'cvae-input-index.npz')
+        self.index.save(path)
+        loaded = FrameIndex.load(path)
+
+        assert loaded.traj_files == self.index.traj_files
+        assert loaded.pdb_files == self.index.pdb_files
+        assert np.array_equal(loaded.locate(np.arange(10))[1],
+                              self.index.locate(np.arange(10))[1])
+
+        # Appending to a loaded index reuses known simulations
+        loaded.append('output-1.dcd', 'input-1.pdb', 3, 1)
+        assert loaded.locate([10])[0].tolist() == [1]
+
+    def test_extend(self):
+        other = FrameIndex()
+        other.append('output-2.dcd', 'input-2.pdb', 0, 4)
+        other.append('output-0.dcd', 'input-0.pdb', 7, 1)
+
+        index = FrameIndex()
+        index.extend(self.index)
+        index.extend(other)
+
+        sims, frames = index.locate([10, 13, 14])
+        assert [index.traj_files[sim] for sim in sims] == \
+               ['output-2.dcd', 'output-2.dcd', 'output-0.dcd']
+        assert frames.tolist() == [0, 3, 7]
+
+    @classmethod
+    def teardown_class(self):
+        self.tmp_dir.cleanup()
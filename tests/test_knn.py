@@ -0,0 +1,56 @@
+import pytest
+import numpy as np
+from sklearn.neighbors import LocalOutlierFactor, NearestNeighbors
+
+from deepdrive.outlier import (knn_query, knn_outlier_scores, local_outlier_factor,
+                               top_outliers)
+
+class TestKNN:
+
+    @classmethod
+    def setup_class(self):
+        rng = np.random.RandomState(0)
+        self.data = np.concatenate([rng.normal(size=(300, 3)),
+                                    rng.normal(loc=6., size=(5, 3))])
+        self.k = 10
+
+    def test_knn_query(self):
+        dist, ind = knn_query(self.data, self.k)
+        expected_dist, expected_ind = NearestNeighbors(n_neighbors=self.k) \
+                                      .fit(self.data).kneighbors()
+        assert np.allclose(dist, expected_dist)
+        assert np.array_equal(ind, expected_ind)
+
+        # Batches, threads and trees do not change the neighbors
+        for kwargs in [{'batch_size': 7, 'num_workers': 3}, {'algorithm': 'ball_tree'}]:
+            batch_dist, batch_ind = knn_query(self.data, self.k, **kwargs)
+            assert np.allclose(batch_dist, dist)
+            assert np.array_equal(batch_ind, ind)
+
+        with pytest.raises(ValueError):
+            knn_query(self.data[:5], 5)
+
+    def test_lof(self):
+        lof = LocalOutlierFactor(n_neighbors=self.k).fit(self.data)
+        scores = knn_outlier_scores(self.data, self.k, method='lof')
+        assert np.allclose(scores, -lof.negative_outlier_factor_)
+        assert np.allclose(scores, local_outlier_factor(*knn_query(self.data, self.k)))
+
+        kdist = knn_outlier_scores(self.data, self.k, method='kdist')
+        assert np.allclose(kdist, knn_query(self.data, self.k)[0][:, -1])
+
+        # The distant cluster is the most outlying
+        assert set(top_outliers(kdist, 5)) == set(range(300, 305))
+
+        for method in ['lof', 'kdist']:
+            with pytest.raises(ValueError):
+                knn_outlier_scores(self.data, 0, method=method)
+
+    def test_top_outliers(self):
+        scores = np.array([0.5, 3., 1., 3., 2., 1., 1.])
+        assert top_outliers(scores, 3).tolist() == [1, 3, 4]
+        # Ties are selected and ordered by index
+        assert top_outliers(scores, 5).tolist() == [1, 3, 4, 2, 5]
+        assert top_outliers(scores, 100).tolist() == [1, 3, 4, 2, 5, 6, 0]
+        assert top_outliers(scores, 0).tolist() == []
+        assert top_outliers(np.ones(1000), 3).tolist() == [0, 1, 2]
@@ -0,0 +1,57 @@
+import pytest
+import numpy as np
+
+pytest.importorskip('keras')
+
+from deepdrive.ml import ContactMapSequence, split_blocks
+
+class TestLoader:
+
+    @classmethod
+    def setup_class(self):
+        # Each frame holds its own index
+        self.num_frames = 103
+        self.data = np.arange(self.num_frames)[:, np.newaxis]
+
+    def test_split_blocks(self):
+        train, valid = split_blocks(self.num_frames, 10, valid_fraction=0.2, seed=1)
+
+        assert len(valid) == 2 and len(train) == 9
+        frames = np.concatenate([np.arange(start, stop)
+                                 for start, stop in np.concatenate([train, valid])])
+        assert np.array_equal(np.sort(frames), np.arange(self.num_frames))
+        # Blocks keep file order within each split
+        assert np.all(np.diff(train[:, 0]) > 0) and np.all(np.diff(valid[:, 0]) > 0)
+
+        same_train, same_valid = split_blocks(self.num_frames, 10, valid_fraction=0.2, seed=1)
+        assert np.array_equal(train, same_train) and np.array_equal(valid, same_valid)
+
+        # Every split of more than one block has both sets
+        train, valid = split_blocks(15, 10, valid_fraction=0.01)
+        assert len(train) == 1 and len(valid) == 1
+
+    def test_epochs(self):
+        # Ragged blocks group into windows of varying size each epoch
+        blocks = np.array([[0, 7], [7, 30], [30, 33], [33, 70], [70, 103]])
+        sequence = ContactMapSequence(self.data, blocks, batch_size=8,
+                                      window_batches=2, seed=0)
+        assert len(sequence) == 13
+
+        for _ in range(5):
+            batches = [sequence[i][0] for i in range(len(sequence))]
+            assert [len(batch) for batch in batches] == [8] * 12 + [7]
+            frames = np.concatenate(batches)[:, 0]
+            assert np.array_equal(np.sort(frames), np.arange(self.num_frames))
+
+            sequence.on_epoch_end()
+            assert len(sequence) == 13
+
+        with pytest.raises(IndexError):
+            sequence[13]
+
+    def test_no_shuffle(self):
+        blocks = np.array([[0, 50], [50, 103]])
+        sequence = ContactMapSequence(self.data, blocks, batch_size=16,
+                                      shuffle=False, prefetch=False)
+        frames = np.concatenate([sequence[i][0] for i in range(len(sequence))])[:, 0]
+        assert np.array_equal(frames, np.arange(self.num_frames))
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import numpy as np
+import MDAnalysis as mda
+
+from deepdrive.outlier import outlier_pdb_name, write_sim_pdbs
+
+def write_trajectory(sim_path, num_atoms=5, num_frames=4, seed=0):
+    os.makedirs(sim_path)
+    pdb_path = os.path.join(sim_path, 'input-0.pdb')
+    dcd_path = os.path.join(sim_path, 'output-0.dcd')
+
+    u = mda.Universe.empty(num_atoms, n_residues=num_atoms,
+                           atom_resindex=np.arange(num_atoms), trajectory=True)
+    u.add_TopologyAttr('names', ['CA'] * num_atoms)
+    u.add_TopologyAttr('resnames', ['ALA'] * num_atoms)
+    u.add_TopologyAttr('resids', np.arange(1, num_atoms + 1))
+    rng = np.random.RandomState(seed)
+    u.atoms.positions = rng.rand(num_atoms, 3) * 10
+    u.atoms.write(pdb_path)
+
+    with mda.Writer(dcd_path, num_atoms) as writer:
+        for _ in range(num_frames):
+            u.atoms.positions = rng.rand(num_atoms, 3) * 10
+            writer.write(u.atoms)
+
+    return pdb_path, dcd_path
+
+class TestOutlierPDBs:
+
+    @classmethod
+    def setup_class(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # Simulations of different iterations share their sim_id
+        self.sims = [write_trajectory(os.path.join(self.tmp_dir.name, 'md', f'pipeline-{i}'),
+                                      seed=i)
+                     for i in range(2)]
+        self.shared_path = os.path.join(self.tmp_dir.name, 'pdb')
+        os.makedirs(self.shared_path)
+
+    def test_names(self):
+        names = [outlier_pdb_name(dcd_path, 3) for _, dcd_path in self.sims]
+        assert names == ['outlier-pipeline-0-0-3.pdb', 'outlier-pipeline-1-0-3.pdb']
+
+    def test_write(self):
+        for pdb_path, dcd_path in self.sims:
+            assert write_sim_pdbs(pdb_path, dcd_path, [1, 3], self.shared_path) == 2
+
+        assert sorted(os.listdir(self.shared_path)) == [
+            'outlier-pipeline-0-0-1.pdb', 'outlier-pipeline-0-0-3.pdb',
+            'outlier-pipeline-1-0-1.pdb', 'outlier-pipeline-1-0-3.pdb']
+
+        # Each file holds the frame of its own simulation
+        for pdb_path, dcd_path in self.sims:
+            u = mda.Universe(pdb_path, dcd_path)
+            u.trajectory[3]
+            written = mda.Universe(os.path.join(self.shared_path,
+                                                outlier_pdb_name(dcd_path, 3)))
+            assert np.allclose(written.atoms.positions, u.atoms.positions, atol=1e-3)
+
+    @classmethod
+    def teardown_class(self):
+        self.tmp_dir.cleanup()
@@ -0,0 +1,289 @@
+import os
+import sys
+import h5py
+import pytest
+import tempfile
+import numpy as np
+
+from deepdrive.preproc import (cm_to_cvae, stream_cm_to_cvae, append_cm_to_cvae,
+                               triu_to_full_batch, pack_triu_batch,
+                               unpack_triu_batch, ContactMapReader,
+                               contact_map_triu, open_contact_maps,
+                               PreprocManifest, FrameIndex)
+from deepdrive.utils import get_id
+
+SCRIPTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'examples', 'cvae_dbscan', 'scripts')
+
+
+def triu_to_full(cm0):
+    # Reference single frame implementation from molecules.utils
+    num_res = int(np.ceil((len(cm0) * 2) ** 0.5))
+    iu1 = np.triu_indices(num_res, 1)
+    cm_full = np.zeros((num_res, num_res))
+    cm_full[iu1] = cm0
+    cm_full.T[iu1] = cm0
+    np.fill_diagonal(cm_full, 1)
+    return cm_full
+
+
+class TestTriuToFullBatch:
+
+    @classmethod
+    def setup_class(self):
+        self.rng = np.random.RandomState(0)
+
+    def _batch(self, num_res, num_frames):
+        triu_len = num_res * (num_res - 1) // 2
+        return (self.rng.rand(num_frames, triu_len) < 0.3).astype(np.float32)
+
+    def test_matches_per_frame(self):
+        for num_res in [21, 22]:
+            cm_batch = self._batch(num_res, 7)
+            full = triu_to_full_batch(cm_batch)
+
+            dim = num_res + num_res % 2
+            assert full.shape == (7, dim, dim)
+
+            for frame, cm in zip(full, cm_batch):
+                expected = triu_to_full(cm)
+                assert np.array_equal(frame[:num_res, :num_res], expected)
+                # Padding row and column must be zero
+                assert not frame[num_res:].any()
+                assert not frame[:, num_res:].any()
+
+    def test_out_buffer(self):
+        cm_batch = self._batch(21, 5)
+        out = np.full((8, 22, 22), np.nan)
+        full = triu_to_full_batch(cm_batch, out=out[:5])
+
+        assert np.shares_memory(full, out)
+        assert np.array_equal(full, triu_to_full_batch(cm_batch))
+
+        with pytest.raises(ValueError):
+            triu_to_full_batch(cm_batch, out=out[:5, ::-1])
+
+    @classmethod
+    def teardown_class(self):
+        pass
+
+
+class TestPackedContactMaps:
+
+    @classmethod
+    def setup_class(self):
+        rng = np.random.RandomState(0)
+        self.cm_data = [(rng.rand(210, n) < 0.3).astype(np.float32)
+                        for n in [50, 37]]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def test_pack_roundtrip(self):
+        cm_batch = self.cm_data[0].T
+        packed = pack_triu_batch(cm_batch)
+
+        assert packed.dtype == np.uint8
+        assert packed.shape == (50, 27)
+        assert np.array_equal(unpack_triu_batch(packed, 210), cm_batch)
+
+    def test_reader(self):
+        expected = cm_to_cvae(self.cm_data)
+
+        for packed in [False, True]:
+            path = os.path.join(self.tmp_dir.name, f'cvae-input-{packed}.h5')
+            with h5py.File(path, 'w') as file:
+                stream_cm_to_cvae(self.cm_data, file, chunk_size=16, packed=packed)
+
+            with h5py.File(path, 'r') as file:
+                reader = ContactMapReader(file, batch_size=10)
+
+                assert reader.packed == packed
+                assert reader.shape == expected.shape
+                assert np.array_equal(reader[:], expected)
+                assert np.array_equal(reader[-1], expected[-1])
+                assert np.array_equal(reader[[9, 3, 3]], expected[[9, 3, 3]])
+
+                batches = list(reader.batches(32))
+                assert [start for start, _ in batches] == [0, 32, 64]
+                assert np.array_equal(np.concatenate([batch for _, batch in batches]),
+                                      expected)
+
+    @classmethod
+    def teardown_class(self):
+        self.tmp_dir.cleanup()
+
+
+class TestContactMaps:
+
+    @classmethod
+    def setup_class(self):
+        rng = np.random.RandomState(0)
+        # Random walk of 600 C-alpha atoms in Angstrom
+        self.positions = np.cumsum(rng.normal(scale=2.2, size=(600, 3)), axis=0)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def test_contact_map_triu(self):
+        num_atoms = len(self.positions)
+        rows, cols = np.triu_indices(num_atoms, 1)
+        dist = np.linalg.norm(self.positions[rows] - self.positions[cols], axis=1)
+        expected = dist < 8.0
+
+        for method in ['dense', 'kdtree', 'auto']:
+            contacts = contact_map_triu(self.positions, 8.0, method)
+            assert np.array_equal(contacts, expected)
+            packed = contact_map_triu(self.positions, 8.0, method, packed=True)
+            assert np.array_equal(packed, pack_triu_batch(expected[np.newaxis])[0])
+
+    def test_open_packed_md_contact_maps(self):
+        frames = [contact_map_triu(self.positions[:21] + i, 8.0) for i in range(5)]
+        cm_data = np.array(frames, dtype=np.float32).T
+
+        path = os.path.join(self.tmp_dir.name, 'output-cm-0.h5')
+        with h5py.File(path, 'w') as file:
+            dset = file.create_dataset('contact_maps',
+                                       data=pack_triu_batch(cm_data.T))
+            dset.attrs['packed'] = True
+            dset.attrs['triu_len'] = 210
+
+        with h5py.File(path, 'r') as file:
+            packed_data = open_contact_maps(file)
+            assert packed_data.shape == (210, 5)
+            assert np.array_equal(packed_data[:, 1:3], cm_data[:, 1:3])
+
+            expected = cm_to_cvae([cm_data])
+            assert np.array_equal(cm_to_cvae([packed_data]), expected)
+
+            for packed in [False, True]:
+                with h5py.File(os.path.join(self.tmp_dir.name, 'cvae-input.h5'), 'w') as out:
+                    stream_cm_to_cvae([packed_data], out, chunk_size=2, packed=packed)
+                    assert np.array_equal(ContactMapReader(out)[:], expected)
+
+    @classmethod
+    def teardown_class(self):
+        self.tmp_dir.cleanup()
+
+
+class TestIncremental:
+
+    @classmethod
+    def setup_class(self):
+        rng = np.random.RandomState(0)
+        self.cm_data = [(rng.rand(210, n) < 0.3).astype(np.float32)
+                        for n in [30, 25]]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def test_append(self):
+        start_frames = [20, 10]
+        old = [data[:, :start] for data, start in zip(self.cm_data, start_frames)]
+        new = [data[:, start:] for data, start in zip(self.cm_data, start_frames)]
+        # New frames follow the old frames of all files
+        expected = np.concatenate([cm_to_cvae(old), cm_to_cvae(new)])
+
+        for packed in [False, True]:
+            path = os.path.join(self.tmp_dir.name, f'cvae-input-{packed}.h5')
+            with h5py.File(path, 'w') as file:
+                stream_cm_to_cvae(old, file, chunk_size=8, packed=packed)
+
+            with h5py.File(path, 'a') as file:
+                num_new = append_cm_to_cvae(self.cm_data, file['contact_maps'],
+                                            start_frames, chunk_size=8)
+                assert num_new == 25
+
+            with h5py.File(path, 'r') as file:
+                reader = ContactMapReader(file)
+                assert reader.packed == packed
+                assert np.array_equal(reader[:], expected)
+
+    def test_start_frames(self):
+        start_frames = [20, 10]
+        new = [data[:, start:] for data, start in zip(self.cm_data, start_frames)]
+
+        for packed in [False, True]:
+            path = os.path.join(self.tmp_dir.name, f'cvae-input-new-{packed}.h5')
+            with h5py.File(path, 'w') as file:
+                dset = stream_cm_to_cvae(self.cm_data, file, chunk_size=8,
+                                         packed=packed, start_frames=start_frames)
+                assert len(dset) == 25
+
+            with h5py.File(path, 'r') as file:
+                assert np.array_equal(ContactMapReader(file)[:], cm_to_cvae(new))
+
+    def _write_sim(self, sim_path, lengths):
+        os.makedirs(sim_path, exist_ok=True)
+        for i, (data, length) in enumerate(zip(self.cm_data, lengths)):
+            path = os.path.join(sim_path, f'output-cm-{i}.h5')
+            with h5py.File(path, 'w') as file:
+                file.create_dataset('contact_maps', data=data[:, :length])
+            # Rewritten files are detected by their modification time
+            os.utime(path, (0, sum(lengths)))
+
+    def test_previous(self):
+        pytest.importorskip('molecules')
+        sys.path.insert(0, SCRIPTS_PATH)
+        import contact_map
+
+        sim_path = os.path.join(self.tmp_dir.name, 'md')
+        out_paths = [os.path.join(self.tmp_dir.name, 'preproc', f'pipeline-{i}')
+                     for i in range(3)]
+        for path in out_paths:
+            os.makedirs(path)
+
+        # The simulations are extended between iterations
+        for i, (lengths, previous) in enumerate([([20, 10], []),
+                                                 ([30, 10], ['--previous', out_paths[0]]),
+                                                 ([30, 25], ['--previous', out_paths[1]])]):
+            self._write_sim(sim_path, lengths)
+            contact_map.main(['--sim_path', sim_path, '--out', out_paths[i],
+                              '--incremental', '--packed', *previous],
+                             standalone_mode=False)
+
+        # Each iteration only holds the frames converted since the previous one
+        expected = [[(0, 0, 20), (1, 0, 10)], [(0, 20, 10)], [(1, 10, 15)]]
+        for path, segments in zip(out_paths, expected):
+            with h5py.File(os.path.join(path, 'cvae-input.h5'), 'r') as file:
+                frames = ContactMapReader(file)[:]
+            assert np.array_equal(frames, cm_to_cvae([self.cm_data[sim][:, start:start + count]
+                                                      for sim, start, count in segments]))
+
+            frame_index = FrameIndex.load(os.path.join(path, 'cvae-input-index.npz'))
+            sims = [int(get_id(frame_index.traj_files[sim], 'output-', 'dcd'))
+                    for sim in frame_index.sims]
+            assert list(zip(sims, frame_index.starts, frame_index.counts)) == segments
+
+        # The manifest records the frames of all iterations
+        manifest = PreprocManifest(os.path.join(out_paths[2], 'cvae-input-manifest.json'))
+        assert [manifest.frames(os.path.join(sim_path, f'output-cm-{i}.h5'))
+                for i in range(2)] == [30, 25]
+
+    def test_manifest(self):
+        cm_file = os.path.join(self.tmp_dir.name, 'output-cm-0.h5')
+        with open(cm_file, 'wb') as file:
+            file.write(b'0' * 100)
+
+        path = os.path.join(self.tmp_dir.name, 'cvae-input-manifest.json')
+        manifest = PreprocManifest(path)
+        assert cm_file not in manifest and manifest.is_modified(cm_file)
+        manifest.update(cm_file, 30)
+        manifest.save()
+
+        manifest = PreprocManifest(path)
+        assert cm_file in manifest
+        assert manifest.frames(cm_file) == 30
+        assert not manifest.is_modified(cm_file)
+
+        # A changed modification time invalidates the entry
+        stat = os.stat(cm_file)
+        os.utime(cm_file, (stat.st_atime, stat.st_mtime + 1))
+        assert manifest.is_modified(cm_file)
+        manifest.update(cm_file, 30)
+
+        # So does a changed size
+        with open(cm_file, 'ab') as file:
+            file.write(b'0')
+        os.utime(cm_file, (stat.st_atime, stat.st_mtime + 1))
+        assert manifest.is_modified(cm_file)
+
+        assert manifest.frames(os.path.join(self.tmp_dir.name, 'output-cm-1.h5')) == 0
+
+    @classmethod
+    def teardown_class(self):
+        self.tmp_dir.cleanup()
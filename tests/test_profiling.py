@@ -0,0 +1,56 @@
+import os
+import time
+import tempfile
+
+from deepdrive.utils import TaskProfiler
+from deepdrive.utils.profiling import (load_profiles, save_pending,
+                                       chrome_trace, summary_table)
+
+class TestProfiling:
+
+    @classmethod
+    def setup_class(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.profile_dir = os.path.join(self.tmp_dir.name, 'pipeline-0')
+
+        os.environ['DEEPDRIVE_PIPELINE_ID'] = '0'
+        os.environ['DEEPDRIVE_STAGE'] = 'ML'
+        os.environ['DEEPDRIVE_TASK_UID'] = 'task.0000'
+
+        self.profiler = TaskProfiler('cvae', self.profile_dir)
+        self.profiler.mark('read')
+        time.sleep(0.01)
+        self.profiler.mark('compute')
+        with self.profiler.phase('write'):
+            time.sleep(0.01)
+
+    def test_save(self):
+        path = self.profiler.save()
+        assert os.path.exists(path)
+
+        stages, tasks = load_profiles(self.tmp_dir.name)
+        assert stages == []
+        assert len(tasks) == 1
+        assert [phase['name'] for phase in tasks[0]['phases']] == ['read', 'write', 'compute']
+        assert tasks[0]['stage'] == 'ML' and tasks[0]['peak_rss'] > 0
+
+    def test_report(self):
+        self.profiler.save()
+        _, tasks = load_profiles(self.tmp_dir.name)
+        stages = [{'pipeline_id': 0, 'stage': 'ML', 'submit': tasks[0]['start'] - 1,
+                   'end': tasks[0]['end'], 'tasks': ['task.0000']}]
+
+        trace = chrome_trace(stages, tasks)
+        names = [event['name'] for event in trace['traceEvents'] if event['ph'] == 'X']
+        assert names == ['ML', 'cvae', 'read', 'write', 'compute']
+
+        table = summary_table(stages, tasks).splitlines()
+        assert len(table) == 2
+        assert table[1].split()[:2] == ['0', 'ML']
+
+    @classmethod
+    def teardown_class(self):
+        save_pending()
+        for env in ['DEEPDRIVE_PIPELINE_ID', 'DEEPDRIVE_STAGE', 'DEEPDRIVE_TASK_UID']:
+            del os.environ[env]
+        self.tmp_dir.cleanup()
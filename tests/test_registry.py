@@ -0,0 +1,68 @@
+import os
+import json
+import pytest
+import tempfile
+import threading
+
+# deepdrive.ml imports keras
+pytest.importorskip('keras')
+
+from deepdrive.ml import ModelRegistry
+
+class TestRegistry:
+
+    def setup_method(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'registry.jsonl')
+        self.registry = ModelRegistry(self.path)
+
+    def test_best(self):
+        assert self.registry.entries() == [] and self.registry.best() is None
+
+        self.registry.register(model_id='0', pipeline_id=0, final_val_loss=0.3)
+        self.registry.register(model_id='1', pipeline_id=0, final_val_loss=0.1)
+        self.registry.register(model_id='2', pipeline_id=0, final_val_loss=None)
+        self.registry.register(model_id='0', pipeline_id=1, final_val_loss=0.2)
+
+        entries = self.registry.entries()
+        assert [entry['model_id'] for entry in entries] == ['0', '1', '2', '0']
+        assert all('timestamp' in entry for entry in entries)
+        assert len(self.registry.entries(model_id='0')) == 2
+
+        assert self.registry.best()['model_id'] == '1'
+        assert self.registry.best(pipeline_id=1)['final_val_loss'] == 0.2
+        # Entries without the key are ignored
+        assert self.registry.best(model_id='2') is None
+        assert self.registry.best(pipeline_id=2) is None
+
+    def test_truncated_line(self):
+        self.registry.register(model_id='0', final_val_loss=0.3)
+        # A writer interrupted in the middle of a line
+        with open(self.path, 'a') as file:
+            file.write('{"model_id": "1", "final_va')
+        self.registry.register(model_id='2', final_val_loss=0.2)
+
+        assert [entry['model_id'] for entry in self.registry.entries()] == ['0', '2']
+        with open(self.path) as file:
+            assert len(file.readlines()) == 3
+
+    def test_concurrent(self):
+        def register(thread):
+            # Each thread appends through its own file description and lock
+            registry = ModelRegistry(self.path)
+            for i in range(50):
+                registry.register(model_id=f'{thread}-{i}', final_val_loss=float(i))
+
+        threads = [threading.Thread(target=register, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with open(self.path) as file:
+            lines = file.readlines()
+        assert len(lines) == 400
+        assert len({json.loads(line)['model_id'] for line in lines}) == 400
+
+    def teardown_method(self):
+        self.tmp_dir.cleanup()
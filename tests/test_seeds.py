@@ -0,0 +1,68 @@
+import os
+import tempfile
+import numpy as np
+
+from deepdrive.outlier import (seed_priorities, diverse_subset, write_seed_manifest,
+                               SeedQueue)
+
+class TestSeeds:
+
+    @classmethod
+    def setup_class(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdb_files = []
+        for i in range(4):
+            path = os.path.join(self.tmp_dir.name, f'outlier-{i}.pdb')
+            open(path, 'w').close()
+            self.pdb_files.append(path)
+
+    def test_priorities(self):
+        embeddings = np.array([[0., 0.], [0.1, 0.], [0., 0.1], [5., 0.], [0., 1.]])
+        scores, novelty, priority = seed_priorities(embeddings, np.array([3, 4]),
+                                                    np.array([0]), k=2)
+        assert np.allclose(novelty, [5., 1.])
+        assert scores[0] > scores[1]
+        assert np.allclose(priority, [2., scores[1] / scores[0] + 0.2])
+
+        # Given scores are used as is
+        scores, _, priority = seed_priorities(embeddings, np.array([3, 4]), np.array([0]),
+                                              scores=np.array([1., 3.]), novelty_weight=0.)
+        assert np.allclose(priority, [1. / 3., 1.])
+
+    def test_diverse_subset(self):
+        embeddings = np.array([[0., 0.], [0.05, 0.], [1., 0.], [1., 0.05], [2., 0.], [3., 0.]])
+        candidates = np.array([1, 0, 2, 3, 4, 5])
+
+        # Candidates near a preferred one are dropped
+        keep = diverse_subset(embeddings, candidates, min_distance=0.1)
+        assert candidates[keep].tolist() == [1, 2, 4, 5]
+
+        keep = diverse_subset(embeddings, candidates, min_distance=0.1,
+                              groups=np.array([0, 0, 1, 1, 1, 0]), max_per_group=1)
+        assert candidates[keep].tolist() == [1, 2]
+
+        assert len(diverse_subset(embeddings, candidates)) == len(candidates)
+
+    def test_queue(self):
+        manifests = [os.path.join(self.tmp_dir.name, f'seeds-{i}.json') for i in range(2)]
+        write_seed_manifest(manifests[0], [{'pdb': self.pdb_files[0], 'priority': 0.5},
+                                           {'pdb': self.pdb_files[1], 'priority': 1.5},
+                                           {'pdb': self.pdb_files[2], 'priority': 1.}])
+        write_seed_manifest(manifests[1], [{'pdb': self.pdb_files[3], 'priority': 0.4}])
+
+        path = os.path.join(self.tmp_dir.name, 'seed-queue.json')
+        queue = SeedQueue(path)
+        assert queue.add_manifest(manifests[0])
+        assert [seed['pdb'] for seed in queue.pop(2)] == self.pdb_files[1:3]
+        queue.save()
+
+        # Leftover seeds carry forward, manifests are only added once
+        queue = SeedQueue(path)
+        assert not queue.add_manifest(manifests[0])
+        assert queue.add_manifest(manifests[1], decay=0.5)
+        assert [seed['pdb'] for seed in queue.pop(2)] == [self.pdb_files[3], self.pdb_files[0]]
+        assert len(queue) == 0
+
+    @classmethod
+    def teardown_class(self):
+        self.tmp_dir.cleanup()
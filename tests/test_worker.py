@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import subprocess
+
+import deepdrive
+from deepdrive.worker import WorkerServer, submit
+from deepdrive.worker import client
+from deepdrive.utils.profiling import load_profiles
+
+SCRIPT = '''
+import os
+import click
+
+calls = []
+
+@click.command()
+@click.option('-n', '--name', required=True)
+def main(name):
+    calls.append(name)
+    print(f'{name} {len(calls)} {os.environ.get("DEEPDRIVE_STAGE")}')
+'''
+
+# Creates create, then waits for wait_for to exist
+WAIT_SCRIPT = '''
+import os
+import time
+import click
+
+@click.command()
+@click.option('-w', '--wait_for', default=None)
+@click.option('-c', '--create', default=None)
+@click.option('-t', '--timeout', default=10., type=float)
+def main(wait_for, create, timeout):
+    if create:
+        open(create, 'w').close()
+    start = time.time()
+    while wait_for and not os.path.exists(wait_for):
+        if time.time() - start > timeout:
+            raise click.ClickException(f'{wait_for} missing')
+        time.sleep(0.01)
+    print(os.getpid())
+'''
+
+# Profiled task allocating size MB
+PROFILED_SCRIPT = '''
+import click
+from deepdrive.utils import TaskProfiler
+
+@click.command()
+@click.option('-s', '--size', default=0, type=int)
+def main(size):
+    profiler = TaskProfiler('alloc')
+    profiler.mark('compute')
+    data = bytearray(size * 2**20)
+    data[::4096] = b'1' * len(data[::4096])
+'''
+
+class TestWorker:
+
+    @classmethod
+    def setup_class(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.queue_dir = os.path.join(self.tmp_dir.name, 'queue')
+        self.script = os.path.join(self.tmp_dir.name, 'hello.py')
+        with open(self.script, 'w') as file:
+            file.write(SCRIPT)
+        self.wait_script = os.path.join(self.tmp_dir.name, 'wait.py')
+        with open(self.wait_script, 'w') as file:
+            file.write(WAIT_SCRIPT)
+
+        self.server = WorkerServer(self.queue_dir, idle_timeout=5.)
+
+    def _request(self, request_id, args):
+        request = {'id': request_id, 'script': self.script, 'args': args,
+                   'cwd': self.tmp_dir.name, 'env': {'DEEPDRIVE_STAGE': 'ML'}}
+        with open(os.path.join(self.queue_dir, 'requests', f'{request_id}.json'), 'w') as file:
+            json.dump(request, file)
+
+    def test_run(self):
+        self._request('0', ['--name', 'a'])
+        self._request('1', [])
+        assert self.server.run(self.server.claim()) == 0
+        # Click usage errors exit with code 2 as in a new process
+        assert self.server.run(self.server.claim()) == 2
+        assert self.server.claim() is None
+
+        with open(os.path.join(self.queue_dir, 'results', '0.out')) as file:
+            assert file.read() == 'a 1 ML\n'
+        assert 'DEEPDRIVE_STAGE' not in os.environ
+
+    def test_submit(self):
+        thread = threading.Thread(target=self.server.serve)
+        thread.start()
+        try:
+            # Module state is kept between requests
+            assert submit(self.queue_dir, self.script, ['--name', 'b'], timeout=5.) == 0
+            assert self.server.module(self.script).calls[-1] == 'b'
+        finally:
+            self.server.idle_timeout = 0.
+            thread.join()
+        assert not os.path.exists(os.path.join(self.queue_dir, 'heartbeat-0'))
+
+    def test_profiles(self):
+        script = os.path.join(self.tmp_dir.name, 'alloc.py')
+        with open(script, 'w') as file:
+            file.write(PROFILED_SCRIPT)
+        profile_dir = os.path.join(self.tmp_dir.name, 'profiles', 'pipeline-0')
+
+        # Requests run in the same process, each saves its own profile
+        for i, size in enumerate([200, 0]):
+            request = {'id': f'alloc-{i}', 'script': script, 'args': ['--size', f'{size}'],
+                       'cwd': self.tmp_dir.name,
+                       'env': {'DEEPDRIVE_PROFILE_DIR': profile_dir,
+                               'DEEPDRIVE_TASK_UID': f'task.{i:04d}'}}
+            with open(os.path.join(self.queue_dir, 'requests', f'alloc-{i}.json'), 'w') as file:
+                json.dump(request, file)
+            assert self.server.run(self.server.claim()) == 0
+
+        _, tasks = load_profiles(os.path.dirname(profile_dir))
+        assert [task['uid'] for task in tasks] == ['task.0000', 'task.0001']
+        assert tasks[0]['pid'] == tasks[1]['pid']
+        # The peak memory of the second request does not include the first
+        assert tasks[1]['peak_rss_scope'] == 'task'
+        assert tasks[0]['peak_rss'] - tasks[1]['peak_rss'] > 100 * 2**20
+
+    def _start_servers(self, queue_dir, slots):
+        # Servers run by path import deepdrive from the repository
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(deepdrive.__file__)))
+        server = os.path.join(os.path.dirname(client.__file__), 'server.py')
+        procs = [subprocess.Popen([sys.executable, server, '--queue_dir', queue_dir,
+                                   '--slot', f'{slot}', '--idle_timeout', '1'], env=env)
+                 for slot in range(slots)]
+        start = time.time()
+        while not all(client.is_alive(queue_dir, slot) for slot in range(slots)):
+            assert time.time() - start < 30.
+            time.sleep(0.05)
+        return procs
+
+    def _submit(self, queue_dir, args, results, **kwargs):
+        thread = threading.Thread(target=lambda: results.append(
+            submit(queue_dir, self.wait_script, args, **kwargs)))
+        thread.start()
+        return thread
+
+    def test_slots(self, capfd):
+        queue_dir = os.path.join(self.tmp_dir.name, 'slots')
+        procs = self._start_servers(queue_dir, slots=2)
+        try:
+            # Each request waits for the other, so they must run at once
+            a, b = [os.path.join(self.tmp_dir.name, name) for name in 'ab']
+            results = []
+            threads = [self._submit(queue_dir, ['-w', a, '-c', b], results, max_workers=2),
+                       self._submit(queue_dir, ['-w', b, '-c', a], results, max_workers=2)]
+            for thread in threads:
+                thread.join()
+            assert results == [0, 0]
+            assert len(set(capfd.readouterr().out.split())) == 2
+        finally:
+            for proc in procs:
+                proc.wait()
+
+    def test_busy_timeout(self):
+        queue_dir = os.path.join(self.tmp_dir.name, 'busy')
+        procs = self._start_servers(queue_dir, slots=1)
+        try:
+            # Waiting behind a busy worker does not count toward the timeout
+            never = os.path.join(self.tmp_dir.name, 'never')
+            results = []
+            threads = [self._submit(queue_dir, ['-w', never, '-t', '1.5'], results)]
+            time.sleep(0.2)
+            threads.append(self._submit(queue_dir, [], results, timeout=0.3))
+            for thread in threads:
+                thread.join()
+            assert set(results) == {0, 1}
+        finally:
+            for proc in procs:
+                proc.wait()
+
+    def test_scale(self, monkeypatch):
+        queue_dir = os.path.join(self.tmp_dir.name, 'scale')
+        started = []
+        monkeypatch.setattr(client, 'start_worker',
+                            lambda queue_dir, slot, *args, **kwargs: started.append(slot))
+        os.makedirs(os.path.join(queue_dir, 'running', '0'))
+        os.makedirs(os.path.join(queue_dir, 'requests'))
+        open(os.path.join(queue_dir, 'requests', '0.json'), 'w').close()
+
+        # An idle worker serves the pending request
+        open(os.path.join(queue_dir, 'heartbeat-0'), 'w').close()
+        assert client._scale_workers(queue_dir, 2, '', self.script)
+        assert started == []
+
+        # A busy worker does not, a worker is started in the next slot
+        open(os.path.join(queue_dir, 'running', '0', '1.json'), 'w').close()
+        assert client._scale_workers(queue_dir, 2, '', self.script)
+        assert started == [1]
+        assert client._scale_workers(queue_dir, 1, '', self.script)
+        assert started == [1]
+
+    @classmethod
+    def teardown_class(self):
+        self.tmp_dir.cleanup()